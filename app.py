@@ -1,63 +1,59 @@
+import time
+APP_START = time.perf_counter()
 import sys
 import os
-import shutil
-import difflib
-import hashlib
-from datetime import datetime
 import re
-import json
-import zipfile
-import fnmatch
 import html
+import bisect
+import threading
+from datetime import datetime
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QTreeWidget, QTreeWidgetItem, QFileDialog, QSplitter,
+    QPushButton, QFileDialog, QSplitter,
     QLabel, QTextBrowser, QComboBox, QMessageBox,
-    QInputDialog, QTextEdit, QStyle, QLineEdit, QTreeWidgetItemIterator,
-    QSystemTrayIcon, QMenu, QDialog, QDialogButtonBox, QStatusBar
+    QInputDialog, QTextEdit, QStyle, QLineEdit,
+    QSystemTrayIcon, QMenu, QDialog, QDialogButtonBox, QStatusBar, QTreeView, QListView,
+    QListWidget, QListWidgetItem, QProgressDialog, QSpinBox, QFormLayout
+)
+from PyQt5.QtCore import (
+    Qt, QTimer, QSize, QThread, QObject, pyqtSignal,
+    QAbstractItemModel, QAbstractListModel, QModelIndex, QSortFilterProxyModel
+)
+from PyQt5.QtGui import QIcon
+
+from bkpr_core import (
+    IGNORE_FILE_PATH, STARTUP_LOG_PATH, STARTUP_REPORT_KEY, METRICS_LOG_PATH, METRICS_LOG_INTERVAL_MS, EVENT_FLUSH_INTERVAL_MS, RECONCILE_INTERVAL_MS, RECONCILE_KEY,
+    PRUNE_KEY, MIGRATE_KEY, REBUILD_INDEX_KEY, PRUNE_INTERVAL_MS, RETENTION_FIELDS, DIFF_PAGE_ROWS, SEARCH_RESULT_LIMIT, SEARCH_INDEX_KEY,
+    CONTENT_HASH, ARCHIVE_MANIFEST, TEXT_EXTENSIONS, IMAGE_EXTENSIONS,
+    snapshot_index, hash_service, metrics, HashService, Tracker, JobQueue, FileWatcher, TextDiff, ArchiveCancelled,
+    set_snapshot_note, snapshot_exists, snapshot_content_path, snapshot_digest, snapshot_size,
+    rename_snapshot_entry, delete_snapshot_entry, is_valid_snapshot_name, migrate_all_snapshots, gc_blobs, index_pending_snapshot_contents,
+    prune_snapshots, export_archive, import_archive, format_snap_time, get_image_preview, copy_file,
+    import_time_report, format_startup_report
 )
-from PyQt5.QtCore import Qt, QTimer, QSize, QThread, pyqtSignal
-from PyQt5.QtGui import QImage, QPixmap, QIcon
-
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-
-from PIL import Image
 
 def resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
-def get_documents_dir():
-    import os
-    from pathlib import Path
-    if os.name == "nt":
-        try:
-            import ctypes.wintypes
-            CSIDL_PERSONAL = 5
-            SHGFP_TYPE_CURRENT = 0
-            buf = ctypes.create_unicode_buffer(ctypes.wintypes.MAX_PATH)
-            ctypes.windll.shell32.SHGetFolderPathW(None, CSIDL_PERSONAL, None, SHGFP_TYPE_CURRENT, buf)
-            return buf.value
-        except Exception:
-            return str(Path.home() / "Documents")
-    else:
-        return os.path.join(os.path.expanduser("~"), "Documents")
-
-APP_DATA_BASE = os.path.join(get_documents_dir(), "be-kind-please-rewind")
-SNAPSHOTS_BASE = os.path.join(APP_DATA_BASE, "snapshots")
-os.makedirs(SNAPSHOTS_BASE, exist_ok=True)
-SETTINGS_PATH = os.path.join(APP_DATA_BASE, "settings.json")
-IGNORE_FILE_PATH = os.path.join(APP_DATA_BASE, ".bkprignore")
+FILTER_DELAY_MS = 200
+FILTER_LOAD_LIMIT = 500
+VERSIONS_PAGE_SIZE = 200
+PREVIEW_DELAY_MS = 100
+PREVIEW_CACHE_SIZE = 32
+METRICS_REFRESH_MS = 2000
 
 DARK_STYLESHEET = """
 QWidget { background-color: #2b2b2b; color: #ffffff; font-family: Segoe UI, Arial, sans-serif; font-size: 10pt; }
 QMainWindow { background-color: #2b2b2b; }
-QTreeWidget { background-color: #3c3f41; border: 1px solid #4f5254; border-radius: 4px; padding: 5px; }
-QTreeWidget::item { padding: 5px; }
-QTreeWidget::item:selected { background-color: #0078d7; color: #ffffff; }
+QTreeView, QListView { background-color: #3c3f41; border: 1px solid #4f5254; border-radius: 4px; padding: 5px; }
+QTreeView::item, QListView::item { padding: 5px; }
+QTreeView::item:selected, QListView::item:selected { background-color: #0078d7; color: #ffffff; }
 QHeaderView::section { background-color: #3c3f41; padding: 4px; border: 1px solid #4f5254; }
 QTextBrowser { background-color: #3c3f41; border: 1px solid #4f5254; border-radius: 4px; }
 QPushButton { background-color: #4f5254; border: 1px solid #5f6264; padding: 6px 12px; border-radius: 4px; }
@@ -84,23 +80,6 @@ QLabel#tracked_header, QLabel#preview_header {
 }
 """
 
-DIFF_CSS = """
-<style>
-body { background-color: #3c3f41; color: #f0f0f0; font-family: Consolas, 'Courier New', monospace; margin: 0; padding: 0; }
-.layout-table { width: 100%; border-collapse: collapse; }
-.layout-table td { width: 50%; vertical-align: top; }
-.layout-table td:first-child { border-right: 1px solid #4f5254; }
-.content-table { table-layout: fixed; width: 100%; border-collapse: collapse; font-size: 9.5pt; }
-.content-table th { background-color: #2b2b2b; padding: 5px; text-align: left; font-weight: bold; border-bottom: 2px solid #222; }
-.content-table td { padding: 1px 5px; vertical-align: top; word-wrap: break-word; }
-.lineno { width: 40px; color: #888; text-align: right; padding-right: 10px; -webkit-user-select: none; user-select: none; }
-.diff_add { background-color: #2a472a; }
-.diff_sub { background-color: #582a2a; }
-.empty_row { background-color: #3c3f41; }
-pre { margin: 0; white-space: pre-wrap; }
-</style>
-"""
-
 class ExclusionsDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -109,7 +88,10 @@ class ExclusionsDialog(QDialog):
 
         layout = QVBoxLayout(self)
         
-        info_label = QLabel("add file or folder patterns to exclude (one per line).\nsupports wildcards like `*` and `?`.")
+        info_label = QLabel("add file or folder patterns to exclude (one per line).\n"
+                            "works like .gitignore: `*`, `?` and `**` wildcards, a leading `/` anchors to the tracked folder, "
+                            "a trailing `/` only matches folders and a leading `!` brings something back. "
+                            "full paths start with a drive letter (`C:/temp/*`) or `//` (`//home/me/*.log`).")
         info_label.setWordWrap(True)
         layout.addWidget(info_label)
 
@@ -132,199 +114,574 @@ class ExclusionsDialog(QDialog):
     def get_patterns(self):
         return self.editor.toPlainText()
 
-def hash_file_path(path):
-    return hashlib.sha256(os.path.abspath(path).lower().encode("utf-8")).hexdigest()
+class StartupReportDialog(QDialog):
+    def __init__(self, report, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("startup report")
+        self.setMinimumSize(560, 480)
+        layout = QVBoxLayout(self)
+        info_label = QLabel("how long this start took, and the slowest imports of a fresh start (like `python -X importtime`).")
+        info_label.setWordWrap(True)
+        layout.addWidget(info_label)
+        text = QTextEdit()
+        text.setReadOnly(True)
+        text.setStyleSheet("font-family: Consolas, 'Courier New', monospace;")
+        text.setPlainText(report)
+        layout.addWidget(text)
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
 
-def get_snapshot_dir(file_path):
-    file_id = hash_file_path(file_path)
-    dir_path = os.path.join(SNAPSHOTS_BASE, file_id)
-    os.makedirs(dir_path, exist_ok=True)
-    return dir_path
+class DiagnosticsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("diagnostics")
+        self.setMinimumSize(640, 480)
+        layout = QVBoxLayout(self)
+        self.info_label = QLabel()
+        self.info_label.setWordWrap(True)
+        layout.addWidget(self.info_label)
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setStyleSheet("font-family: Consolas, 'Courier New', monospace;")
+        layout.addWidget(self.text)
+        buttons = QHBoxLayout()
+        reset_btn = QPushButton("reset")
+        reset_btn.clicked.connect(self.reset)
+        export_btn = QPushButton("export json...")
+        export_btn.clicked.connect(self.export_json)
+        buttons.addWidget(reset_btn); buttons.addWidget(export_btn); buttons.addStretch()
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        button_box.rejected.connect(self.reject)
+        buttons.addWidget(button_box)
+        layout.addLayout(buttons)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(METRICS_REFRESH_MS)
+        self.refresh()
+
+    def refresh(self):
+        if metrics.enabled:
+            self.info_label.setText(f"time spent in the hot paths and how busy the file watcher is. a summary is also appended to {METRICS_LOG_PATH} every minute.")
+        else:
+            self.info_label.setText("metrics are off, turn them on with manage > collect performance metrics.")
+        self.text.setPlainText(metrics.format_report())
 
-def get_notes_path(file_path):
-    return os.path.join(get_snapshot_dir(file_path), "notes.json")
+    def reset(self):
+        metrics.reset()
+        self.refresh()
 
-def load_notes(file_path):
-    notes_path = get_notes_path(file_path)
-    if os.path.exists(notes_path):
-        with open(notes_path, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-def save_notes(file_path, notes):
-    notes_path = get_notes_path(file_path)
-    with open(notes_path, 'w') as f:
-        json.dump(notes, f, indent=4)
-
-def current_timestamp():
-    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-
-def make_snapshot_name(orig_name):
-    _, ext = os.path.splitext(orig_name)
-    return f"{current_timestamp()}{ext}"
-
-def save_snapshot(file_path, note=None):
-    if not os.path.exists(file_path): return None, None
-    snapdir = get_snapshot_dir(file_path)
-    snap_name = make_snapshot_name(os.path.basename(file_path))
-    dest = os.path.join(snapdir, snap_name)
-    shutil.copy2(file_path, dest)
-    if note:
-        notes = load_notes(file_path)
-        notes[snap_name] = note
-        save_notes(file_path, notes)
-    return dest, snap_name
-
-def list_snapshots(file_path):
-    snapdir = get_snapshot_dir(file_path)
-    if not os.path.exists(snapdir): return []
-    files = [f for f in os.listdir(snapdir) if f not in ["notes.json", "settings.json"]]
-    def snapkey(f):
-        m = re.search(r'(\d{8}_\d{6}_\d{6})', f)
-        if m:
-            try: return datetime.strptime(m.group(1), "%Y%m%d_%H%M%S_%f")
-            except ValueError: pass
-        return datetime.fromtimestamp(os.path.getmtime(os.path.join(snapdir, f)))
-    return sorted(files, key=snapkey, reverse=True)
-
-def format_snap_time(fname):
-    match = re.match(r'^(.*?)(_?)(\d{8}_\d{6}_\d{6}\..*)$', fname)
-    if not match:
-        return fname
-
-    custom_name, separator, timestamp_part_with_ext = match.groups()
-    
-    ts_match = re.search(r'(\d{8}_\d{6}_\d{6})', timestamp_part_with_ext)
-    if not ts_match:
-        return fname 
-
-    try:
-        dt = datetime.strptime(ts_match.group(1), "%Y%m%d_%H%M%S_%f")
-        time_str = dt.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    except ValueError:
-        return fname
-
-    if custom_name:
-        return f"{custom_name} ({time_str})"
-    else:
-        return time_str
-
-def get_text_diff(snap, curr):
-    try:
-        with open(snap, encoding="utf-8", errors="ignore") as f: left = f.readlines()
-        with open(curr, encoding="utf-8", errors="ignore") as f: right = f.readlines()
-    except Exception as e:
-        return f"<pre>could not read files: {e}</pre>"
-
-    left = [html.escape(line) for line in left]
-    right = [html.escape(line) for line in right]
-
-    seq = difflib.SequenceMatcher(None, left, right)
-    l, r = ['<table class="content-table"><tr><th>&nbsp;</th><th>selected version</th></tr>'], ['<table class="content-table"><tr><th>&nbsp;</th><th>current file</th></tr>']
-    for opcode, i1,i2, j1,j2 in seq.get_opcodes():
-        if opcode == "equal":
-            for i, j in zip(range(i1,i2), range(j1,j2)):
-                l.append(f'<tr><td class="lineno">{i+1}</td><td><pre>{left[i]}</pre></td></tr>')
-                r.append(f'<tr><td class="lineno">{j+1}</td><td><pre>{right[j]}</pre></td></tr>')
-        elif opcode == "replace":
-            for i in range(i2-i1): l.append(f'<tr class="diff_sub"><td class="lineno">{i1+i+1}</td><td><pre>{left[i1+i]}</pre></td></tr>')
-            for j in range(j2-j1): r.append(f'<tr class="diff_add"><td class="lineno">{j1+j+1}</td><td><pre>{right[j1+j]}</pre></td></tr>')
-            diff = (i2-i1) - (j2-j1)
-            if diff > 0:
-                for _ in range(diff): r.append('<tr class="empty_row"><td class="lineno">&nbsp;</td><td>&nbsp;</td></tr>')
-            elif diff < 0:
-                for _ in range(-diff): l.append('<tr class="empty_row"><td class="lineno">&nbsp;</td><td>&nbsp;</td></tr>')
-        elif opcode == "delete":
-            for i in range(i1, i2):
-                l.append(f'<tr class="diff_sub"><td class="lineno">{i+1}</td><td><pre>{left[i]}</pre></td></tr>')
-                r.append('<tr class="empty_row"><td class="lineno">&nbsp;</td><td>&nbsp;</td></tr>')
-        elif opcode == "insert":
-            for j in range(j1, j2):
-                r.append(f'<tr class="diff_add"><td class="lineno">{j+1}</td><td><pre>{right[j]}</pre></td></tr>')
-                l.append('<tr class="empty_row"><td class="lineno">&nbsp;</td><td>&nbsp;</td></tr>')
-    l.append('</table>'); r.append('</table>')
-    return DIFF_CSS + f'<table class="layout-table"><tr><td>{"".join(l)}</td><td>{"".join(r)}</td></tr></table>'
-
-def get_image_preview(image_path):
-    try:
-        img = Image.open(image_path)
-        img.thumbnail((256, 256))
-        img = img.convert("RGBA")
-        data = img.tobytes("raw", "RGBA")
-        qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-        return QPixmap.fromImage(qimg)
-    except Exception: return None
-
-def get_latest_snapshot(file_path):
-    snaps = list_snapshots(file_path)
-    if not snaps: return None
-    return os.path.join(get_snapshot_dir(file_path), snaps[0])
-
-class ChangeHandler(FileSystemEventHandler):
-    def __init__(self, callback):
-        super().__init__()
-        self.callback = callback
+    def export_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, "export metrics", f"bkpr_metrics_{datetime.now():%Y%m%d_%H%M%S}.json", "JSON Files (*.json)")
+        if not path: return
+        try:
+            metrics.export_json(path)
+        except OSError as e:
+            QMessageBox.warning(self, "export failed", f"could not write {path}: {e}")
 
-    def on_modified(self, event):
-        if not event.is_directory:
-            self.callback(event.src_path)
+class SearchDialog(QDialog):
+    result_chosen = pyqtSignal(str, str, int)
 
-    def on_created(self, event):
-        if not event.is_directory:
-            self.callback(event.src_path)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("search snapshot contents")
+        self.setMinimumSize(500, 400)
 
-class WatcherThread(QThread):
-    file_changed = pyqtSignal(str)
-    def __init__(self, paths):
+        layout = QVBoxLayout(self)
+
+        info_label = QLabel("words match anywhere inside a word, \"quoted text\" matches a phrase. "
+                            "every word or phrase has to be in the same version.")
+        info_label.setWordWrap(True)
+        layout.addWidget(info_label)
+
+        self.query_box = QLineEdit(); self.query_box.setPlaceholderText("search all versions of all tracked files...")
+        self.query_box.textChanged.connect(lambda _: self.search_timer.start())
+        self.query_box.returnPressed.connect(self.run_search)
+        layout.addWidget(self.query_box)
+        self.search_timer = QTimer(self); self.search_timer.setSingleShot(True); self.search_timer.setInterval(FILTER_DELAY_MS)
+        self.search_timer.timeout.connect(self.run_search)
+
+        self.results_list = QListWidget()
+        self.results_list.itemActivated.connect(self.open_result)
+        layout.addWidget(self.results_list)
+        self.summary_label = QLabel("")
+        layout.addWidget(self.summary_label)
+
+    def run_search(self):
+        self.search_timer.stop()
+        self.results_list.clear()
+        query = self.query_box.text().strip()
+        if not query:
+            self.summary_label.setText("")
+            return
+        started = time.perf_counter()
+        results = snapshot_index.search(query)
+        elapsed = (time.perf_counter() - started) * 1000
+        for r in results:
+            lines = ", ".join(str(n) for n in r["lines"][:5]) + (" ..." if len(r["lines"]) > 5 else "")
+            item = QListWidgetItem(f"{os.path.basename(r['path'])}  -  {format_snap_time(r['name'])}  -  line {lines}")
+            item.setToolTip(r["path"])
+            item.setData(Qt.UserRole, (r["path"], r["name"], r["lines"][0] if r["lines"] else 0))
+            self.results_list.addItem(item)
+        more = " (showing the newest)" if len(results) >= SEARCH_RESULT_LIMIT else ""
+        self.summary_label.setText(f"{len(results)} matching versions{more} in {elapsed:.0f} ms")
+
+    def open_result(self, item):
+        path, name, line = item.data(Qt.UserRole)
+        self.result_chosen.emit(path, name, line)
+
+class RetentionDialog(QDialog):
+    def __init__(self, path, policy, preview, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("retention policy")
+        self.setMinimumSize(420, 300)
+        self.preview = preview
+
+        layout = QVBoxLayout(self)
+        info_label = QLabel(f"thin out old automatic snapshots of {os.path.basename(path) or path}. 0 turns a rule off. "
+                            "the newest snapshot, named snapshots and snapshots with a note you wrote are always kept, automatic ones can go.")
+        info_label.setWordWrap(True)
+        layout.addWidget(info_label)
+
+        form = QFormLayout()
+        self.fields = {}
+        for key, label in RETENTION_FIELDS:
+            box = QSpinBox(); box.setRange(0, 1000000); box.setValue(int(policy.get(key, 0)))
+            self.fields[key] = box
+            form.addRow(label, box)
+        layout.addLayout(form)
+
+        self.preview_label = QLabel("")
+        self.preview_label.setWordWrap(True)
+        preview_btn = QPushButton("preview (dry run)"); preview_btn.clicked.connect(self.show_preview)
+        layout.addWidget(preview_btn); layout.addWidget(self.preview_label)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Cancel)
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def get_policy(self):
+        return {key: box.value() for key, box in self.fields.items() if box.value()}
+
+    def show_preview(self):
+        summary = self.preview(self.get_policy())
+        self.preview_label.setText(f"would delete {summary['snapshots']} snapshot(s) of {summary['files']} file(s) "
+                                   f"and free about {summary['bytes'] / (1024 * 1024):.2f} mb.")
+
+class BaselineThread(QThread):
+    progress = pyqtSignal(int, int)
+    def __init__(self, tracker):
         super().__init__()
-        self.paths = paths
-        self.observer = Observer()
+        self.tracker = tracker
+        self.scanned = set()
+        self.completed = False
+    def run(self):
+        scanned = self.tracker.scan_baseline(self.isInterruptionRequested, self.progress.emit)
+        if scanned is None: return
+        self.scanned = scanned
+        self.completed = True
+    def stop(self): self.requestInterruption()
+
+class ArchiveThread(QThread):
+    progress = pyqtSignal(int, int)
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.error = None
+        self.was_cancelled = False
     def run(self):
-        handler = ChangeHandler(self.file_changed.emit)
-        unique_dirs = set()
-        for p in self.paths:
-            if os.path.isdir(p):
-                unique_dirs.add(p)
-            elif os.path.isfile(p):
-                unique_dirs.add(os.path.dirname(p))
-
-        for d in unique_dirs:
-             self.observer.schedule(handler, d, recursive=True)
-
-        self.observer.start()
         try:
-            while not self.isInterruptionRequested(): self.msleep(200)
-        finally:
-            self.observer.stop()
-            self.observer.join()
+            self.result = self.fn(*self.args, progress=self.progress.emit, cancelled=self.isInterruptionRequested)
+        except ArchiveCancelled:
+            self.was_cancelled = True
+        except Exception as e:
+            self.error = str(e)
     def stop(self): self.requestInterruption()
 
+class TreeNode:
+    __slots__ = ("path", "name", "is_dir", "parent", "children", "row")
+    def __init__(self, path, name, is_dir, parent):
+        self.path = path
+        self.name = name
+        self.is_dir = is_dir
+        self.parent = parent
+        self.children = [] if not is_dir else None
+        self.row = 0
+
+    def sort_key(self):
+        return (not self.is_dir, self.name.lower())
+
+class TrackedItemsModel(QAbstractItemModel):
+    # folder contents are only listed when a folder is expanded, and changes are applied as row deltas
+    def __init__(self, is_ignored, dir_icon, file_icon, parent=None):
+        super().__init__(parent)
+        self.is_ignored = is_ignored
+        self.dir_icon = dir_icon
+        self.file_icon = file_icon
+        self.root = TreeNode("", "", False, None)
+        self.nodes = {}
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        children = self.node(parent).children
+        if column != 0 or not children or row < 0 or row >= len(children): return QModelIndex()
+        return self.createIndex(row, 0, children[row])
+
+    def parent(self, index):
+        if not index.isValid(): return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root: return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0: return 0
+        return len(self.node(parent).children or ())
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if node.children is None: return node.is_dir
+        return bool(node.children)
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return node.is_dir and node.children is None
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if node.children is not None: return
+        children = []
+        try:
+            with os.scandir(node.path) as entries:
+                for entry in entries:
+                    try: is_dir = entry.is_dir()
+                    except OSError: continue
+                    if not self.is_ignored(entry.path, is_dir):
+                        children.append(TreeNode(entry.path, entry.name, is_dir, node))
+        except OSError:
+            pass
+        children.sort(key=TreeNode.sort_key)
+        if not children:
+            node.children = []
+            return
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        node.children = children
+        for row, child in enumerate(children):
+            child.row = row
+            self.nodes[child.path] = child
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole: return node.name
+        if role == Qt.DecorationRole: return self.dir_icon if node.is_dir else self.file_icon
+        if role == Qt.ToolTipRole: return node.path
+        if role == Qt.UserRole: return node.path
+        return None
+
+    def index_for_path(self, path):
+        node = self.nodes.get(path)
+        if node is None: return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def is_top_level(self, index):
+        return index.isValid() and index.internalPointer().parent is self.root
+
+    def set_roots(self, paths):
+        wanted = {p: os.path.isdir(p) for p in paths}
+        for node in [n for n in self.root.children if n.path not in wanted or wanted[n.path] != n.is_dir]:
+            self.remove_node(node)
+        existing = {n.path for n in self.root.children}
+        for path, is_dir in wanted.items():
+            if path not in existing:
+                self.insert_node(self.root, TreeNode(path, os.path.basename(path) or path, is_dir, self.root))
+
+    def reset_roots(self, paths):
+        self.beginResetModel()
+        self.root.children = []
+        self.nodes = {}
+        self.endResetModel()
+        self.set_roots(paths)
+
+    def insert_node(self, parent, node):
+        keys = [c.sort_key() for c in parent.children]
+        row = bisect.bisect_left(keys, node.sort_key())
+        parent_index = QModelIndex() if parent is self.root else self.createIndex(parent.row, 0, parent)
+        self.beginInsertRows(parent_index, row, row)
+        parent.children.insert(row, node)
+        for i in range(row, len(parent.children)): parent.children[i].row = i
+        self.nodes[node.path] = node
+        self.endInsertRows()
+
+    def remove_node(self, node):
+        parent = node.parent
+        parent_index = QModelIndex() if parent is self.root else self.createIndex(parent.row, 0, parent)
+        self.beginRemoveRows(parent_index, node.row, node.row)
+        del parent.children[node.row]
+        for i in range(node.row, len(parent.children)): parent.children[i].row = i
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if self.nodes.get(n.path) is n: del self.nodes[n.path]
+            stack.extend(n.children or ())
+        self.endRemoveRows()
+
+    def add_path(self, path):
+        if path in self.nodes: return
+        parent_path = os.path.dirname(path)
+        while parent_path not in self.nodes:
+            # the file sits in a folder we have not shown yet, add the topmost missing folder instead
+            if os.path.dirname(parent_path) == parent_path: return
+            path, parent_path = parent_path, os.path.dirname(parent_path)
+            if path in self.nodes: return
+        parent = self.nodes[parent_path]
+        if parent.children is None: return
+        self.insert_node(parent, TreeNode(path, os.path.basename(path), os.path.isdir(path), parent))
+
+    def remove_path(self, path):
+        node = self.nodes.get(path)
+        # take folders that disappeared along with the file out too
+        while node is not None and node.parent is not self.root:
+            parent = node.parent
+            self.remove_node(node)
+            node = parent if not os.path.exists(parent.path) else None
+
+    def ensure_loaded(self, path):
+        # load every folder between a tracked root and path, so filtering can find it
+        chain = []
+        parent_path = os.path.dirname(path)
+        while parent_path not in self.nodes:
+            if os.path.dirname(parent_path) == parent_path: return
+            chain.append(parent_path)
+            parent_path = os.path.dirname(parent_path)
+        chain.append(parent_path)
+        for folder in reversed(chain):
+            node = self.nodes.get(folder)
+            if node is None: return
+            if node.children is None: self.fetchMore(self.createIndex(node.row, 0, node))
+
+class SnapshotListModel(QAbstractListModel):
+    # rows are pulled from the index a page at a time as the list scrolls, and formatted when painted
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file_path = None
+        self.filter_text = ""
+        self.rows = []
+        self.exhausted = True
+        self.display_cache = {}
+
+    def set_file(self, file_path, filter_text=""):
+        self.beginResetModel()
+        self.file_path = file_path
+        self.filter_text = filter_text
+        self.rows = []
+        self.exhausted = file_path is None
+        self.display_cache = {}
+        self.endResetModel()
+
+    def set_filter(self, filter_text):
+        self.set_file(self.file_path, filter_text)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.exhausted: return
+        after = (self.rows[-1][2], self.rows[-1][0]) if self.rows else None
+        page = snapshot_index.page(self.file_path, self.filter_text, after, VERSIONS_PAGE_SIZE)
+        if len(page) < VERSIONS_PAGE_SIZE: self.exhausted = True
+        if not page: return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows): return None
+        name, note, _ = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            display = self.display_cache.get(name)
+            if display is None: display = self.display_cache[name] = format_snap_time(name)
+            return display
+        if role == Qt.ToolTipRole: return note if note else name
+        if role == Qt.UserRole + 1: return self.file_path
+        if role == Qt.UserRole + 2: return name
+        return None
+
+    def update_note(self, name, note):
+        for i, row in enumerate(self.rows):
+            if row[0] == name:
+                self.rows[i] = (name, note, row[2])
+                self.dataChanged.emit(self.index(i), self.index(i))
+                return
+
+    def row_for_name(self, name):
+        row = 0
+        while True:
+            for i in range(row, len(self.rows)):
+                if self.rows[i][0] == name: return i
+            if self.exhausted: return -1
+            row = len(self.rows)
+            self.fetchMore()
+
+class SnapshotExecutor(QObject):
+    # the core job queue, with its callbacks turned into signals so results arrive on the gui thread
+    job_finished = pyqtSignal(str, object)
+    job_failed = pyqtSignal(str, str)
+    status_changed = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = JobQueue(self.job_finished.emit, self.job_failed.emit, self.status_changed.emit)
+
+    def submit(self, path, kind, fn, *args, coalesce=False):
+        return self.queue.submit(path, kind, fn, *args, coalesce=coalesce)
+
+    def shutdown(self):
+        self.queue.shutdown()
+
+class WatchSignals(QObject):
+    # watchdog reports on its own threads, these hop the events over to the gui thread
+    file_changed = pyqtSignal(str)
+    file_moved = pyqtSignal(str, str)
+
+class PreviewWorker(QObject):
+    preview_ready = pyqtSignal(int, object)
+
+    def __init__(self, cache_size=PREVIEW_CACHE_SIZE, parent=None):
+        super().__init__(parent)
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bkpr-preview")
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    # only the newest request is worth computing, older ones are skipped once they reach the worker
+    def request(self, orig_path, snap_name, hasher):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        self.pool.submit(self.run, generation, orig_path, snap_name, hasher)
+        return generation
+
+    def cancel(self):
+        with self.lock: self.generation += 1
+
+    def is_current(self, generation):
+        with self.lock: return generation == self.generation
+
+    def run(self, generation, orig_path, snap_name, hasher):
+        if not self.is_current(generation): return
+        try:
+            result = self.build(orig_path, snap_name, hasher)
+        except Exception as e:
+            result = ("error", str(e))
+        if self.is_current(generation):
+            self.preview_ready.emit(generation, result)
+
+    def build(self, orig_path, snap_name, hasher):
+        ext = os.path.splitext(snap_name)[1].lower()
+        key = None
+        if ext in TEXT_EXTENSIONS and os.path.exists(orig_path):
+            key = (snapshot_digest(orig_path, snap_name), hasher(orig_path))
+            if key[0] and key[1]:
+                with self.lock:
+                    diff = self.cache.get(key)
+                    if diff is not None:
+                        self.cache.move_to_end(key)
+                        return ("diff", diff)
+        version_path = snapshot_content_path(orig_path, snap_name)
+        if not version_path or not os.path.exists(version_path):
+            return ("missing", None)
+        if ext in TEXT_EXTENSIONS:
+            diff = TextDiff(version_path, orig_path)
+            if key and key[0] and key[1] and diff.error is None:
+                with self.lock:
+                    self.cache[key] = diff
+                    while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+            return ("diff", diff)
+        if ext in IMAGE_EXTENSIONS:
+            snap_digest = snapshot_digest(orig_path, snap_name)
+            snap_thumb = get_image_preview(version_path, snap_digest)
+            curr_digest = hasher(orig_path) if os.path.exists(orig_path) else None
+            curr_thumb = get_image_preview(orig_path, curr_digest) if curr_digest else (None, None)
+            return ("image", {"snap": snap_thumb, "snap_bytes": os.path.getsize(version_path),
+                              "current": curr_thumb, "current_bytes": os.path.getsize(orig_path) if curr_digest else 0,
+                              "same": hash_service.algorithm == CONTENT_HASH and snap_digest == curr_digest})
+        return ("binary", os.path.getsize(version_path))
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # benchmark: quit as soon as startup is done and print the timings, for bench_startup.py
+    def __init__(self, benchmark=False):
         super().__init__()
         icon_path = resource_path('bkpr.ico')
         icon = QIcon(icon_path)
         self.setWindowTitle("be kind, please rewind")
         self.setGeometry(100, 100, 1400, 900)
         self.setWindowIcon(icon)
-        self.tracked_paths = [] 
-        self.file_hashes = {} 
-        self.watcher_thread = None
+        self.tracker = Tracker(self.submit_snapshot_job)
+        self.watch_signals = WatchSignals(self)
+        self.watch_signals.file_changed.connect(self.on_file_event)
+        self.watch_signals.file_moved.connect(self.on_file_moved)
+        self.file_watcher = FileWatcher(self.watch_signals.file_changed.emit, self.watch_signals.file_moved.emit)
         self.poll_timer = QTimer(self)
         self.poll_timer.timeout.connect(self.poll_files)
-        self.notes = {}
+        self.event_timer = QTimer(self)
+        self.event_timer.setInterval(EVENT_FLUSH_INTERVAL_MS)
+        self.event_timer.timeout.connect(self.flush_file_events)
+        self.reconcile_timer = QTimer(self)
+        self.reconcile_timer.timeout.connect(self.poll_files)
+        self.prune_timer = QTimer(self)
+        self.prune_timer.timeout.connect(self.prune_now)
+        self.prune_timer.start(PRUNE_INTERVAL_MS)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics_status)
+        self.metrics_log_timer = QTimer(self)
+        self.metrics_log_timer.timeout.connect(metrics.write_log)
+        self.snapshot_executor = SnapshotExecutor(parent=self)
+        self.snapshot_executor.job_finished.connect(self.on_snapshot_job_finished)
+        self.snapshot_executor.job_failed.connect(self.on_snapshot_job_failed)
+        self.snapshot_executor.status_changed.connect(self.update_queue_status)
+        self.preview_worker = PreviewWorker(parent=self)
+        self.preview_worker.preview_ready.connect(self.on_preview_ready)
+        self.preview_generation = 0
+        self.preview_request = (None, None)
+        self.preview_focus = None
+        self.search_dialog = None
+        self.archive_thread = None
+        self.archive_progress = None
+        self.preview_timer = QTimer(self); self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.request_preview)
         self.is_quitting = False
         self.is_paused = False
-        self.ignore_patterns = []
+        self.current_diff = None
+        self.diff_expanded = set()
+        self.diff_rows = DIFF_PAGE_ROWS
         self.icon = icon
         self.icon_path = icon_path
+        self.baseline_thread = None
+        self.baseline_started = 0
+        self.startup_timings = {}
+        self.benchmark = benchmark
         self.init_ui()
         self.init_tray_icon()
         self.load_ignore_patterns()
         self.load_settings()
+        QTimer.singleShot(0, self.start_tracking)
 
     def init_ui(self):
         main = QWidget(); layout = QVBoxLayout(main); self.setCentralWidget(main)
@@ -346,9 +703,42 @@ class MainWindow(QMainWindow):
         manage_menu = QMenu(self)
         import_action = manage_menu.addAction("import snapshots...")
         import_action.triggered.connect(self.import_snapshots)
-        self.export_action = manage_menu.addAction("export snapshots for selected file...")
+        self.export_action = manage_menu.addAction("export snapshots for selected item...")
         self.export_action.triggered.connect(self.export_snapshots)
         self.export_action.setEnabled(False)
+        export_all_action = manage_menu.addAction("export all snapshots...")
+        export_all_action.triggered.connect(lambda: self.export_snapshots(export_all=True))
+        manage_menu.addSeparator()
+        self.retention_action = manage_menu.addAction("retention policy for selected item...")
+        self.retention_action.triggered.connect(self.edit_retention_policy)
+        self.retention_action.setEnabled(False)
+        prune_action = manage_menu.addAction("prune old snapshots now")
+        prune_action.triggered.connect(lambda: self.prune_now(manual=True))
+        prune_preview_action = manage_menu.addAction("show what pruning would remove")
+        prune_preview_action.triggered.connect(lambda: self.prune_now(dry_run=True))
+        manage_menu.addSeparator()
+        migrate_action = manage_menu.addAction("move old snapshots to shared storage")
+        migrate_action.triggered.connect(self.migrate_snapshots)
+        rebuild_index_action = manage_menu.addAction("rebuild snapshot index")
+        rebuild_index_action.triggered.connect(self.rebuild_snapshot_index)
+        self.delta_action = manage_menu.addAction("compress text snapshots")
+        self.delta_action.setCheckable(True)
+        self.delta_action.toggled.connect(self.toggle_delta_storage)
+        self.polling_action = manage_menu.addAction("poll for changes (network drives)")
+        self.polling_action.setCheckable(True)
+        self.polling_action.toggled.connect(self.toggle_watch_polling)
+        settle_action = manage_menu.addAction("write settle time...")
+        settle_action.triggered.connect(self.change_settle_time)
+        hash_action = manage_menu.addAction("change detection hash...")
+        hash_action.triggered.connect(self.change_hash_algorithm)
+        manage_menu.addSeparator()
+        startup_report_action = manage_menu.addAction("startup report...")
+        startup_report_action.triggered.connect(self.show_startup_report)
+        self.metrics_action = manage_menu.addAction("collect performance metrics")
+        self.metrics_action.setCheckable(True)
+        self.metrics_action.toggled.connect(self.toggle_metrics)
+        diagnostics_action = manage_menu.addAction("diagnostics...")
+        diagnostics_action.triggered.connect(self.show_diagnostics)
         self.manage_menu_btn.setMenu(manage_menu)
 
         self.snapshot_menu_btn = QPushButton("snapshot...")
@@ -366,6 +756,7 @@ class MainWindow(QMainWindow):
         self.snapshot_menu_btn.setEnabled(False)
 
         self.exclusions_btn = QPushButton("edit exclusions"); self.exclusions_btn.clicked.connect(self.open_exclusions_editor)
+        self.search_btn = QPushButton("search contents"); self.search_btn.clicked.connect(self.open_search)
         
         self.pause_btn = QPushButton("pause tracking", self)
         self.pause_btn.setObjectName("pause_btn")
@@ -378,16 +769,25 @@ class MainWindow(QMainWindow):
         top.addWidget(self.actions_menu_btn)
         top.addWidget(self.manage_menu_btn)
         top.addWidget(self.snapshot_menu_btn)
-        top.addWidget(self.exclusions_btn); top.addStretch()
+        top.addWidget(self.exclusions_btn); top.addWidget(self.search_btn); top.addStretch()
         top.addWidget(QLabel("tracking frequency:"))
         top.addWidget(self.freq_combo)
         top.addWidget(self.pause_btn)
 
         files_panel = QWidget(); files_layout = QVBoxLayout(files_panel); files_layout.setContentsMargins(0,0,0,0)
         files_layout.addWidget(QLabel("tracked items", objectName="tracked_header"))
-        self.file_search_box = QLineEdit(); self.file_search_box.setPlaceholderText("search tracked items..."); self.file_search_box.textChanged.connect(self.filter_files_tree)
+        self.file_search_box = QLineEdit(); self.file_search_box.setPlaceholderText("search tracked items..."); self.file_search_box.textChanged.connect(self.schedule_files_filter)
         files_layout.addWidget(self.file_search_box)
-        self.files_tree = QTreeWidget(); self.files_tree.setHeaderHidden(True); self.files_tree.itemClicked.connect(self.on_item_selected)
+        self.files_filter_timer = QTimer(self); self.files_filter_timer.setSingleShot(True); self.files_filter_timer.setInterval(FILTER_DELAY_MS)
+        self.files_filter_timer.timeout.connect(lambda: self.filter_files_tree(self.file_search_box.text()))
+        self.files_model = TrackedItemsModel(self.tracker.is_path_ignored, self.style().standardIcon(QStyle.SP_DirIcon), self.style().standardIcon(QStyle.SP_FileIcon), self)
+        self.files_proxy = QSortFilterProxyModel(self)
+        self.files_proxy.setSourceModel(self.files_model)
+        self.files_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.files_proxy.setRecursiveFilteringEnabled(True)
+        self.files_tree = QTreeView(); self.files_tree.setHeaderHidden(True); self.files_tree.setUniformRowHeights(True)
+        self.files_tree.setModel(self.files_proxy)
+        self.files_tree.selectionModel().currentChanged.connect(self.on_item_selected)
         files_layout.addWidget(self.files_tree)
 
         versions_panel = QWidget(); versions_layout = QVBoxLayout(versions_panel)
@@ -401,9 +801,14 @@ class MainWindow(QMainWindow):
         versions_layout.addLayout(versions_header_layout)
 
 
-        self.version_search_box = QLineEdit(); self.version_search_box.setPlaceholderText("search versions..."); self.version_search_box.textChanged.connect(self.filter_versions_list)
+        self.version_search_box = QLineEdit(); self.version_search_box.setPlaceholderText("search versions..."); self.version_search_box.textChanged.connect(lambda _: self.versions_filter_timer.start())
         versions_layout.addWidget(self.version_search_box)
-        self.versions_list = QTreeWidget(); self.versions_list.setHeaderHidden(True); self.versions_list.itemClicked.connect(self.on_version_selected)
+        self.versions_filter_timer = QTimer(self); self.versions_filter_timer.setSingleShot(True); self.versions_filter_timer.setInterval(FILTER_DELAY_MS)
+        self.versions_filter_timer.timeout.connect(lambda: self.filter_versions_list(self.version_search_box.text()))
+        self.versions_model = SnapshotListModel(self)
+        self.versions_list = QListView(); self.versions_list.setUniformItemSizes(True)
+        self.versions_list.setModel(self.versions_model)
+        self.versions_list.selectionModel().currentChanged.connect(self.on_version_selected)
         versions_layout.addWidget(self.versions_list)
         
         notes_panel = QVBoxLayout(); notes_panel.addWidget(QLabel("snapshot note", objectName="header"))
@@ -414,7 +819,8 @@ class MainWindow(QMainWindow):
 
         preview_panel = QWidget(); preview_layout = QVBoxLayout(preview_panel); preview_layout.setContentsMargins(0,0,0,0)
         preview_layout.addWidget(QLabel("preview / diff", objectName="preview_header"))
-        self.preview_box = QTextBrowser(); self.preview_box.setOpenExternalLinks(False)
+        self.preview_box = QTextBrowser(); self.preview_box.setOpenExternalLinks(False); self.preview_box.setOpenLinks(False)
+        self.preview_box.anchorClicked.connect(self.on_preview_link)
         preview_layout.addWidget(self.preview_box)
 
         splitter = QSplitter(Qt.Horizontal)
@@ -427,6 +833,12 @@ class MainWindow(QMainWindow):
         self.statusBar().showMessage(" ")
         self.pause_status_label = QLabel("tracking paused")
         self.pause_status_label.setObjectName("pause_status")
+        self.queue_status_label = QLabel("")
+        self.statusBar().addPermanentWidget(self.queue_status_label)
+        self.queue_status_label.hide()
+        self.metrics_status_label = QLabel("")
+        self.statusBar().addPermanentWidget(self.metrics_status_label)
+        self.metrics_status_label.hide()
 
     def init_tray_icon(self):
         if not QSystemTrayIcon.isSystemTrayAvailable():
@@ -445,6 +857,7 @@ class MainWindow(QMainWindow):
         self.tray_icon.setContextMenu(tray_menu)
         self.tray_icon.activated.connect(self.tray_icon_activated)
         self.tray_icon.show()
+        self.startup_timings["tray_shown_ms"] = (time.perf_counter() - APP_START) * 1000
 
     def tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.Trigger:
@@ -458,13 +871,20 @@ class MainWindow(QMainWindow):
     def quit_application(self):
         self.is_quitting = True
         self.close()
+        # the app stays alive without windows for the tray, so closing the last one does not end it
+        QApplication.instance().quit()
 
-    def on_item_selected(self, item, column):
-        path = item.data(0, Qt.UserRole)
-        is_file = path and os.path.isfile(path)
-        is_top_level = item.parent() is None
+    def selected_tracked_path(self):
+        index = self.files_tree.currentIndex()
+        return index.data(Qt.UserRole) if index.isValid() else None
 
-        self.export_action.setEnabled(is_file)
+    def on_item_selected(self, current, previous=None):
+        path = current.data(Qt.UserRole) if current.isValid() else None
+        is_file = bool(path) and os.path.isfile(path)
+        is_top_level = self.files_model.is_top_level(self.files_proxy.mapToSource(current))
+
+        self.export_action.setEnabled(bool(path))
+        self.retention_action.setEnabled(bool(path) and path in self.tracker.tracked_paths)
         self.remove_action.setEnabled(is_top_level)
         self.take_snapshot_btn.setEnabled(is_file)
 
@@ -476,22 +896,28 @@ class MainWindow(QMainWindow):
         if is_file:
             self.show_versions()
         else:
-            self.versions_list.clear()
-            self.preview_box.clear()
+            self.versions_model.set_file(None)
+            self.cancel_preview(); self.preview_box.clear()
             self.note_edit.clear()
             self.snapshot_menu_btn.setEnabled(False)
             self.save_note_btn.setEnabled(False)
 
-    def on_version_selected(self, item, column):
-        self.show_preview(item)
+    def current_version(self):
+        index = self.versions_list.currentIndex()
+        if not index.isValid(): return None, None
+        return index.data(Qt.UserRole + 1), index.data(Qt.UserRole + 2)
+
+    def on_version_selected(self, current, previous=None):
+        orig_path, snap_name = self.current_version()
+        if not snap_name: return
+        self.show_preview(orig_path, snap_name)
         self.save_note_btn.setEnabled(True)
         self.snapshot_menu_btn.setEnabled(True)
         self.load_note()
         
-        version_path = item.data(0, Qt.UserRole)
-        if version_path and os.path.exists(version_path):
-            file_size = os.path.getsize(version_path)
-            self.statusBar().showMessage(f"snapshot: {os.path.basename(version_path)}  |  size: {file_size / 1024:.2f} kb")
+        if snap_name and snapshot_exists(orig_path, snap_name):
+            file_size = snapshot_size(orig_path, snap_name)
+            self.statusBar().showMessage(f"snapshot: {snap_name}  |  size: {file_size / 1024:.2f} kb")
 
     def open_exclusions_editor(self):
         dialog = ExclusionsDialog(self)
@@ -502,117 +928,170 @@ class MainWindow(QMainWindow):
             self.load_ignore_patterns()
             self.refresh_all_tracking()
 
+    def open_search(self):
+        if self.search_dialog is None:
+            self.search_dialog = SearchDialog(self)
+            self.search_dialog.result_chosen.connect(self.open_search_result)
+        self.search_dialog.show(); self.search_dialog.raise_(); self.search_dialog.activateWindow()
+
+    def open_search_result(self, orig_path, snap_name, line):
+        self.file_search_box.setText("")
+        self.version_search_box.setText(""); self.versions_filter_timer.stop()
+        self.versions_model.set_filter("")
+        if self.selected_tracked_path() != orig_path:
+            self.select_tracked_path(orig_path)
+        if self.selected_tracked_path() != orig_path:
+            self.statusBar().showMessage(f"{orig_path} is no longer tracked.")
+            return
+        self.preview_focus = (orig_path, snap_name, line)
+        self.select_version(snap_name)
+        self.show_preview(orig_path, snap_name)
+
     def add_file(self):
         path, _ = QFileDialog.getOpenFileName(self, "select file to track")
-        if path and path not in self.tracked_paths: self.add_path(path)
+        if path and os.path.normpath(path) not in self.tracker.tracked_paths: self.add_path(path)
 
     def add_folder(self):
         path = QFileDialog.getExistingDirectory(self, "select folder to track")
-        if path and path not in self.tracked_paths: self.add_path(path)
+        if path and os.path.normpath(path) not in self.tracker.tracked_paths: self.add_path(path)
 
     def add_path(self, path):
-        if self.is_path_ignored(path):
+        path = os.path.normpath(path)
+        if self.tracker.is_path_ignored(path):
             QMessageBox.warning(self, "path ignored", "this file or folder cannot be tracked because it matches an exclusion pattern... check your exclusions.")
             return
 
         note, ok = QInputDialog.getText(self, "initial snapshot note", "enter a note for the first snapshot(s) (optional):")
         if not ok: return
-        self.tracked_paths.append(path)
-        if os.path.isfile(path):
-            self.track_new_file(path, note)
-        elif os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                for name in files: self.track_new_file(os.path.join(root, name), note)
+        self.tracker.track(path, note)
         self.update_files_tree()
         self.update_monitoring()
 
-    def track_new_file(self, file_path, note):
-        if self.is_path_ignored(file_path):
-            return
-        save_snapshot(file_path, note)
-        self.file_hashes[file_path] = self.hash_file(file_path)
+    def submit_snapshot_job(self, path, kind, fn, *args, coalesce=False):
+        if not self.snapshot_executor.submit(path, kind, fn, *args, coalesce=coalesce):
+            self.statusBar().showMessage(f"snapshot queue is full, skipped {os.path.basename(path) or path}. it will be picked up by the next full check.")
+            return False
+        return True
+
+    def on_snapshot_job_finished(self, path, result):
+        if not result: return
+        kind, file_path = result[0], result[1]
+        if kind == "created":
+            self.files_model.add_path(file_path)
+        elif kind == "deleted":
+            self.files_model.remove_path(file_path)
+        elif kind == "changed":
+            if hasattr(self, 'tray_icon'):
+                self.tray_icon.showMessage(
+                    "sum changed",
+                    f"'{os.path.basename(file_path)}' was updated. a new snapshot has been created.",
+                    QSystemTrayIcon.Information,
+                    3000
+                )
+            self.refresh_versions_if_selected(file_path)
+        elif kind == "manual":
+            self.refresh_versions_if_selected(file_path)
+            QMessageBox.information(self, "snapshot created", "a new snapshot has been created successfully.")
+        elif kind == "restored":
+            QMessageBox.information(self, "yay", "file restored successfully.")
+            self.refresh_versions_if_selected(file_path)
+        elif kind == "checked":
+            for r in file_path: self.on_snapshot_job_finished(r[1], r)
+        elif kind == "failed":
+            self.on_snapshot_job_failed(file_path, result[2])
+        elif kind == "pruned":
+            self.on_prune_finished(*result[1:])
+        elif kind == "migrated":
+            self.on_migrate_finished(*result[1:])
+        elif kind == "index rebuilt":
+            self.on_index_rebuilt()
+        elif kind == "purged":
+            self.statusBar().showMessage(f"deleted the snapshots of {file_path}.", 5000)
+        elif kind == "startup report":
+            StartupReportDialog(format_startup_report(self.startup_timings, result[1]), self).exec_()
+        elif kind == "indexed" and file_path:
+            self.statusBar().showMessage(f"indexed {file_path} snapshot versions for search.", 5000)
+
+    def on_snapshot_job_failed(self, path, error):
+        self.statusBar().showMessage(f"sum happened with {os.path.basename(path) or path}: {error}")
+
+    def update_queue_status(self, queued, running):
+        if queued or running:
+            self.queue_status_label.setText(f"snapshots: {running} running, {queued} queued")
+            self.queue_status_label.show()
+        else:
+            self.queue_status_label.hide()
+
+    def toggle_delta_storage(self, enabled):
+        self.tracker.storage_mode = "delta" if enabled else "full"
+        self.save_settings()
 
     def remove_item(self):
-        curr = self.files_tree.currentItem()
-        if not curr or curr.parent() is not None:
+        current = self.files_tree.currentIndex()
+        if not self.files_model.is_top_level(self.files_proxy.mapToSource(current)):
             return
             
-        path = curr.data(0, Qt.UserRole)
+        path = current.data(Qt.UserRole)
         reply = QMessageBox.question(self, "remove item", f"are you sure you want to stop tracking {os.path.basename(path)}?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply != QMessageBox.Yes: return
         
         files_to_purge = []
-        if os.path.isdir(path): files_to_purge.extend(self.get_all_files_in_path(path))
+        if os.path.isdir(path): files_to_purge.extend(self.tracker.get_all_files_in_path(path))
         else: files_to_purge.append(path)
         
+        purge = False
         if files_to_purge:
             reply_del = QMessageBox.question(self, "delete snapshots", "do you also want to delete all associated snapshots?",
                                              QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-            if reply_del == QMessageBox.Yes:
-                for f in files_to_purge: shutil.rmtree(get_snapshot_dir(f), ignore_errors=True)
-
-        if path in self.tracked_paths:
-            self.tracked_paths.remove(path)
-            
-        for f in files_to_purge: self.file_hashes.pop(f, None)
+            purge = reply_del == QMessageBox.Yes
+        self.tracker.untrack(path, purge, files_to_purge)
         
         self.update_files_tree()
-        self.versions_list.clear(); self.preview_box.clear(); self.note_edit.clear()
+        self.versions_model.set_file(None); self.cancel_preview(); self.preview_box.clear(); self.note_edit.clear()
         self.remove_action.setEnabled(False); self.export_action.setEnabled(False)
         self.snapshot_menu_btn.setEnabled(False); self.save_note_btn.setEnabled(False)
         self.statusBar().showMessage(" ")
         self.update_monitoring()
 
     def update_files_tree(self):
-        current_selection = None
-        if self.files_tree.currentItem():
-            current_selection = self.files_tree.currentItem().data(0, Qt.UserRole)
-            
-        self.files_tree.clear()
-        for path in sorted(self.tracked_paths):
-            if self.is_path_ignored(path):
-                continue
-            name = os.path.basename(path)
-            if os.path.isdir(path):
-                parent_item = QTreeWidgetItem(self.files_tree, [name])
-                parent_item.setData(0, Qt.UserRole, path)
-                parent_item.setIcon(0, self.style().standardIcon(QStyle.SP_DirIcon))
-                for f in sorted(self.get_all_files_in_path(path)):
-                    child_item = QTreeWidgetItem(parent_item, [os.path.relpath(f, path)])
-                    child_item.setData(0, Qt.UserRole, f)
-                    child_item.setIcon(0, self.style().standardIcon(QStyle.SP_FileIcon))
-                    if f == current_selection:
-                        self.files_tree.setCurrentItem(child_item)
-            else:
-                item = QTreeWidgetItem(self.files_tree, [name])
-                item.setData(0, Qt.UserRole, path)
-                item.setToolTip(0, path)
-                item.setIcon(0, self.style().standardIcon(QStyle.SP_FileIcon))
-                if path == current_selection:
-                    self.files_tree.setCurrentItem(item)
-
+        with metrics.timed("update_files_tree"):
+            self.files_model.set_roots([p for p in sorted(self.tracker.tracked_paths) if not self.tracker.is_path_ignored(p)])
+
+    def rebuild_files_tree(self):
+        current_selection = self.selected_tracked_path()
+        with metrics.timed("update_files_tree"):
+            self.files_model.reset_roots([p for p in sorted(self.tracker.tracked_paths) if not self.tracker.is_path_ignored(p)])
+        if current_selection:
+            self.select_tracked_path(current_selection)
         self.filter_files_tree(self.file_search_box.text())
 
+    def select_tracked_path(self, path):
+        self.files_model.ensure_loaded(path)
+        index = self.files_proxy.mapFromSource(self.files_model.index_for_path(path))
+        if index.isValid():
+            self.files_tree.setCurrentIndex(index)
+
+    def schedule_files_filter(self, text):
+        self.files_filter_timer.start()
+
     def filter_files_tree(self, text):
         search_term = text.lower()
-        root = self.files_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            item = root.child(i)
-            is_match = search_term in item.text(0).lower()
-            
-            if item.childCount() > 0:
-                has_visible_child = False
-                for j in range(item.childCount()):
-                    child = item.child(j)
-                    child_is_match = search_term in child.text(0).lower()
-                    child.setHidden(not child_is_match)
-                    if not child.isHidden():
-                        has_visible_child = True
-                item.setHidden(not has_visible_child)
-            else:
-                item.setHidden(not is_match)
-        self.files_tree.expandAll()
+        matches = []
+        if search_term:
+            # folders are loaded lazily, so pull in the folders that hold matching files first
+            for f in list(self.tracker.file_hashes):
+                if search_term in os.path.basename(f).lower():
+                    matches.append(f)
+                    if len(matches) >= FILTER_LOAD_LIMIT: break
+            for f in matches: self.files_model.ensure_loaded(f)
+        self.files_proxy.setFilterFixedString(text)
+        for f in matches:
+            index = self.files_proxy.mapFromSource(self.files_model.index_for_path(f))
+            parent = index.parent()
+            while parent.isValid() and not self.files_tree.isExpanded(parent):
+                self.files_tree.expand(parent)
+                parent = parent.parent()
         
     def toggle_pause_tracking(self, paused):
         self.is_paused = paused
@@ -635,173 +1114,199 @@ class MainWindow(QMainWindow):
         self.style().polish(self.pause_btn)
 
     def stop_monitoring(self):
-        if self.watcher_thread:
-            self.watcher_thread.stop()
-            self.watcher_thread = None
+        self.file_watcher.clear()
         self.poll_timer.stop()
+        self.reconcile_timer.stop()
+        self.event_timer.stop()
+        self.tracker.clear_events()
 
+    # the watcher only adds and drops the watches that changed, so this is cheap to call on every edit
     def update_monitoring(self):
-        self.stop_monitoring()
-        if not self.tracked_paths or self.is_paused:
+        self.poll_timer.stop()
+        if not self.tracker.tracked_paths or self.is_paused:
+            self.stop_monitoring()
             return
         freq = self.freq_combo.currentText()
         if freq == "on change":
-            self.watcher_thread = WatcherThread(self.tracked_paths)
-            self.watcher_thread.file_changed.connect(self.on_file_event)
-            self.watcher_thread.start()
+            self.file_watcher.set_paths(list(self.tracker.tracked_paths), self.tracker.is_path_ignored, self.tracker.watch_polling)
+            if not self.reconcile_timer.isActive(): self.reconcile_timer.start(RECONCILE_INTERVAL_MS)
         else:
+            self.file_watcher.clear()
+            self.reconcile_timer.stop()
             intervals = {"every 30 seconds": 30000, "every 1 minute": 60000, "every 5 minutes": 300000}
             self.poll_timer.start(intervals[freq.lower()])
 
+    def toggle_watch_polling(self, enabled):
+        self.tracker.watch_polling = enabled
+        self.save_settings()
+        self.update_monitoring()
+
+    def toggle_metrics(self, enabled):
+        metrics.enabled = enabled
+        self.save_settings()
+        self.update_metrics_timers()
+
+    def update_metrics_timers(self):
+        if metrics.enabled:
+            self.metrics_timer.start(METRICS_REFRESH_MS)
+            self.metrics_log_timer.start(METRICS_LOG_INTERVAL_MS)
+            self.update_metrics_status()
+        else:
+            self.metrics_timer.stop()
+            self.metrics_log_timer.stop()
+            self.metrics_status_label.hide()
+
+    def update_metrics_status(self):
+        self.metrics_status_label.setText(metrics.summary())
+        self.metrics_status_label.show()
+
+    def show_diagnostics(self):
+        DiagnosticsDialog(self).exec_()
+
     def poll_files(self):
         if self.is_paused: return
-        all_tracked_files = self.get_all_tracked_files()
-        for file_path in all_tracked_files:
-            if not os.path.exists(file_path):
-                if file_path in self.file_hashes:
-                    self.handle_file_deletion(file_path)
-                continue
-
-            current_hash = self.hash_file(file_path)
-            last_hash = self.file_hashes.get(file_path)
-            if last_hash is None:
-                self.handle_file_creation(file_path)
-            elif current_hash and current_hash != last_hash:
-                self.handle_file_change(file_path, current_hash)
+        self.submit_snapshot_job(RECONCILE_KEY, "reconcile", self.tracker.reconcile_files, coalesce=True)
 
     def on_file_event(self, path):
-        if self.is_paused or self.is_path_ignored(path):
+        if self.is_paused:
             return
-        self.poll_files()
-
-    def handle_file_change(self, file_path, new_hash):
-        save_snapshot(file_path, "auto-snapshot on file change")
-        self.file_hashes[file_path] = new_hash
-        if hasattr(self, 'tray_icon'):
-            self.tray_icon.showMessage(
-                "sum changed",
-                f"'{os.path.basename(file_path)}' was updated. a new snapshot has been created.",
-                QSystemTrayIcon.Information,
-                3000
-            )
-        self.refresh_versions_if_selected(file_path)
-
-    def handle_file_creation(self, file_path):
-        self.track_new_file(file_path, "auto-snapshot for new file")
-        self.update_files_tree()
+        self.tracker.note_event(path)
+        if not self.event_timer.isActive():
+            self.event_timer.start()
 
-    def handle_file_deletion(self, file_path):
-        self.file_hashes.pop(file_path, None)
-        self.update_files_tree()
+    def on_file_moved(self, src, dest):
+        if self.is_paused:
+            return
+        self.tracker.note_move(src, dest)
+        if not self.event_timer.isActive():
+            self.event_timer.start()
+
+    def flush_file_events(self):
+        files = self.tracker.settled_events()
+        if not self.tracker.has_pending_events():
+            self.event_timer.stop()
+        if files and not self.is_paused:
+            self.tracker.check_files(files)
+
+    def change_settle_time(self):
+        value, ok = QInputDialog.getInt(self, "write settle time", "wait until a file has not changed for (ms):", self.tracker.settle_ms, 50, 60000, 50)
+        if ok:
+            self.tracker.settle_ms = value
+            self.save_settings()
 
     def refresh_versions_if_selected(self, file_path):
-        current_item = self.files_tree.currentItem()
-        if not current_item: return
-        selected_path = current_item.data(0, Qt.UserRole)
+        selected_path = self.selected_tracked_path()
+        if not selected_path: return
         if selected_path == file_path:
             self.show_versions()
         elif os.path.isdir(selected_path) and file_path.startswith(selected_path):
             self.show_versions()
 
     def show_versions(self):
-        current_item = self.files_tree.currentItem()
-        if not current_item: return
-        file_path = current_item.data(0, Qt.UserRole)
+        file_path = self.selected_tracked_path()
         if not file_path or not os.path.isfile(file_path):
-            self.versions_list.clear()
+            self.versions_model.set_file(None)
             return
             
-        selected_version_path = None
-        if self.versions_list.currentItem():
-            selected_version_path = self.versions_list.currentItem().data(0, Qt.UserRole)
-        self.versions_list.clear()
-        self.preview_box.clear(); self.note_edit.clear()
+        previous_file, selected_snap_name = self.current_version()
+        self.cancel_preview(); self.preview_box.clear(); self.note_edit.clear()
         self.snapshot_menu_btn.setEnabled(False); self.save_note_btn.setEnabled(False)
-        self.notes = load_notes(file_path)
-        versions = list_snapshots(file_path)
-        
-        new_item_to_select = None
-        for v_name in versions:
-            display = format_snap_time(v_name)
-            version_item = QTreeWidgetItem(self.versions_list, [display])
-            note = self.notes.get(v_name, "")
-            tooltip = note if note else v_name
-            version_item.setToolTip(0, tooltip)
-            version_path = os.path.join(get_snapshot_dir(file_path), v_name)
-            version_item.setData(0, Qt.UserRole, version_path)
-            version_item.setData(0, Qt.UserRole + 1, file_path)
-            version_item.setData(0, Qt.UserRole + 2, v_name)
-            if version_path == selected_version_path:
-                new_item_to_select = version_item
-        if new_item_to_select:
-            self.versions_list.setCurrentItem(new_item_to_select)
-        self.filter_versions_list(self.version_search_box.text())
+        self.versions_model.set_file(file_path, self.version_search_box.text())
+        if selected_snap_name and previous_file == file_path:
+            self.select_version(selected_snap_name)
+
+    def select_version(self, snap_name):
+        row = self.versions_model.row_for_name(snap_name)
+        if row >= 0:
+            self.versions_list.setCurrentIndex(self.versions_model.index(row))
 
     def filter_versions_list(self, text):
-        search_term = text.lower()
-        iterator = QTreeWidgetItemIterator(self.versions_list)
-        while iterator.value():
-            item = iterator.value()
-            snap_name = item.data(0, Qt.UserRole + 2)
-            note = self.notes.get(snap_name, "")
-            display_text = item.text(0).lower()
-            is_visible = search_term in display_text or search_term in note.lower()
-            item.setHidden(not is_visible)
-            iterator += 1
-
-    def show_preview(self, item):
-        if not item: return
-        version_path = item.data(0, Qt.UserRole)
-        orig_path = item.data(0, Qt.UserRole + 1)
-        ext = os.path.splitext(version_path)[1].lower()
-        if ext in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.log']:
-            diff_html = get_text_diff(version_path, orig_path)
-            self.preview_box.setHtml(diff_html)
-        elif ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
-            self.preview_box.setHtml(f'<body style="text-align:center;"><img src="file:///{version_path}"><p style="color:white;">{os.path.basename(version_path)}</p></body>')
+        _, selected_snap_name = self.current_version()
+        self.versions_model.set_filter(text)
+        if selected_snap_name:
+            self.select_version(selected_snap_name)
+
+    # selection changes are debounced so scrolling through the list only previews where it stops
+    def show_preview(self, orig_path, snap_name):
+        self.preview_request = (orig_path, snap_name)
+        self.preview_timer.start(PREVIEW_DELAY_MS)
+
+    def request_preview(self):
+        orig_path, snap_name = self.preview_request
+        self.current_diff = None
+        self.preview_generation = self.preview_worker.request(orig_path, snap_name, self.tracker.current_hash)
+
+    def image_comparison_html(self, snap_name, value):
+        def cell(title, thumb, size_bytes):
+            path, dims = thumb
+            if not path:
+                return f'<td style="text-align:center; color:#888;"><p>{title}</p><p>no preview</p></td>'
+            return (f'<td style="text-align:center;"><p style="color:white;">{title}</p><img src="file:///{path}">'
+                    f'<p style="color:#888;">{dims[0]} x {dims[1]}  |  {size_bytes / 1024:.2f} kb</p></td>')
+        same = '<p style="text-align:center; color:#888;">the current file is identical to this version.</p>' if value["same"] else ""
+        return ('<table width="100%"><tr>' + cell(f"selected version: {html.escape(format_snap_time(snap_name))}", value["snap"], value["snap_bytes"])
+                + cell("current file", value["current"], value["current_bytes"]) + '</tr></table>' + same)
+
+    def cancel_preview(self):
+        self.preview_timer.stop()
+        self.preview_worker.cancel()
+        self.current_diff = None
+
+    def on_preview_ready(self, generation, result):
+        if generation != self.preview_generation: return
+        orig_path, snap_name = self.preview_request
+        kind, value = result
+        if kind == "diff":
+            self.current_diff = value
+            self.diff_expanded = set(); self.diff_rows = DIFF_PAGE_ROWS
+            focus = self.preview_focus[2] if self.preview_focus and self.preview_focus[:2] == (orig_path, snap_name) else None
+            self.preview_focus = None
+            self.preview_box.setHtml(self.current_diff.render(self.diff_expanded, self.diff_rows, focus=focus))
+            if focus: self.preview_box.scrollToAnchor("focus")
+        elif kind == "image":
+            self.preview_box.setHtml(self.image_comparison_html(snap_name, value))
+        elif kind == "binary":
+            self.preview_box.setText(f"no preview available.\n\nfile: {snap_name}\nsize: {value / 1024:.2f} kb")
+        elif kind == "missing":
+            self.preview_box.setText("snapshot content is missing.")
         else:
-            file_size = os.path.getsize(version_path)
-            self.preview_box.setText(f"no preview available.\n\nfile: {os.path.basename(version_path)}\nsize: {file_size / 1024:.2f} kb")
+            self.preview_box.setText(f"could not build preview: {value}")
+
+    def on_preview_link(self, url):
+        if self.current_diff is None: return
+        kind, _, value = url.toString().partition(":")
+        if kind == "expand": self.diff_expanded.add(int(value))
+        elif kind == "more": self.diff_rows = int(value) + DIFF_PAGE_ROWS
+        else: return
+        scroll = self.preview_box.verticalScrollBar().value()
+        self.preview_box.setHtml(self.current_diff.render(self.diff_expanded, self.diff_rows))
+        self.preview_box.verticalScrollBar().setValue(scroll)
 
     def restore_version(self):
-        current_item = self.versions_list.currentItem()
-        if not current_item: return
-        version_path = current_item.data(0, Qt.UserRole)
-        orig_path = current_item.data(0, Qt.UserRole + 1)
+        orig_path, snap_name = self.current_version()
+        if not snap_name: return
         reply = QMessageBox.question(self, "restore and overwrite", "this will overwrite the current file. a snapshot will be saved first to be safe. continue?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            latest_snap = get_latest_snapshot(orig_path)
-            curr_hash = self.hash_file(orig_path)
-            latest_hash = self.hash_file(latest_snap) if latest_snap else None
-            if curr_hash != latest_hash:
-                save_snapshot(orig_path, "auto-snapshot before restore")
-            shutil.copy2(version_path, orig_path)
-            self.file_hashes[orig_path] = self.hash_file(orig_path)
-            QMessageBox.information(self, "yay", "file restored successfully.")
-            self.refresh_versions_if_selected(orig_path)
+            self.submit_snapshot_job(orig_path, "restore", self.tracker.restore_file, orig_path, snap_name)
 
     def restore_as_copy(self):
-        current_item = self.versions_list.currentItem()
-        if not current_item: return
-        version_path = current_item.data(0, Qt.UserRole)
-        orig_path = current_item.data(0, Qt.UserRole + 1)
+        orig_path, snap_name = self.current_version()
+        if not snap_name: return
+        version_path = snapshot_content_path(orig_path, snap_name)
         base, ext = os.path.splitext(orig_path)
         suggested_name = f"{base}_restored_copy{ext}"
         save_path, _ = QFileDialog.getSaveFileName(self, "save restored copy as...", suggested_name)
 
         if save_path:
             try:
-                shutil.copy2(version_path, save_path)
+                copy_file(version_path, save_path)
                 QMessageBox.information(self, "success", f"restored copy saved to:\n{save_path}")
             except Exception as e:
                 QMessageBox.critical(self, "error", f"could not save file:\n{e}")
 
     def rename_snapshot(self):
-        curr = self.versions_list.currentItem()
-        if not curr: return
-        version_path = curr.data(0, Qt.UserRole)
-        orig_path = curr.data(0, Qt.UserRole + 1)
-        old_snap_name = curr.data(0, Qt.UserRole + 2)
+        orig_path, old_snap_name = self.current_version()
+        if not old_snap_name: return
         match = re.match(r'^(.*?)_?(\d{8}_\d{6}_\d{6}\..*)$', old_snap_name)
         if not match:
             QMessageBox.warning(self, "rename failed", "could not parse the snapshot name format.")
@@ -811,172 +1316,275 @@ class MainWindow(QMainWindow):
         new_base_name, ok = QInputDialog.getText(self, "rename snapshot", "enter new name for the snapshot:", text=current_base_name)
         if ok and new_base_name != current_base_name:
             new_snap_name = f"{new_base_name}_{timestamp_part}" if new_base_name else timestamp_part
-            new_version_path = os.path.join(get_snapshot_dir(orig_path), new_snap_name)
-            if os.path.exists(new_version_path):
+            if not is_valid_snapshot_name(new_snap_name):
+                QMessageBox.warning(self, "rename failed", "snapshot names cannot contain /, \\, : or ..")
+                return
+            if snapshot_exists(orig_path, new_snap_name):
                 QMessageBox.warning(self, "rename failed", "a snapshot with this name already exists.")
                 return
             try:
-                os.rename(version_path, new_version_path)
-                notes = load_notes(orig_path)
-                if old_snap_name in notes:
-                    notes[new_snap_name] = notes.pop(old_snap_name)
-                    save_notes(orig_path, notes)
-                
+                rename_snapshot_entry(orig_path, old_snap_name, new_snap_name)
                 self.show_versions()
                 QMessageBox.information(self, "rename successful", "snapshot has been renamed.")
             except OSError as e:
                 QMessageBox.critical(self, "error", f"could not rename snapshot:\n{e}")
 
     def delete_snapshot(self):
-        curr = self.versions_list.currentItem()
-        if not curr: return
-        version_path = curr.data(0, Qt.UserRole); snap_name = curr.data(0, Qt.UserRole + 2); orig_path = curr.data(0, Qt.UserRole+1)
+        orig_path, snap_name = self.current_version()
+        if not snap_name: return
         reply = QMessageBox.question(self, "delete snapshot", f"are you sure you want to permanently delete this snapshot?\n{snap_name}",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            os.remove(version_path)
-            notes = load_notes(orig_path)
-            if snap_name in notes: del notes[snap_name]; save_notes(orig_path, notes)
+            delete_snapshot_entry(orig_path, snap_name)
             self.show_versions()
 
     def take_manual_snapshot(self):
-        current_item = self.files_tree.currentItem()
-        if not current_item:
-            return
-        file_path = current_item.data(0, Qt.UserRole)
+        file_path = self.selected_tracked_path()
         if not file_path or not os.path.isfile(file_path):
             return
         note, ok = QInputDialog.getText(self, "take snapshot", "enter a note for this snapshot (optional):")
         if ok:
-            save_snapshot(file_path, note)
-            self.file_hashes[file_path] = self.hash_file(file_path)
-            self.show_versions()
-            QMessageBox.information(self, "snapshot created", "a new snapshot has been created successfully.")
+            self.submit_snapshot_job(file_path, "manual", self.tracker.take_snapshot_now, file_path, note)
 
     def save_note(self):
-        curr = self.versions_list.currentItem()
-        if not curr: return
-        snap_name = curr.data(0, Qt.UserRole + 2); orig_path = curr.data(0, Qt.UserRole + 1)
-        notes = load_notes(orig_path)
-        notes[snap_name] = self.note_edit.toPlainText()
-        save_notes(orig_path, notes)
+        orig_path, snap_name = self.current_version()
+        if not snap_name: return
+        set_snapshot_note(orig_path, snap_name, self.note_edit.toPlainText())
+        self.versions_model.update_note(snap_name, self.note_edit.toPlainText())
         QMessageBox.information(self, "note saved", "snapshot note has been updated.")
 
     def load_note(self):
-        curr = self.versions_list.currentItem()
-        if not curr: self.note_edit.clear(); return
-        snap_name = curr.data(0, Qt.UserRole + 2); orig_path = curr.data(0, Qt.UserRole + 1)
-        self.notes = load_notes(orig_path)
-        self.note_edit.setPlainText(self.notes.get(snap_name, ""))
+        orig_path, snap_name = self.current_version()
+        if not snap_name: self.note_edit.clear(); return
+        row = snapshot_index.get(orig_path, snap_name)
+        self.note_edit.setPlainText(row["note"] if row else "")
 
     def import_snapshots(self):
-        curr_file_item = self.files_tree.currentItem()
-        if not curr_file_item or not os.path.isfile(curr_file_item.data(0, Qt.UserRole)):
-            QMessageBox.warning(self, "no file selected", "please select a file to import snapshots for.")
+        if self.archive_thread is not None:
+            QMessageBox.information(self, "busy", "another import or export is still running.")
             return
-        orig_path = curr_file_item.data(0, Qt.UserRole)
         zip_path, _ = QFileDialog.getOpenFileName(self, "select snapshot zip to import", "", "Zip Files (*.zip)")
         if not zip_path: return
-        with zipfile.ZipFile(zip_path, 'r') as zipf: zipf.extractall(get_snapshot_dir(orig_path))
+        import zipfile
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as zipf:
+                names = zipf.namelist()
+                file_count = len(json.loads(zipf.read(ARCHIVE_MANIFEST)).get("files", [])) if ARCHIVE_MANIFEST in names else None
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            QMessageBox.critical(self, "error", f"could not read the archive:\n{e}")
+            return
+        # single-file (and old manifest-less) archives go to the selected file, bigger ones to where they came from
+        selected = self.selected_tracked_path()
+        target = selected if selected and os.path.isfile(selected) and (file_count is None or file_count == 1) else None
+        if file_count is None and not target:
+            QMessageBox.warning(self, "no file selected", "please select a file to import snapshots for.")
+            return
+        self.run_archive_job("importing snapshots...", import_archive, (zip_path, target), self.on_import_finished)
+
+    def on_import_finished(self, thread):
         self.show_versions()
-        QMessageBox.information(self, "import complete", "snapshots have been imported.")
-
-    def export_snapshots(self):
-        curr_file_item = self.files_tree.currentItem()
-        if not curr_file_item or not os.path.isfile(curr_file_item.data(0, Qt.UserRole)): return
-        orig_path = curr_file_item.data(0, Qt.UserRole)
-        snap_dir = get_snapshot_dir(orig_path)
-        zip_path, _ = QFileDialog.getSaveFileName(self, "save snapshot zip", f"{os.path.basename(orig_path)}_snapshots.zip", "Zip Files (*.zip)")
+        self.index_snapshot_contents()
+        imported, skipped = thread.result
+        QMessageBox.information(self, "import complete", f"imported {imported} snapshot(s), skipped {skipped} already present.")
+
+    def export_snapshots(self, export_all=False):
+        if self.archive_thread is not None:
+            QMessageBox.information(self, "busy", "another import or export is still running.")
+            return
+        if export_all:
+            file_paths, default_name = sorted(self.tracker.get_all_tracked_files()), "bkpr_snapshots.zip"
+        else:
+            path = self.selected_tracked_path()
+            if not path: return
+            file_paths = [path] if os.path.isfile(path) else sorted(self.tracker.get_all_files_in_path(path))
+            default_name = f"{os.path.basename(path)}_snapshots.zip"
+        zip_path, _ = QFileDialog.getSaveFileName(self, "save snapshot zip", default_name, "Zip Files (*.zip)")
         if not zip_path: return
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for f in os.listdir(snap_dir): zipf.write(os.path.join(snap_dir, f), f)
-        QMessageBox.information(self, "export complete", f"snapshots exported to {zip_path}")
-
-    def is_path_ignored(self, path):
-        for pattern in self.ignore_patterns:
-            if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(os.path.basename(path), pattern):
-                return True
-        return False
-
-    def get_all_files_in_path(self, path):
-        files = []
-        if os.path.isdir(path):
-            for root, dirs, fnames in os.walk(path, topdown=True):
-                dirs[:] = [d for d in dirs if not self.is_path_ignored(os.path.join(root, d))]
-                for fname in fnames:
-                    file_path = os.path.join(root, fname)
-                    if not self.is_path_ignored(file_path):
-                        files.append(file_path)
-        return files
-
-    def get_all_tracked_files(self):
-        all_files = set()
-        for path in self.tracked_paths:
-            if self.is_path_ignored(path):
-                continue
-            if os.path.isfile(path):
-                all_files.add(path)
-            elif os.path.isdir(path):
-                all_files.update(self.get_all_files_in_path(path))
-        return all_files
-
-    def hash_file(self, path):
-        try:
-            sha256 = hashlib.sha256()
-            with open(path, "rb") as f:
-                for b in iter(lambda: f.read(4096), b""): sha256.update(b)
-            return sha256.hexdigest()
-        except Exception: return None
+        self.run_archive_job("exporting snapshots...", export_archive, (zip_path, file_paths),
+                             lambda thread: QMessageBox.information(self, "export complete", f"{thread.result[0]} snapshot(s) exported to {zip_path}"))
+
+    def run_archive_job(self, label, fn, args, on_done):
+        self.archive_progress = QProgressDialog(label, "cancel", 0, 0, self)
+        self.archive_progress.setWindowTitle("be kind, please rewind")
+        self.archive_progress.setMinimumDuration(300)
+        self.archive_progress.setAutoClose(False); self.archive_progress.setAutoReset(False)
+        thread = ArchiveThread(fn, *args)
+        thread.progress.connect(self.on_archive_progress)
+        thread.finished.connect(lambda: self.on_archive_finished(thread, on_done))
+        self.archive_progress.canceled.connect(thread.stop)
+        self.archive_thread = thread
+        thread.start()
+
+    def on_archive_progress(self, done, total):
+        if self.archive_progress is None: return
+        self.archive_progress.setMaximum(total); self.archive_progress.setValue(done)
+
+    def on_archive_finished(self, thread, on_done):
+        if thread is not self.archive_thread: return
+        self.archive_thread = None
+        self.archive_progress.close(); self.archive_progress = None
+        if thread.was_cancelled:
+            self.show_versions()
+            self.statusBar().showMessage("cancelled.", 5000)
+        elif thread.error:
+            self.show_versions()
+            QMessageBox.critical(self, "error", f"sum happened:\n{thread.error}")
+        else:
+            on_done(thread)
+
+    def migrate_snapshots(self):
+        reply = QMessageBox.question(self, "move old snapshots", "this moves snapshots made by older versions into the shared storage, so identical versions are only stored once. continue?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes: return
+        known_paths = self.tracker.get_all_tracked_files()
+        self.statusBar().showMessage("moving old snapshots...")
+        self.submit_snapshot_job(MIGRATE_KEY, "migrate", lambda: ("migrated", migrate_all_snapshots(known_paths)) + gc_blobs(), coalesce=True)
+
+    def on_migrate_finished(self, migrated, removed, freed):
+        self.statusBar().showMessage(" ")
+        self.show_versions()
+        QMessageBox.information(self, "done", f"moved {migrated} snapshot(s), removed {removed} unused blob(s), freed {freed / 1024:.2f} kb.")
+
+    def edit_retention_policy(self):
+        path = self.selected_tracked_path()
+        if path not in self.tracker.tracked_paths: return
+        dialog = RetentionDialog(path, self.tracker.retention_policies.get(path, {}),
+                                 lambda policy: prune_snapshots(self.tracker.retention_plans({path: policy}), dry_run=True), self)
+        if dialog.exec_() != QDialog.Accepted: return
+        policy = dialog.get_policy()
+        if policy: self.tracker.retention_policies[path] = policy
+        else: self.tracker.retention_policies.pop(path, None)
+        self.save_settings()
+
+    def prune_now(self, dry_run=False, manual=False):
+        if not self.tracker.retention_policies:
+            if dry_run or manual: QMessageBox.information(self, "nothing to prune", "no retention policy is set up yet (manage → retention policy for selected item).")
+            return
+        if self.is_paused and not (dry_run or manual): return
+        plans = self.tracker.retention_plans()
+        self.submit_snapshot_job(PRUNE_KEY, "prune", lambda: ("pruned", prune_snapshots(plans, dry_run), manual), coalesce=True)
+
+    def on_prune_finished(self, summary, manual):
+        size = f"{summary['bytes'] / (1024 * 1024):.2f} mb"
+        if summary["dry_run"]:
+            QMessageBox.information(self, "dry run", f"pruning would delete {summary['snapshots']} snapshot(s) of {summary['files']} file(s) and free about {size}.")
+            return
+        if summary["snapshots"]:
+            self.show_versions()
+            self.statusBar().showMessage(f"pruned {summary['snapshots']} old snapshot(s), freed {size}.", 5000)
+        elif manual:
+            self.statusBar().showMessage("nothing to prune.", 5000)
+
+    def rebuild_snapshot_index(self):
+        known_paths = self.tracker.get_all_tracked_files(); self.statusBar().showMessage("rebuilding the snapshot index...")
+        self.submit_snapshot_job(REBUILD_INDEX_KEY, "rebuild index", lambda: ("index rebuilt", snapshot_index.rebuild(known_paths)), coalesce=True)
+
+    def on_index_rebuilt(self):
+        self.show_versions()
+        if self.search_dialog is not None and self.search_dialog.isVisible(): self.search_dialog.run_search()
+        self.statusBar().showMessage("snapshot index rebuilt.", 5000)
+        self.index_snapshot_contents()
+
+    def index_snapshot_contents(self):
+        self.submit_snapshot_job(SEARCH_INDEX_KEY, "search index", lambda: ("indexed", index_pending_snapshot_contents()), coalesce=True)
+
+    def change_hash_algorithm(self):
+        names = HashService.algorithms()
+        name, ok = QInputDialog.getItem(self, "change detection hash", "hash used to notice changed files (snapshots are always stored by sha256):",
+                                        names, names.index(hash_service.algorithm) if hash_service.algorithm in names else 0, False)
+        if not ok or name == hash_service.algorithm: return
+        self.tracker.set_hash_algorithm(name)
+        self.save_settings()
+        self.refresh_all_tracking()
 
     def save_settings(self):
-        settings = {
-            "tracked_paths": self.tracked_paths
-        }
-        try:
-            with open(SETTINGS_PATH, 'w') as f:
-                json.dump(settings, f, indent=4)
-        except IOError:
-            print("sum happened, could not save settings.")
+        self.tracker.save_settings()
 
     def load_settings(self):
-        if not os.path.exists(SETTINGS_PATH):
-            return
-        try:
-            with open(SETTINGS_PATH, 'r') as f:
-                settings_data = json.load(f)
-            if isinstance(settings_data, list):
-                self.tracked_paths = settings_data
-            else:
-                self.tracked_paths = settings_data.get("tracked_paths", [])
-            self.refresh_all_tracking()
-        except (IOError, json.JSONDecodeError):
-            print("sum happened, could not load settings.")
-            self.tracked_paths = []
+        self.tracker.load_settings()
+        for action, checked in ((self.delta_action, self.tracker.storage_mode == "delta"), (self.polling_action, self.tracker.watch_polling),
+                                (self.metrics_action, metrics.enabled)):
+            action.blockSignals(True); action.setChecked(checked); action.blockSignals(False)
+        self.update_metrics_timers()
 
     def load_ignore_patterns(self):
-        if os.path.exists(IGNORE_FILE_PATH):
-            with open(IGNORE_FILE_PATH, 'r') as f:
-                self.ignore_patterns = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-        else:
-            self.ignore_patterns = []
+        self.tracker.load_ignore_patterns()
 
-    def refresh_all_tracking(self):
-        self.file_hashes.clear()
-        all_files = self.get_all_tracked_files()
-        for file_path in all_files:
-            if os.path.exists(file_path):
-                self.file_hashes[file_path] = self.hash_file(file_path)
+    def start_tracking(self):
+        self.startup_timings["window_shown_ms"] = (time.perf_counter() - APP_START) * 1000
+        self.tracker.seed_known_hashes()
         self.update_files_tree()
         self.update_monitoring()
+        self.startup_timings["tree_shown_ms"] = (time.perf_counter() - APP_START) * 1000
+        if self.benchmark:
+            print(json.dumps(self.startup_timings), flush=True)
+            self.quit_application()
+            return
+        self.start_baseline()
+
+    def refresh_all_tracking(self):
+        self.rebuild_files_tree()
+        self.update_monitoring()
+        self.start_baseline()
+
+    def start_baseline(self):
+        if self.baseline_thread:
+            self.baseline_thread.stop()
+            self.baseline_thread.wait()
+        self.baseline_started = time.perf_counter()
+        self.baseline_thread = BaselineThread(self.tracker)
+        self.baseline_thread.progress.connect(self.on_baseline_progress)
+        self.baseline_thread.finished.connect(self.on_baseline_finished)
+        self.baseline_thread.start(QThread.LowestPriority)
+
+    def on_baseline_progress(self, done, total):
+        self.statusBar().showMessage(f"checking tracked files... {done}/{total}")
+
+    def on_baseline_finished(self):
+        thread = self.sender()
+        if thread is not self.baseline_thread or not thread.completed: return
+        self.tracker.finish_baseline(thread.scanned)
+        self.baseline_thread = None
+        elapsed = time.perf_counter() - self.baseline_started
+        self.statusBar().showMessage(f"checked {len(thread.scanned)} tracked files in {elapsed:.1f}s", 5000)
+        if "baseline_ms" not in self.startup_timings:
+            self.startup_timings["baseline_ms"] = (time.perf_counter() - APP_START) * 1000
+            self.startup_timings["baseline_files"] = len(thread.scanned)
+            self.record_startup_timings()
+            self.index_snapshot_contents()
+            self.prune_now()
+
+    def show_startup_report(self):
+        self.statusBar().showMessage("measuring imports...", 5000)
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        self.submit_snapshot_job(STARTUP_REPORT_KEY, "startup report", lambda: ("startup report", import_time_report("app", cwd)), coalesce=True)
+
+    def record_startup_timings(self):
+        timings = dict(self.startup_timings, when=datetime.now().isoformat(timespec="seconds"))
+        try:
+            with open(STARTUP_LOG_PATH, 'a') as f:
+                f.write(json.dumps(timings) + "\n")
+        except IOError:
+            pass
 
     def closeEvent(self, event):
         if self.is_quitting:
             self.save_settings()
+            if metrics.enabled: metrics.write_log()
             if hasattr(self, 'tray_icon'):
                 self.tray_icon.hide()
             self.stop_monitoring()
-            if self.watcher_thread:
-                self.watcher_thread.wait()
+            if self.baseline_thread:
+                self.baseline_thread.stop()
+                self.baseline_thread.wait()
+            self.snapshot_executor.shutdown()
+            self.preview_worker.shutdown()
+            hash_service.shutdown()
+            if self.archive_thread:
+                self.archive_thread.stop()
+                self.archive_thread.wait()
+            self.tracker.change_cache.save()
+            self.file_watcher.shutdown()
             event.accept()
         else:
             event.ignore()
@@ -995,6 +1603,6 @@ if __name__ == '__main__':
     app.setStyleSheet(DARK_STYLESHEET)
     icon_path = resource_path('bkpr.ico')
     app.setWindowIcon(QIcon(icon_path))
-    main_win = MainWindow()
+    main_win = MainWindow(benchmark="--startup-benchmark" in sys.argv)
     main_win.show()
     sys.exit(app.exec_())
\ No newline at end of file
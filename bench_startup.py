@@ -0,0 +1,68 @@
+# startup budget check: starts the app until its tray icon is up, a few times over, and fails when the
+# median goes over the budget. the time is measured from launching python, so interpreter start and every
+# import count. runs against an empty data folder unless --real-data is given.
+#   python bench_startup.py [--runs 5] [--budget-ms 1500] [--real-data]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTUP_BUDGET_MS = 1500
+
+def run_once(env, timeout):
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, app_path, "--startup-benchmark"], env=env, cwd=os.path.dirname(app_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in proc.stdout:
+            if line.startswith("{"):
+                elapsed = (time.perf_counter() - started) * 1000
+                return dict(json.loads(line), total_ms=elapsed)
+        raise RuntimeError(f"the app exited with {proc.wait()} before it finished starting")
+    finally:
+        try: proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired: proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="fail when starting bkpr takes longer than a budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--real-data", action="store_true", help="start with your own tracked files instead of an empty setup")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    data_dir = None
+    if not args.real_data:
+        data_dir = tempfile.TemporaryDirectory(prefix="bkpr-bench-")
+        env["BKPR_DATA_DIR"] = data_dir.name
+    if sys.platform.startswith("linux") and not env.get("DISPLAY") and not env.get("WAYLAND_DISPLAY"):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    # the first start also compiles bytecode and warms the disk cache, it is not counted
+    run_once(env, args.timeout)
+    results = []
+    for i in range(args.runs):
+        r = run_once(env, args.timeout)
+        results.append(r)
+        tray = f"{r['tray_shown_ms']:.0f} ms" if "tray_shown_ms" in r else "no tray"
+        print(f"run {i + 1}: {r['total_ms']:.0f} ms in total; tray icon {tray}, window {r['window_shown_ms']:.0f} ms after app.py started")
+    median = statistics.median(r["total_ms"] for r in results)
+    print(f"median {median:.0f} ms, budget {args.budget_ms:.0f} ms")
+    if median > args.budget_ms:
+        print("over budget. slowest imports:")
+        # the report imports the app in a child process, which has to see the same data folder
+        os.environ.update(env)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from bkpr_core import import_time_report, format_startup_report
+        print(format_startup_report({}, import_time_report("app", os.path.dirname(os.path.abspath(__file__))), limit=15))
+    if data_dir: data_dir.cleanup()
+    return 0 if median <= args.budget_ms else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
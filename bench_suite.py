@@ -0,0 +1,198 @@
+# benchmarks for the hot paths (snapshotting, scanning, listing, hashing, diffing, export and import) on
+# synthetic trees built in a scratch folder, so runs are repeatable and never touch your own snapshots.
+# results are written as json; pass an older result with --compare to see what changed between commits.
+#   python bench_suite.py [--scale 1.0] [--repeat 3] [--output results.json] [--compare old.json] [--only NAME]
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+
+def text_lines(rng, count):
+    return [" ".join(rng.choices(WORDS, k=rng.randint(4, 12))) + "\n" for _ in range(count)]
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w" if isinstance(data, str) else "wb") as f: f.write(data)
+
+def build_trees(root, scale, rng):
+    # many small files in a flat-ish tree, a few huge files, one deep chain of folders and one long text file
+    n = lambda count: max(1, int(count * scale))
+    trees = {k: os.path.join(root, k) for k in ("small", "huge", "deep", "history")}
+    for i in range(n(5000)):
+        write(os.path.join(trees["small"], f"d{i % 50:02}", f"f{i:05}.txt"), "".join(text_lines(rng, rng.randint(10, 60))))
+    for i in range(3):
+        write(os.path.join(trees["huge"], f"big{i}.bin"), rng.randbytes(n(64) * 1024 * 1024))
+    path = trees["deep"]
+    for depth in range(n(40)):
+        path = os.path.join(path, f"level{depth:02}")
+        for i in range(5): write(os.path.join(path, f"f{i}.md"), "".join(text_lines(rng, 20)))
+    write(os.path.join(trees["history"], "notes.txt"), "".join(text_lines(rng, n(5000))))
+    # freshly written files have racy mtimes and are never trusted by the change cache, age them like real files
+    past = time.time() - 3600
+    for dirpath, _, fnames in os.walk(root):
+        for fname in fnames: os.utime(os.path.join(dirpath, fname), (past, past))
+    return trees
+
+class Bench:
+    def __init__(self, repeat, only):
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+    def wanted(self, name):
+        return not self.only or any(o in name for o in self.only)
+
+    # fn runs `repeat` times unless it changes state (once=True); ops is how many items one run handles.
+    # steps that change state still run when filtered out with --only, later benchmarks build on them
+    def run(self, name, fn, ops=1, once=False, **extra):
+        if not self.wanted(name):
+            return fn() if once else None
+        times, value = [], None
+        for _ in range(1 if once else self.repeat):
+            started = time.perf_counter()
+            value = fn()
+            times.append(time.perf_counter() - started)
+        best = min(times)
+        self.results[name] = dict(seconds=best, median_seconds=statistics.median(times), runs=len(times), ops=ops,
+                                  per_op_ms=best * 1000 / ops if ops else None, **extra)
+        print(f"{name:40} {best * 1000:10.1f} ms" + (f"  ({best * 1000 / ops:.3f} ms/op, {ops} ops)" if ops > 1 else ""), flush=True)
+        return value
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_suite(args, work):
+    # the core reads its data folder when it is imported, so it is only imported once that points at the scratch folder
+    os.environ["BKPR_DATA_DIR"] = os.path.join(work, "data")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bkpr_core as core
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    trees = build_trees(os.path.join(work, "trees"), args.scale, rng)
+    print(f"built synthetic trees in {time.perf_counter() - started:.1f}s", flush=True)
+
+    bench = Bench(args.repeat, args.only)
+    tracker = core.Tracker()
+    tracker.storage_mode = "delta" if args.delta else "full"
+    tracker.tracked_paths = list(trees.values())
+    small_files = sorted(tracker.get_all_files_in_path(trees["small"]))
+    huge_files = sorted(tracker.get_all_files_in_path(trees["huge"]))
+    history_file = os.path.join(trees["history"], "notes.txt")
+
+    bench.run("get_all_tracked_files", tracker.get_all_tracked_files, ops=len(tracker.get_all_tracked_files()))
+    bench.run("get_all_files_in_path.deep", lambda: tracker.get_all_files_in_path(trees["deep"]))
+    bench.run("hash_file.small", lambda: [core.hash_service.hash_file(f) for f in small_files], ops=len(small_files))
+    bench.run("hash_file.huge", lambda: [core.hash_service.hash_file(f) for f in huge_files], ops=len(huge_files),
+              mb=sum(os.path.getsize(f) for f in huge_files) / (1024 * 1024))
+    bench.run("hash_many.small", lambda: list(core.hash_service.hash_many(small_files)), ops=len(small_files))
+
+    bench.run("save_snapshot.small", lambda: [tracker.track_new_file(f, "") for f in small_files], ops=len(small_files), once=True)
+    bench.run("save_snapshot.huge", lambda: [tracker.track_new_file(f, "") for f in huge_files], ops=len(huge_files), once=True)
+    bench.run("save_snapshot.unchanged", lambda: [tracker.save_snapshot(f, None, tracker.current_hash(f)) for f in small_files[:500]],
+              ops=min(500, len(small_files)), once=True)
+
+    # one file with a long history, every version a small edit of the one before
+    lines = open(history_file).readlines()
+    versions = max(1, int(1000 * args.scale))
+    def edit_history():
+        for i in range(versions):
+            lines[rng.randrange(len(lines))] = f"edit {i}\n"
+            with open(history_file, "w") as f: f.writelines(lines)
+            tracker.save_snapshot(history_file, core.NOTE_FILE_CHANGE if i % 2 else None)
+    bench.run("save_snapshot.history", edit_history, ops=versions, once=True)
+    bench.run("list_snapshots.history", lambda: core.list_snapshots(history_file), ops=versions)
+    bench.run("snapshot_index.page.history", lambda: core.snapshot_index.page(history_file, "", None, 200))
+    bench.run("list_snapshots.small", lambda: [core.list_snapshots(f) for f in small_files], ops=len(small_files))
+
+    # poll_files checks every tracked file: cold with an empty change cache, warm when stat says nothing changed
+    tracker.change_cache.entries.clear()
+    tracker.file_hashes.clear()
+    tracker.file_hashes.update({f: core.hash_service.hash_file(f) for f in tracker.get_all_tracked_files()})
+    bench.run("poll_files.cold", tracker.reconcile_files, ops=len(tracker.file_hashes), once=True)
+    bench.run("poll_files.warm", tracker.reconcile_files, ops=len(tracker.file_hashes))
+    for f in small_files[::10]:
+        with open(f, "a") as out: out.write("changed\n")
+    bench.run("poll_files.changed_10pct", tracker.reconcile_files, ops=len(tracker.file_hashes), once=True)
+
+    names = core.list_snapshots(history_file)
+    old_version = core.snapshot_content_path(history_file, names[-1])
+    bench.run("get_text_diff.history", lambda: core.get_text_diff(old_version, history_file), lines=len(lines))
+    big_a, big_b = os.path.join(work, "diff_a.txt"), os.path.join(work, "diff_b.txt")
+    a = text_lines(rng, int(20000 * args.scale) or 1)
+    b = list(a)
+    for _ in range(max(1, len(b) // 200)): b[rng.randrange(len(b))] = "changed line\n"
+    write(big_a, "".join(a)); write(big_b, "".join(b))
+    bench.run("get_text_diff.large", lambda: core.get_text_diff(big_a, big_b), lines=len(a))
+
+    archive = os.path.join(work, "export.zip")
+    exported = small_files + [history_file]
+    bench.run("export_archive", lambda: core.export_archive(archive, exported), ops=len(exported), once=True)
+    if "export_archive" in bench.results: bench.results["export_archive"]["mb"] = os.path.getsize(archive) / (1024 * 1024)
+    if bench.wanted("import_archive") and os.path.exists(archive):
+        for f in exported:
+            shutil.rmtree(core.get_snapshot_dir(f), ignore_errors=True)
+            core.snapshot_index.remove_file(f)
+        core.gc_blobs()
+        bench.run("import_archive", lambda: core.import_archive(archive), ops=len(exported), once=True)
+    core.hash_service.shutdown()
+    return bench.results
+
+def compare(results, old_path):
+    with open(old_path) as f: old = json.load(f)
+    print(f"\ncompared with {old.get('commit') or old_path}:")
+    for name, r in results.items():
+        before = old.get("results", {}).get(name)
+        if not before or not before.get("seconds"): continue
+        ratio = r["seconds"] / before["seconds"]
+        print(f"{name:40} {before['seconds'] * 1000:10.1f} -> {r['seconds'] * 1000:10.1f} ms  ({(ratio - 1) * 100:+.0f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark bkpr's hot paths on synthetic trees")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies file counts, file sizes and history length")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each repeatable benchmark, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--delta", action="store_true", help="store text snapshots compressed, as deltas")
+    parser.add_argument("--only", action="append", help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--output", help="write the results here as json")
+    parser.add_argument("--compare", help="an earlier json result to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch folder")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="bkpr-bench-")
+    try:
+        results = run_suite(args, work)
+    finally:
+        if args.keep: print(f"scratch folder kept at {work}")
+        else: shutil.rmtree(work, ignore_errors=True)
+    report = {
+        "commit": git_commit(),
+        "when": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    if args.compare: compare(results, args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
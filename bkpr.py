@@ -0,0 +1,309 @@
+# bkpr without a window: a tracking daemon for servers and headless machines, and one-off commands to
+# snapshot, list, restore, diff and prune. everything goes through bkpr_core, qt and pillow are never loaded.
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bkpr_core import (
+    SETTINGS_PATH, IGNORE_FILE_PATH, EVENT_FLUSH_INTERVAL_MS, RECONCILE_INTERVAL_MS, RECONCILE_KEY,
+    PRUNE_KEY, PRUNE_INTERVAL_MS, SEARCH_INDEX_KEY, CONTENT_HASH, TEXT_EXTENSIONS, METRICS_LOG_PATH,
+    METRICS_LOG_INTERVAL_MS, snapshot_index, hash_service, metrics, Tracker, JobQueue, FileWatcher,
+    snapshot_content_path, snapshot_digest, prune_snapshots, index_pending_snapshot_contents,
+    format_snap_time, unified_diff
+)
+
+def log(message):
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}", flush=True)
+
+def fail(message):
+    print(f"bkpr: {message}", file=sys.stderr)
+    return 2
+
+def load_tracker():
+    tracker = Tracker()
+    tracker.load_ignore_patterns()
+    tracker.load_settings()
+    return tracker
+
+def file_mtime(path):
+    try: return os.stat(path).st_mtime_ns
+    except OSError: return None
+
+class Daemon:
+    # the same tracking the app does, driven by a plain loop instead of qt timers. settings.json and
+    # .bkprignore are re-read when they change, so `bkpr track` and the app's editors reach a running daemon
+    def __init__(self, interval=None, use_polling=False, collect_metrics=False):
+        self.interval = interval
+        self.use_polling = use_polling
+        self.collect_metrics = collect_metrics
+        self.stop_event = threading.Event()
+        self.jobs = JobQueue(self.on_job_finished, self.on_job_failed)
+        self.tracker = Tracker(self.submit)
+        self.watcher = None
+        self.config_mtimes = None
+
+    def submit(self, path, kind, fn, *args, coalesce=False):
+        if not self.jobs.submit(path, kind, fn, *args, coalesce=coalesce):
+            log(f"snapshot queue is full, skipped {path}. it will be picked up by the next full check.")
+            return False
+        return True
+
+    def on_job_finished(self, path, result):
+        if not result: return
+        if result[0] == "pruned":
+            summary = result[1]
+            if summary["snapshots"]: log(f"pruned {summary['snapshots']} old snapshot(s), freed {summary['bytes'] / (1024 * 1024):.2f} mb")
+        elif result[0] == "indexed":
+            if result[1]: log(f"indexed {result[1]} snapshot versions for search")
+        elif result[0] == "checked":
+            for r in result[1]: self.on_job_finished(r[1], r)
+        elif result[0] == "failed":
+            self.on_job_failed(result[1], result[2])
+        else:
+            log(f"{result[0]} {result[1]}")
+
+    def on_job_failed(self, path, error):
+        log(f"sum happened with {path}: {error}")
+
+    def load_config(self):
+        self.config_mtimes = (file_mtime(SETTINGS_PATH), file_mtime(IGNORE_FILE_PATH))
+        self.tracker.load_ignore_patterns()
+        self.tracker.load_settings()
+        if self.collect_metrics: metrics.enabled = True
+        if self.watcher:
+            self.watcher.set_paths(list(self.tracker.tracked_paths), self.tracker.is_path_ignored, self.use_polling or self.tracker.watch_polling)
+
+    def config_changed(self):
+        return (file_mtime(SETTINGS_PATH), file_mtime(IGNORE_FILE_PATH)) != self.config_mtimes
+
+    def reconcile(self):
+        self.submit(RECONCILE_KEY, "reconcile", self.tracker.reconcile_files, coalesce=True)
+
+    def prune(self):
+        if not self.tracker.retention_policies: return
+        plans = self.tracker.retention_plans()
+        self.submit(PRUNE_KEY, "prune", lambda: ("pruned", prune_snapshots(plans)), coalesce=True)
+
+    def baseline(self):
+        started = time.perf_counter()
+        scanned = self.tracker.scan_baseline(self.stop_event.is_set)
+        if scanned is None: return
+        self.tracker.finish_baseline(scanned)
+        log(f"checked {len(scanned)} tracked files in {time.perf_counter() - started:.1f}s")
+        self.submit(SEARCH_INDEX_KEY, "search index", lambda: ("indexed", index_pending_snapshot_contents()), coalesce=True)
+        self.prune()
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        if self.interval is None:
+            self.watcher = FileWatcher(self.tracker.note_event, self.tracker.note_move)
+        self.load_config()
+        if not self.tracker.tracked_paths:
+            log("nothing is tracked yet, add something with `bkpr track PATH`. waiting for settings to change.")
+        mode = f"checking every {self.interval:g}s" if self.interval is not None else "watching for changes"
+        log(f"tracking {len(self.tracker.tracked_paths)} path(s), {mode}. stop with ctrl+c.")
+        if metrics.enabled: log(f"collecting performance metrics in {METRICS_LOG_PATH}")
+        self.tracker.seed_known_hashes()
+        threading.Thread(target=self.baseline, name="bkpr-baseline", daemon=True).start()
+        now = time.monotonic()
+        next_check = now + (self.interval if self.interval is not None else RECONCILE_INTERVAL_MS / 1000)
+        next_prune = now + PRUNE_INTERVAL_MS / 1000
+        next_metrics = now + METRICS_LOG_INTERVAL_MS / 1000
+        while not self.stop_event.wait(EVENT_FLUSH_INTERVAL_MS / 1000):
+            files = self.tracker.settled_events()
+            if files: self.tracker.check_files(files)
+            now = time.monotonic()
+            if self.config_changed():
+                log("settings changed, reloading.")
+                self.load_config()
+                self.reconcile()
+            if now >= next_check:
+                self.reconcile()
+                next_check = now + (self.interval if self.interval is not None else RECONCILE_INTERVAL_MS / 1000)
+            if now >= next_prune:
+                self.prune()
+                next_prune = now + PRUNE_INTERVAL_MS / 1000
+            if now >= next_metrics:
+                if metrics.enabled: metrics.write_log()
+                next_metrics = now + METRICS_LOG_INTERVAL_MS / 1000
+        log("stopping.")
+        if metrics.enabled: metrics.write_log()
+        if self.watcher: self.watcher.shutdown()
+        self.jobs.shutdown()
+        hash_service.shutdown()
+        self.tracker.change_cache.save()
+        return 0
+
+def cmd_daemon(args):
+    return Daemon(args.interval, args.polling, args.metrics).run()
+
+def cmd_track(args):
+    tracker = load_tracker()
+    path = os.path.normpath(os.path.abspath(args.path))
+    if not os.path.exists(path): return fail(f"{path} does not exist")
+    if path in tracker.tracked_paths: return fail(f"{path} is already tracked")
+    if tracker.is_path_ignored(path): return fail(f"{path} matches an exclusion pattern, check {IGNORE_FILE_PATH}")
+    tracker.track(path, args.message or "")
+    tracker.save_settings()
+    tracker.change_cache.save()
+    print(f"tracking {path}, {len(tracker.file_hashes)} file(s) snapshotted.")
+    return 0
+
+def cmd_untrack(args):
+    tracker = load_tracker()
+    path = os.path.normpath(os.path.abspath(args.path))
+    if path not in tracker.tracked_paths: return fail(f"{path} is not tracked")
+    tracker.untrack(path, args.purge)
+    tracker.save_settings()
+    tracker.change_cache.save()
+    print(f"stopped tracking {path}" + (" and deleted its snapshots." if args.purge else "."))
+    return 0
+
+def cmd_snapshot(args):
+    tracker = load_tracker()
+    files = []
+    for p in args.paths:
+        path = os.path.normpath(os.path.abspath(p))
+        if not tracker.is_path_tracked(path): return fail(f"{path} is not tracked, add it with `bkpr track`")
+        files.extend(tracker.get_all_files_in_path(path) if os.path.isdir(path) else [path])
+    for f in files:
+        tracker.take_snapshot_now(f, args.message or "")
+        print(f"snapshot of {f}")
+    tracker.change_cache.save()
+    return 0
+
+# snapshots are picked by name or by their number in `bkpr list` (1 is the newest)
+def resolve_snapshot(path, ref):
+    names = snapshot_index.list(path)
+    if ref is None: return names[0] if names else None
+    if ref.isdigit() and 0 < int(ref) <= len(names) and ref not in names: return names[int(ref) - 1]
+    return ref if ref in names else None
+
+def cmd_list(args):
+    tracker = load_tracker()
+    if not args.path:
+        for p in tracker.tracked_paths:
+            print(p + (os.sep if os.path.isdir(p) else "") + ("  (retention policy)" if p in tracker.retention_policies else ""))
+        return 0
+    path = os.path.normpath(os.path.abspath(args.path))
+    if os.path.isdir(path):
+        for f in sorted(snapshot_index.files_under(path)):
+            print(f"{len(snapshot_index.list(f)):6}  {f}")
+        return 0
+    rows = snapshot_index.page(path, args.filter or "", None, args.limit)
+    if not rows: return fail(f"no snapshots of {path}")
+    for i, (name, note, ts) in enumerate(rows, 1):
+        print(f"{i:4}  {format_snap_time(name):32}  {name}" + (f"  {note}" if note else ""))
+    return 0
+
+def cmd_restore(args):
+    tracker = load_tracker()
+    path = os.path.normpath(os.path.abspath(args.path))
+    snap_name = resolve_snapshot(path, args.snapshot)
+    if not snap_name: return fail(f"no snapshot {args.snapshot} of {path}")
+    dest = os.path.abspath(args.to) if args.to else None
+    tracker.restore_file(path, snap_name, dest)
+    tracker.change_cache.save()
+    print(f"restored {snap_name} to {dest or path}")
+    return 0
+
+def read_lines(path):
+    with open(path, encoding="utf-8", errors="ignore") as f: return f.readlines()
+
+def cmd_diff(args):
+    path = os.path.normpath(os.path.abspath(args.path))
+    snap_name = resolve_snapshot(path, args.snapshot)
+    if not snap_name: return fail(f"no snapshot {args.snapshot} of {path}" if args.snapshot else f"no snapshots of {path}")
+    if args.other:
+        other = resolve_snapshot(path, args.other)
+        if not other: return fail(f"no snapshot {args.other} of {path}")
+        other_path, other_label = snapshot_content_path(path, other), other
+    else:
+        other_path, other_label = path, path
+    if not os.path.exists(other_path): return fail(f"{other_path} does not exist")
+    if os.path.splitext(path)[1].lower() not in TEXT_EXTENSIONS:
+        same = snapshot_digest(path, snap_name) == (snapshot_digest(path, other) if args.other else hash_service.hash_file(path, CONTENT_HASH))
+        if not same: print(f"binary files {snap_name} and {other_label} differ")
+        return 0 if same else 1
+    lines = list(unified_diff(read_lines(snapshot_content_path(path, snap_name)), read_lines(other_path), snap_name, other_label, args.context))
+    sys.stdout.writelines(lines)
+    return 1 if lines else 0
+
+def cmd_prune(args):
+    tracker = load_tracker()
+    policies = None
+    if args.path:
+        path = os.path.normpath(os.path.abspath(args.path))
+        if path not in tracker.retention_policies: return fail(f"{path} has no retention policy")
+        policies = {path: tracker.retention_policies[path]}
+    elif not tracker.retention_policies:
+        return fail("no retention policy is set up yet")
+    summary = prune_snapshots(tracker.retention_plans(policies), dry_run=args.dry_run)
+    verb = "would delete" if summary["dry_run"] else "deleted"
+    print(f"{verb} {summary['snapshots']} snapshot(s) of {summary['files']} file(s), about {summary['bytes'] / (1024 * 1024):.2f} mb.")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bkpr", description="be kind, please rewind: automatic file snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("daemon", aliases=["watch"], help="track files in the foreground without the app")
+    p.add_argument("--interval", type=float, help="check everything every N seconds instead of watching for changes")
+    p.add_argument("--polling", action="store_true", help="poll for changes instead of using native file events")
+    p.add_argument("--metrics", action="store_true", help="time the hot paths and append a summary to metrics.log every minute")
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser("track", help="start tracking a file or folder and snapshot it")
+    p.add_argument("path")
+    p.add_argument("-m", "--message", help="note for the first snapshot(s)")
+    p.set_defaults(func=cmd_track)
+
+    p = sub.add_parser("untrack", help="stop tracking a file or folder")
+    p.add_argument("path")
+    p.add_argument("--purge", action="store_true", help="also delete its snapshots")
+    p.set_defaults(func=cmd_untrack)
+
+    p = sub.add_parser("snapshot", help="snapshot tracked files now")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("-m", "--message", help="note for the snapshot(s)")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("list", help="list tracked paths, or the snapshots of a file")
+    p.add_argument("path", nargs="?")
+    p.add_argument("-f", "--filter", help="only snapshots whose time or note contains this")
+    p.add_argument("-n", "--limit", type=int, default=50)
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("restore", help="restore a snapshot over the file, or to another path")
+    p.add_argument("path")
+    p.add_argument("snapshot", help="snapshot name, or its number in `bkpr list`")
+    p.add_argument("--to", help="write the snapshot here instead of over the file")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("diff", help="diff a snapshot against the file or another snapshot")
+    p.add_argument("path")
+    p.add_argument("snapshot", nargs="?", help="defaults to the newest snapshot")
+    p.add_argument("other", nargs="?", help="compare against this snapshot instead of the file")
+    p.add_argument("-U", "--context", type=int, default=3)
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser("prune", help="apply retention policies now")
+    p.add_argument("path", nargs="?", help="only prune this tracked path")
+    p.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    p.set_defaults(func=cmd_prune)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2583 @@
+# everything bkpr does that does not need a display: storage, the snapshot index, hashing, diffs,
+# archives, retention and the tracking engine. the qt app and the bkpr command line are both built on it.
+import sys
+import os
+import shutil
+import hashlib
+from datetime import datetime
+import re
+import json
+import io
+import fnmatch
+import html
+import tempfile
+import time
+import zlib
+import sqlite3
+import threading
+import bisect
+import array
+import contextlib
+import functools
+import atexit
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+def get_documents_dir():
+    import os
+    if os.name == "nt":
+        from pathlib import Path
+        try:
+            import ctypes.wintypes
+            CSIDL_PERSONAL = 5
+            SHGFP_TYPE_CURRENT = 0
+            buf = ctypes.create_unicode_buffer(ctypes.wintypes.MAX_PATH)
+            ctypes.windll.shell32.SHGetFolderPathW(None, CSIDL_PERSONAL, None, SHGFP_TYPE_CURRENT, buf)
+            return buf.value
+        except Exception:
+            return str(Path.home() / "Documents")
+    else:
+        return os.path.join(os.path.expanduser("~"), "Documents")
+
+# BKPR_DATA_DIR keeps settings and snapshots somewhere else, the benchmarks use it to work in a scratch folder
+APP_DATA_BASE = os.environ.get("BKPR_DATA_DIR") or os.path.join(get_documents_dir(), "be-kind-please-rewind")
+SNAPSHOTS_BASE = os.path.join(APP_DATA_BASE, "snapshots")
+os.makedirs(SNAPSHOTS_BASE, exist_ok=True)
+BLOBS_BASE = os.path.join(APP_DATA_BASE, "blobs")
+os.makedirs(BLOBS_BASE, exist_ok=True)
+BLOBS_LOCK_PATH = os.path.join(BLOBS_BASE, ".lock")
+MATERIALIZED_DIR = os.path.join(APP_DATA_BASE, "cache", "materialized")
+THUMBNAILS_DIR = os.path.join(APP_DATA_BASE, "cache", "thumbnails")
+SETTINGS_PATH = os.path.join(APP_DATA_BASE, "settings.json")
+IGNORE_FILE_PATH = os.path.join(APP_DATA_BASE, ".bkprignore")
+HASH_CACHE_PATH = os.path.join(APP_DATA_BASE, "hash_cache.json")
+INDEX_PATH = os.path.join(APP_DATA_BASE, "index.sqlite3")
+STARTUP_LOG_PATH = os.path.join(APP_DATA_BASE, "startup.log")
+METRICS_LOG_PATH = os.path.join(APP_DATA_BASE, "metrics.log")
+
+EVENT_SETTLE_MS = 500
+EVENT_MAX_WAIT_MS = 10 * 1000
+EVENT_FLUSH_INTERVAL_MS = 250
+RECONCILE_INTERVAL_MS = 15 * 60 * 1000
+SNAPSHOT_WORKERS = 2
+SNAPSHOT_QUEUE_LIMIT = 1024
+RECONCILE_KEY = "<reconcile>"
+PRUNE_KEY = "<prune>"
+MIGRATE_KEY = "<migrate>"
+REBUILD_INDEX_KEY = "<rebuild-index>"
+PRUNE_INTERVAL_MS = 60 * 60 * 1000
+BLOB_GC_GRACE_SECONDS = 60 * 60
+PRUNE_BATCH = 20
+PRUNE_PAUSE = 0.05
+# labels the tracker puts on snapshots it takes by itself. they are not user notes, retention may thin them
+NOTE_FILE_CHANGE = "auto-snapshot on file change"
+NOTE_NEW_FILE = "auto-snapshot for new file"
+NOTE_BEFORE_RESTORE = "auto-snapshot before restore"
+AUTO_NOTES = frozenset((NOTE_FILE_CHANGE, NOTE_NEW_FILE, NOTE_BEFORE_RESTORE))
+RETENTION_FIELDS = [
+    ("keep_all_hours", "keep everything for (hours)"),
+    ("hourly_days", "then one per hour for (days)"),
+    ("daily_days", "then one per day for (days)"),
+    ("weekly_weeks", "then one per week for (weeks)"),
+    ("max_count", "at most this many snapshots per file"),
+    ("max_mb", "at most this many mb per file"),
+]
+BASELINE_BATCH = 200
+DIFF_CONTEXT = 3
+DIFF_PAGE_ROWS = 500
+DIFF_TIME_BUDGET = 0.5
+DIFF_MAX_EDITS = 2000
+SEARCH_MAX_BYTES = 8 * 1024 * 1024
+SEARCH_MAX_TERM = 64
+SEARCH_RESULT_LIMIT = 200
+SEARCH_INDEX_KEY = "<search-index>"
+STARTUP_REPORT_KEY = "<startup-report>"
+REF_SUFFIX = ".bkref"
+NOTES_JOURNAL = "notes.journal"
+SNAPSHOT_META_FILES = ["notes.json", NOTES_JOURNAL, "settings.json"]
+NOTES_JOURNAL_MAX_BYTES = 64 * 1024
+NOTES_SYNC_BATCH = 64
+NOTES_SYNC_SECONDS = 2.0
+COPY_CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+CONTENT_HASH = "sha256"
+HASH_READ_SIZE = 1024 * 1024
+HASH_WORKERS = min(8, os.cpu_count() or 2)
+DELTA_SUFFIX = ".delta"
+DEFAULT_KEYFRAME_INTERVAL = 20
+DELTA_MAX_BYTES = 32 * 1024 * 1024
+DELTA_MAX_LINES = 5000
+ARCHIVE_FORMAT = 2
+ARCHIVE_MANIFEST = "manifest.json"
+MATERIALIZED_KEEP = 32
+THUMBNAIL_SIZE = 360
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+METRICS_LOG_BYTES = 1024 * 1024
+METRICS_LOG_INTERVAL_MS = 60 * 1000
+
+TEXT_EXTENSIONS = ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.log']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif']
+# files modified this recently might still change within the same mtime tick
+RACY_MTIME_NS = 2 * 1000 * 1000 * 1000
+
+DIFF_CSS = """
+<style>
+body { background-color: #3c3f41; color: #f0f0f0; font-family: Consolas, 'Courier New', monospace; margin: 0; padding: 0; }
+.layout-table { width: 100%; border-collapse: collapse; }
+.layout-table td { width: 50%; vertical-align: top; }
+.layout-table td:first-child { border-right: 1px solid #4f5254; }
+.content-table { table-layout: fixed; width: 100%; border-collapse: collapse; font-size: 9.5pt; }
+.content-table th { background-color: #2b2b2b; padding: 5px; text-align: left; font-weight: bold; border-bottom: 2px solid #222; }
+.content-table td { padding: 1px 5px; vertical-align: top; word-wrap: break-word; }
+.lineno { width: 40px; color: #888; text-align: right; padding-right: 10px; -webkit-user-select: none; user-select: none; }
+.diff_add { background-color: #2a472a; }
+.diff_sub { background-color: #582a2a; }
+.empty_row { background-color: #3c3f41; }
+.collapsed { background-color: #2f3133; color: #888; }
+a { color: #8ab4f8; text-decoration: none; }
+pre { margin: 0; white-space: pre-wrap; }
+</style>
+"""
+
+class Metrics:
+    # timings and counters for the hot paths, off unless asked for. while off, timed() hands back one shared
+    # do-nothing context and count() returns straight away, so instrumented code pays a single attribute check
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.since = datetime.now()
+            self.started = time.monotonic()
+
+    def timed(self, name):
+        return MetricsTimer(self, name) if self.enabled else NO_TIMER
+
+    def record(self, name, seconds):
+        with self.lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                if seconds > t[2]: t[2] = seconds
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            timers = {name: {"calls": calls, "total_ms": total * 1000, "mean_ms": total * 1000 / calls, "max_ms": most * 1000}
+                      for name, (calls, total, most) in self.timers.items()}
+            counters = {name: {"count": n, "per_second": n / elapsed} for name, n in self.counters.items()}
+        return {"since": self.since.isoformat(timespec="seconds"), "elapsed_s": elapsed, "enabled": self.enabled,
+                "timers": timers, "counters": counters}
+
+    def summary(self, limit=3):
+        # one line for a status bar: where most of the time went and how busy the watcher is
+        snap = self.snapshot()
+        busiest = sorted(snap["timers"].items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:limit]
+        parts = [f"{name} {t['total_ms'] / 1000:.1f}s/{t['calls']}" for name, t in busiest]
+        events = snap["counters"].get("watch_events")
+        parts.append(f"{events['per_second'] if events else 0:.1f} events/s")
+        return " · ".join(parts)
+
+    def format_report(self):
+        snap = self.snapshot()
+        lines = [f"since {snap['since'].replace('T', ' ')} ({snap['elapsed_s']:.0f}s)", "",
+                 f"{'timer':28} {'calls':>8} {'total ms':>11} {'mean ms':>9} {'max ms':>9}"]
+        for name, t in sorted(snap["timers"].items(), key=lambda kv: kv[1]["total_ms"], reverse=True):
+            lines.append(f"{name:28} {t['calls']:8} {t['total_ms']:11.1f} {t['mean_ms']:9.2f} {t['max_ms']:9.1f}")
+        if snap["counters"]:
+            lines += ["", f"{'counter':28} {'count':>8} {'per second':>11}"]
+            for name, c in sorted(snap["counters"].items()):
+                lines.append(f"{name:28} {c['count']:8} {c['per_second']:11.2f}")
+        return "\n".join(lines)
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def write_log(self, path=METRICS_LOG_PATH, max_bytes=METRICS_LOG_BYTES):
+        # one json line per call; the log rolls over to a single .1 backup once it grows past max_bytes
+        line = json.dumps(dict(self.snapshot(), when=datetime.now().isoformat(timespec="seconds")))
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > max_bytes: os.replace(path, path + ".1")
+            with open(path, "a") as f: f.write(line + "\n")
+        except OSError:
+            pass
+
+class MetricsTimer:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+
+NO_TIMER = contextlib.nullcontext()
+metrics = Metrics()
+
+def instrumented(name):
+    # times every call of the decorated function under name while metrics are on
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled: return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+class ChangeCache:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.entries = {p: tuple(e) for p, e in data.items() if isinstance(e, list) and len(e) == 4}
+        except (IOError, ValueError, AttributeError):
+            self.entries = {}
+        self.dirty = False
+
+    # saves come from workers, the gui thread and shutdown at once: each writes its own temp file, and
+    # save_lock keeps an older copy of the entries from replacing a newer one
+    def save(self):
+        if not self.dirty: return
+        with self.save_lock:
+            with self.lock:
+                entries = dict(self.entries)
+                self.dirty = False
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=os.path.basename(self.path) + ".tmp-")
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except IOError:
+                if tmp_path and os.path.exists(tmp_path): os.remove(tmp_path)
+                self.dirty = True
+                print("sum happened, could not save hash cache.")
+
+    def get_hash(self, path, hasher):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.forget(path)
+            return None
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        entry = self.entries.get(path)
+        if entry and entry[:3] == signature:
+            return entry[3]
+        digest = hasher(path)
+        if digest and time.time_ns() - st.st_mtime_ns > RACY_MTIME_NS:
+            with self.lock:
+                self.entries[path] = signature + (digest,)
+                self.dirty = True
+        else:
+            self.forget(path)
+        return digest
+
+    # for content written by us whose hash is already known, e.g. a restored version
+    def remember(self, path, digest):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if digest and time.time_ns() - st.st_mtime_ns > RACY_MTIME_NS:
+            with self.lock:
+                self.entries[path] = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+                self.dirty = True
+
+    def forget(self, path):
+        with self.lock:
+            if self.entries.pop(path, None) is not None:
+                self.dirty = True
+
+    def prune(self, keep):
+        with self.lock:
+            stale = [p for p in self.entries if p not in keep]
+            for p in stale: del self.entries[p]
+            if stale: self.dirty = True
+
+class SnapshotIndex:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        orig_path TEXT,
+        ts TEXT NOT NULL,
+        custom_name TEXT,
+        note TEXT NOT NULL DEFAULT '',
+        size INTEGER NOT NULL DEFAULT 0,
+        digest TEXT,
+        search_key TEXT NOT NULL DEFAULT '',
+        UNIQUE (file_id, name)
+    );
+    CREATE INDEX IF NOT EXISTS snapshots_by_time ON snapshots (file_id, ts DESC);
+    CREATE INDEX IF NOT EXISTS snapshots_by_digest ON snapshots (digest);
+    CREATE TABLE IF NOT EXISTS indexed_dirs (file_id TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS search_terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE);
+    CREATE TABLE IF NOT EXISTS search_contents (id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE, line_starts BLOB NOT NULL);
+    CREATE TABLE IF NOT EXISTS search_postings (
+        term_id INTEGER NOT NULL,
+        content_id INTEGER NOT NULL,
+        positions BLOB NOT NULL,
+        PRIMARY KEY (term_id, content_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS search_postings_by_content ON search_postings (content_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        try:
+            self.conn = self.connect()
+        except sqlite3.DatabaseError:
+            # the index only mirrors what is on disk, a broken one is simply rebuilt
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix): os.remove(path + suffix)
+            self.conn = self.connect()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    @staticmethod
+    def row_fields(name, note):
+        m = re.search(r'^(.*?)_?(\d{8}_\d{6}_\d{6})', name)
+        custom_name = m.group(1) if m and m.group(1) else None
+        search_key = f"{format_snap_time(name)}\n{note}".lower()
+        return custom_name, search_key
+
+    def ensure_indexed(self, file_path):
+        file_id = hash_file_path(file_path)
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM indexed_dirs WHERE file_id = ?", (file_id,)).fetchone():
+                return
+            self.reindex_dir(file_id, file_path)
+
+    def reindex_dir(self, file_id, orig_path=None):
+        snapdir = os.path.join(SNAPSHOTS_BASE, file_id)
+        rows = []
+        if os.path.isdir(snapdir):
+            notes = notes_journal.read(snapdir)
+            for f in os.listdir(snapdir):
+                if f in SNAPSHOT_META_FILES: continue
+                entry_path = os.path.join(snapdir, f)
+                if f.endswith(REF_SUFFIX):
+                    name = f[:-len(REF_SUFFIX)]
+                    ref = read_snapshot_ref(entry_path)
+                    if not ref: continue
+                    digest, size = ref["blob"], ref.get("size", 0)
+                    orig_path = orig_path or ref.get("path")
+                else:
+                    name, digest = f, None
+                    try: size = os.path.getsize(entry_path)
+                    except OSError: continue
+                note = notes.get(name, "")
+                rows.append((file_id, name, snapshot_sort_key(entry_path, name), note, size, digest) + self.row_fields(name, note))
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshots WHERE file_id = ?", (file_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (file_id, name, ts, note, size, digest, custom_name, search_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if orig_path:
+                self.conn.execute("UPDATE snapshots SET orig_path = ? WHERE file_id = ?", (orig_path, file_id))
+            self.conn.execute("INSERT OR IGNORE INTO indexed_dirs (file_id) VALUES (?)", (file_id,))
+
+    def rebuild(self, known_paths=()):
+        paths_by_id = {hash_file_path(p): p for p in known_paths}
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshots")
+            self.conn.execute("DELETE FROM indexed_dirs")
+        for file_id in os.listdir(SNAPSHOTS_BASE):
+            if os.path.isdir(os.path.join(SNAPSHOTS_BASE, file_id)):
+                self.reindex_dir(file_id, paths_by_id.get(file_id))
+
+    def add(self, file_path, name, ts, size, digest, note=""):
+        self.ensure_indexed(file_path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots (file_id, name, orig_path, ts, note, size, digest, custom_name, search_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (hash_file_path(file_path), name, file_path, ts, note or "", size, digest) + self.row_fields(name, note or ""))
+
+    def remove(self, file_path, name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshots WHERE file_id = ? AND name = ?", (hash_file_path(file_path), name))
+
+    def remove_file(self, file_path):
+        file_id = hash_file_path(file_path)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshots WHERE file_id = ?", (file_id,))
+            self.conn.execute("DELETE FROM indexed_dirs WHERE file_id = ?", (file_id,))
+
+    def rename(self, file_path, old_name, new_name):
+        file_id = hash_file_path(file_path)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT note FROM snapshots WHERE file_id = ? AND name = ?", (file_id, old_name)).fetchone()
+            note = row[0] if row else ""
+            custom_name, search_key = self.row_fields(new_name, note)
+            self.conn.execute("UPDATE snapshots SET name = ?, custom_name = ?, search_key = ? WHERE file_id = ? AND name = ?",
+                              (new_name, custom_name, search_key, file_id, old_name))
+
+    def set_note(self, file_path, name, note):
+        _, search_key = self.row_fields(name, note)
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE snapshots SET note = ?, search_key = ? WHERE file_id = ? AND name = ?",
+                              (note, search_key, hash_file_path(file_path), name))
+
+    def list(self, file_path):
+        self.ensure_indexed(file_path)
+        with self.lock:
+            rows = self.conn.execute("SELECT name FROM snapshots WHERE file_id = ? ORDER BY ts DESC, name DESC", (hash_file_path(file_path),)).fetchall()
+        return [r[0] for r in rows]
+
+    def latest(self, file_path):
+        self.ensure_indexed(file_path)
+        with self.lock:
+            row = self.conn.execute("SELECT name FROM snapshots WHERE file_id = ? ORDER BY ts DESC, name DESC LIMIT 1", (hash_file_path(file_path),)).fetchone()
+        return row[0] if row else None
+
+    def get(self, file_path, name):
+        self.ensure_indexed(file_path)
+        with self.lock:
+            row = self.conn.execute("SELECT note, size, digest FROM snapshots WHERE file_id = ? AND name = ?", (hash_file_path(file_path), name)).fetchone()
+        return {"note": row[0], "size": row[1], "digest": row[2]} if row else None
+
+    def notes(self, file_path):
+        self.ensure_indexed(file_path)
+        with self.lock:
+            rows = self.conn.execute("SELECT name, note FROM snapshots WHERE file_id = ? AND note != ''", (hash_file_path(file_path),)).fetchall()
+        return dict(rows)
+
+    def page(self, file_path, text="", after=None, limit=200):
+        # keyset paging on (ts, name), so every page costs the same no matter how deep it is
+        self.ensure_indexed(file_path)
+        sql = "SELECT name, note, ts FROM snapshots WHERE file_id = ?"
+        args = [hash_file_path(file_path)]
+        if text:
+            sql += " AND search_key LIKE ? ESCAPE '\\'"
+            args.append("%" + text.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if after:
+            sql += " AND (ts, name) < (?, ?)"
+            args.extend(after)
+        sql += " ORDER BY ts DESC, name DESC LIMIT ?"
+        args.append(limit)
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def retention_rows(self, file_path):
+        self.ensure_indexed(file_path)
+        with self.lock:
+            return self.conn.execute("SELECT name, ts, size, digest, note, custom_name FROM snapshots WHERE file_id = ? ORDER BY ts DESC, name DESC",
+                                     (hash_file_path(file_path),)).fetchall()
+
+    def files_under(self, path):
+        prefix = os.path.join(path, "")
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT orig_path FROM snapshots WHERE orig_path = ? OR substr(orig_path, 1, ?) = ?",
+                                     (path, len(prefix), prefix)).fetchall()
+        return [r[0] for r in rows]
+
+    def digest_counts(self, digests):
+        digests, counts = list(digests), {}
+        with self.lock:
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                counts.update(self.conn.execute(f"SELECT digest, COUNT(*) FROM snapshots WHERE digest IN ({','.join('?' * len(chunk))}) GROUP BY digest", chunk))
+        return counts
+
+    # full-text search: postings are keyed by blob digest, so identical versions are indexed once.
+    # positions are token offsets into the content and line_starts maps them back to line numbers.
+    @staticmethod
+    def tokenize(text):
+        return [t for t in re.findall(r"\w+", text.lower()) if len(t) <= SEARCH_MAX_TERM]
+
+    def is_content_indexed(self, digest):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM search_contents WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def index_content(self, digest, text):
+        positions, line_starts, pos = {}, array.array("I"), 0
+        # lines are counted the way TextDiff reads them (universal newlines), so a hit opens on the right row.
+        # splitlines would also break on form feeds and unicode separators
+        for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+            line_starts.append(pos)
+            for term in self.tokenize(line):
+                positions.setdefault(term, array.array("I")).append(pos)
+                pos += 1
+        with self.lock, self.conn:
+            if self.conn.execute("SELECT 1 FROM search_contents WHERE digest = ?", (digest,)).fetchone(): return
+            content_id = self.conn.execute("INSERT INTO search_contents (digest, line_starts) VALUES (?, ?)", (digest, line_starts.tobytes())).lastrowid
+            self.conn.executemany("INSERT OR IGNORE INTO search_terms (term) VALUES (?)", ((t,) for t in positions))
+            term_ids = {}
+            terms = list(positions)
+            for i in range(0, len(terms), 500):
+                chunk = terms[i:i + 500]
+                term_ids.update(self.conn.execute(f"SELECT term, id FROM search_terms WHERE term IN ({','.join('?' * len(chunk))})", chunk))
+            self.conn.executemany("INSERT INTO search_postings (term_id, content_id, positions) VALUES (?, ?, ?)",
+                                  ((term_ids[t], content_id, p.tobytes()) for t, p in positions.items()))
+
+    def unindexed_contents(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT DISTINCT s.digest, s.name FROM snapshots s LEFT JOIN search_contents c ON c.digest = s.digest "
+                "WHERE s.digest IS NOT NULL AND c.id IS NULL").fetchall()
+
+    def prune_search(self, live_digests):
+        with self.lock, self.conn:
+            dead = [(cid,) for cid, digest in self.conn.execute("SELECT id, digest FROM search_contents") if digest not in live_digests]
+            self.conn.executemany("DELETE FROM search_postings WHERE content_id = ?", dead)
+            self.conn.executemany("DELETE FROM search_contents WHERE id = ?", dead)
+        return len(dead)
+
+    def match_terms(self, token, mode):
+        like = token.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if mode == "exact":
+            sql, args = "SELECT id FROM search_terms WHERE term = ?", (token,)
+        elif mode == "prefix":
+            sql, args = "SELECT id FROM search_terms WHERE term >= ? AND term < ?", (token, token + "\uffff")
+        elif mode == "suffix":
+            sql, args = "SELECT id FROM search_terms WHERE term LIKE ? ESCAPE '\\'", ("%" + like,)
+        else:
+            sql, args = "SELECT id FROM search_terms WHERE term LIKE ? ESCAPE '\\'", ("%" + like + "%",)
+        return [r[0] for r in self.conn.execute(sql, args)]
+
+    def term_positions(self, term_ids, content_ids=None):
+        found = {}
+        # once earlier words narrowed things down, only those postings are read
+        narrow = sorted(content_ids) if content_ids is not None and len(content_ids) <= 400 else None
+        for i in range(0, len(term_ids), 500):
+            chunk = term_ids[i:i + 500]
+            sql = f"SELECT content_id, positions FROM search_postings WHERE term_id IN ({','.join('?' * len(chunk))})"
+            if narrow is not None:
+                sql += f" AND content_id IN ({','.join('?' * len(narrow))})"
+                chunk = chunk + narrow
+            for content_id, blob in self.conn.execute(sql, chunk):
+                if content_ids is not None and content_id not in content_ids: continue
+                found.setdefault(content_id, set()).update(array.array("I", blob))
+        return found
+
+    def clause_hits(self, tokens, content_ids):
+        # a lone word matches inside any term; in a phrase the first word may be a suffix,
+        # the last a prefix and the ones in between have to match whole terms
+        if len(tokens) == 1:
+            modes = ["substring"]
+        else:
+            modes = ["suffix"] + ["exact"] * (len(tokens) - 2) + ["prefix"]
+        hits = None
+        for offset, (token, mode) in enumerate(zip(tokens, modes)):
+            found = self.term_positions(self.match_terms(token, mode), content_ids)
+            if hits is None:
+                hits = found
+            else:
+                hits = {cid: {p for p in starts if p + offset in found[cid]} for cid, starts in hits.items() if cid in found}
+                hits = {cid: starts for cid, starts in hits.items() if starts}
+            content_ids = set(hits)
+            if not hits: break
+        return hits or {}
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        clauses = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            tokens = self.tokenize(phrase or word)
+            if phrase: clauses.append(tokens)
+            else: clauses.extend([t] for t in tokens)
+        clauses = [c for c in clauses if c]
+        if not clauses: return []
+        with self.lock:
+            content_ids, lines = None, {}
+            for tokens in clauses:
+                hits = self.clause_hits(tokens, content_ids)
+                content_ids = set(hits)
+                lines = {cid: lines.get(cid, set()) | hits[cid] for cid in content_ids}
+                if not content_ids: return []
+            results = []
+            for cid in content_ids:
+                digest, line_starts = self.conn.execute("SELECT digest, line_starts FROM search_contents WHERE id = ?", (cid,)).fetchone()
+                starts = array.array("I", line_starts)
+                line_numbers = sorted({bisect.bisect_right(starts, p) for p in lines[cid]})
+                for orig_path, name, ts in self.conn.execute(
+                        "SELECT orig_path, name, ts FROM snapshots WHERE digest = ? AND orig_path IS NOT NULL", (digest,)):
+                    results.append((ts, orig_path, name, line_numbers))
+        results.sort(key=lambda r: r[0], reverse=True)
+        return [{"path": p, "name": n, "lines": ln} for _, p, n, ln in results[:limit]]
+
+def translate_ignore_glob(pattern):
+    res, i, n = [], 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 3] == '**/':
+                res.append('(?:.*/)?'); i += 3; continue
+            if pattern[i:i + 2] == '**':
+                res.append('.*'); i += 2; continue
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2 if pattern[i + 1:i + 2] in ('!', ']') else i + 1)
+            if j == -1:
+                res.append('\\[')
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body.startswith('!'): body = '^' + body[1:]
+                res.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res.append(re.escape(pattern[i]))
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return ''.join(res)
+
+class IgnoreMatcher:
+    # gitignore-style rules: plain names match at any depth, patterns with a slash are
+    # anchored to the tracked folder, full paths (a drive letter, a unc prefix or a leading //)
+    # match the whole path, a trailing slash only matches folders and a leading ! re-includes.
+    # last match wins.
+    DIR_CACHE_LIMIT = 50000
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        flags = re.IGNORECASE if os.name == "nt" else 0
+        rules = {"name": ([], []), "rel": ([], []), "abs": ([], [])}
+        self.negated = {}
+        for idx, line in enumerate(self.patterns):
+            negate = line.startswith('!')
+            if negate: line = line[1:]
+            dir_only = line.endswith('/') or line.endswith('\\')
+            line = line.rstrip('/\\')
+            if not line: continue
+            full_path = self.full_path_pattern(line)
+            if full_path is not None:
+                kind, regex = "abs", fnmatch.translate(full_path.replace('\\', '/'))
+            elif '/' in line:
+                kind, regex = "rel", translate_ignore_glob(line.lstrip('/'))
+            else:
+                kind, regex = "name", translate_ignore_glob(line)
+            self.negated[idx] = negate
+            group = f"(?P<r{idx}>{regex})"
+            rules[kind][1].append(group)
+            if not dir_only: rules[kind][0].append(group)
+        # alternatives are tried in order, so listing later rules first makes the first hit the winner
+        self.compiled = {}
+        for kind, (file_groups, dir_groups) in rules.items():
+            self.compiled[kind] = tuple(re.compile('|'.join(reversed(g)), flags) if g else None for g in (file_groups, dir_groups))
+        self.has_dir_rules = any(self.compiled[k][1] is not None for k in self.compiled)
+        self.dir_cache = {}
+
+    @staticmethod
+    def full_path_pattern(line):
+        # the pattern to match whole paths with, or None for rules relative to the tracked folder. it only
+        # depends on how the rule is written: "/lib/vendor" is anchored on every machine, "//home/me/*.log"
+        # is the full path /home/me/*.log, and on windows // and \\ start a unc path
+        if re.match(r'^[A-Za-z]:[\\/]', line): return line
+        if line.startswith('//') or line.startswith('\\\\'):
+            return line if os.name == "nt" else line[1:]
+        return None
+
+    def __bool__(self):
+        return bool(self.negated)
+
+    def match_entry(self, path, rel, is_dir):
+        # decision for one entry, assuming none of its parent folders are excluded
+        if not self.negated: return False
+        which = 1 if is_dir else 0
+        best = -1
+        for kind, value in (("name", os.path.basename(path)), ("rel", rel), ("abs", path.replace('\\', '/'))):
+            regex = self.compiled[kind][which]
+            if regex is None or (kind == "rel" and not rel): continue
+            m = regex.fullmatch(value)
+            if m: best = max(best, int(m.lastgroup[1:]))
+        return best >= 0 and not self.negated[best]
+
+    def is_ignored(self, path, root, is_dir=None):
+        if not self.negated: return False
+        rel = os.path.relpath(path, root).replace('\\', '/') if root else ""
+        if rel == "." or rel.startswith("../"): rel = ""
+        parent_rel = rel
+        parents = []
+        while '/' in parent_rel:
+            parent_rel = parent_rel.rsplit('/', 1)[0]
+            parents.append(parent_rel)
+        for parent in [""] + parents[::-1] if rel else []:
+            if self.dir_ignored(os.path.join(root, parent) if parent else root, parent):
+                return True
+        if is_dir is None:
+            is_dir = self.has_dir_rules and os.path.isdir(path)
+        return self.match_entry(path, rel, is_dir)
+
+    def dir_ignored(self, path, rel):
+        cached = self.dir_cache.get(path)
+        if cached is None:
+            if len(self.dir_cache) > self.DIR_CACHE_LIMIT: self.dir_cache.clear()
+            cached = self.dir_cache[path] = self.match_entry(path, rel, True)
+        return cached
+
+def hash_file_path(path):
+    return hashlib.sha256(os.path.abspath(path).lower().encode("utf-8")).hexdigest()
+
+def get_snapshot_dir(file_path):
+    file_id = hash_file_path(file_path)
+    dir_path = os.path.join(SNAPSHOTS_BASE, file_id)
+    os.makedirs(dir_path, exist_ok=True)
+    return dir_path
+
+def get_notes_path(file_path):
+    return os.path.join(get_snapshot_dir(file_path), "notes.json")
+
+def read_notes_file(notes_path):
+    if os.path.exists(notes_path):
+        with open(notes_path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+    return {}
+
+def fsync_dir(path):
+    if os.name == "nt": return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError:
+        pass
+
+class NotesJournal:
+    # note changes are appended to notes.journal next to notes.json, one json line each, so an edit costs
+    # the same however many notes a file has. once the journal passes NOTES_JOURNAL_MAX_BYTES it is folded
+    # into notes.json, which is only ever replaced whole through a temp file. appends reach the disk in
+    # batches (NOTES_SYNC_BATCH files or NOTES_SYNC_SECONDS, and at exit); a line torn by a crash is skipped
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.unsynced = set()
+        self.sync_timer = None
+
+    @staticmethod
+    def apply(notes, line):
+        try: op = json.loads(line)
+        except ValueError: return
+        if not isinstance(op, dict): return
+        if "set" in op:
+            if op.get("note"): notes[op["set"]] = op["note"]
+            else: notes.pop(op["set"], None)
+        elif "move" in op and op["move"][0] in notes:
+            notes[op["move"][1]] = notes.pop(op["move"][0])
+
+    def read(self, snapdir):
+        notes = read_notes_file(os.path.join(snapdir, "notes.json"))
+        try:
+            with open(os.path.join(snapdir, NOTES_JOURNAL), "r", encoding="utf-8", errors="replace") as f:
+                for line in f: self.apply(notes, line)
+        except OSError:
+            pass
+        return notes
+
+    def append(self, snapdir, op):
+        line = (json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8")
+        path = os.path.join(snapdir, NOTES_JOURNAL)
+        with self.lock, open(path, "a+b") as f:
+            # the daemon and the app may share a snapshot folder, compaction must not drop the other's lines
+            if fcntl is not None: fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n": line = b"\n" + line
+            f.write(line)
+            f.flush()
+            if f.tell() > NOTES_JOURNAL_MAX_BYTES:
+                self.compact(snapdir, f)
+                return
+            self.unsynced.add(path)
+            if len(self.unsynced) >= NOTES_SYNC_BATCH:
+                self.sync_locked()
+            elif self.sync_timer is None:
+                self.sync_timer = threading.Timer(NOTES_SYNC_SECONDS, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+
+    def replace(self, snapdir, notes):
+        # notes becomes the whole set of notes for the folder, anything still in the journal is dropped
+        with self.lock, open(os.path.join(snapdir, NOTES_JOURNAL), "a+b") as f:
+            if fcntl is not None: fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.compact(snapdir, f, notes)
+
+    def compact(self, snapdir, journal, notes=None):
+        if notes is None: notes = self.read(snapdir)
+        fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOTS_BASE, prefix="tmp-notes-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(notes, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(snapdir, "notes.json"))
+        except Exception:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+        fsync_dir(snapdir)
+        # replaying a journal over the notes it was folded into changes nothing, so a crash before
+        # this truncate is harmless
+        journal.truncate(0)
+        self.unsynced.discard(journal.name)
+
+    def sync(self):
+        with self.lock: self.sync_locked()
+
+    def sync_locked(self):
+        if self.sync_timer is not None:
+            self.sync_timer.cancel()
+            self.sync_timer = None
+        for path in self.unsynced:
+            try:
+                with open(path, "ab") as f: os.fsync(f.fileno())
+            except OSError:
+                pass
+        self.unsynced.clear()
+
+notes_journal = NotesJournal()
+atexit.register(notes_journal.sync)
+
+def load_notes(file_path):
+    return notes_journal.read(get_snapshot_dir(file_path))
+
+def save_notes(file_path, notes):
+    notes_journal.replace(get_snapshot_dir(file_path), notes)
+
+def set_snapshot_note(file_path, snap_name, note):
+    notes_journal.append(get_snapshot_dir(file_path), {"set": snap_name, "note": note or ""})
+    snapshot_index.set_note(file_path, snap_name, note)
+
+def hash_cache_path(algorithm):
+    if algorithm == CONTENT_HASH: return HASH_CACHE_PATH
+    return os.path.join(APP_DATA_BASE, f"hash_cache-{algorithm}.json")
+
+def current_timestamp():
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+SNAPSHOT_NAME_RE = re.compile(r'^[^/\\:\x00]*\d{8}_\d{6}_\d{6}[^/\\:\x00]*$')
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def is_valid_digest(digest):
+    # digests become blob paths, only a plain sha256 hex digest can be trusted with that
+    return isinstance(digest, str) and bool(DIGEST_RE.match(digest))
+
+def is_valid_snapshot_name(name):
+    # names end up as file names inside a snapshot folder, so anything that could point elsewhere is refused
+    return isinstance(name, str) and ".." not in name and not name.endswith(REF_SUFFIX) and bool(SNAPSHOT_NAME_RE.match(name))
+
+def make_snapshot_name(orig_name):
+    _, ext = os.path.splitext(orig_name)
+    return f"{current_timestamp()}{ext}"
+
+class BlobStoreLock:
+    # code that writes a blob holds this (shared) until the .bkref pointing at it is on disk, garbage
+    # collection holds it alone, so it never sees a fresh blob before its ref and deletes it. a waiting
+    # collection holds back new writers, and writers held back get their turn before the next collection.
+    # the daemon and the app share the store, so both modes also flock BLOBS_LOCK_PATH to keep the same
+    # rule between processes. without fcntl collection falls back to sparing young blobs
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.writers = 0
+        self.blocked = 0
+        self.collecting = False
+        self.waiting = 0
+        self.writers_turn = False
+
+    @contextlib.contextmanager
+    def writing(self):
+        with self.cond:
+            self.blocked += 1
+            while self.collecting or (self.waiting and not self.writers_turn): self.cond.wait()
+            self.blocked -= 1
+            if not self.blocked: self.writers_turn = False
+            self.writers += 1
+        try:
+            with self.file_lock(exclusive=False):
+                yield
+        finally:
+            with self.cond:
+                self.writers -= 1
+                self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self.cond:
+            self.waiting += 1
+            while self.collecting or self.writers or (self.writers_turn and self.blocked): self.cond.wait()
+            self.waiting -= 1
+            self.collecting = True
+        try:
+            with self.file_lock(exclusive=True):
+                yield
+        finally:
+            with self.cond:
+                self.collecting = False
+                self.writers_turn = True
+                self.cond.notify_all()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def file_lock(exclusive):
+        if fcntl is None:
+            yield
+            return
+        # one open per holder, flock locks belong to the open file so threads here do not share them
+        with open(BLOBS_LOCK_PATH, "a+b") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+blob_store_lock = BlobStoreLock()
+
+def blob_path(digest):
+    return os.path.join(BLOBS_BASE, digest[:2], digest)
+
+def delta_path(digest):
+    return blob_path(digest) + DELTA_SUFFIX
+
+def blob_exists(digest):
+    return os.path.exists(blob_path(digest)) or os.path.exists(delta_path(digest))
+
+def read_delta_header(digest):
+    try:
+        with open(delta_path(digest), "rb") as f:
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+def common_run_length(a, b, limit, from_end):
+    # binary search over slice comparisons keeps the byte scanning in C
+    a, b = memoryview(a), memoryview(b)
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if from_end: same = a[len(a) - mid:] == b[len(b) - mid:]
+        else: same = a[:mid] == b[:mid]
+        if same: lo = mid
+        else: hi = mid - 1
+    return lo
+
+def make_delta(base, new):
+    import difflib
+    # ops are [0, offset, length] to copy from the base and [1, length] to take literal bytes
+    limit = min(len(base), len(new))
+    prefix = common_run_length(base, new, limit, from_end=False)
+    suffix = common_run_length(base, new, limit - prefix, from_end=True)
+    ops, literal = [], bytearray()
+    def copy(offset, length):
+        if length: ops.append([0, offset, length])
+    def insert(data):
+        if not data: return
+        if ops and ops[-1][0] == 1: ops[-1][1] += len(data)
+        else: ops.append([1, len(data)])
+        literal.extend(data)
+
+    copy(0, prefix)
+    base_mid = base[prefix:len(base) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+    base_lines = base_mid.splitlines(keepends=True)
+    new_lines = new_mid.splitlines(keepends=True)
+    if base_lines and new_lines and max(len(base_lines), len(new_lines)) <= DELTA_MAX_LINES:
+        base_offsets = [prefix]
+        for line in base_lines: base_offsets.append(base_offsets[-1] + len(line))
+        new_offsets = [0]
+        for line in new_lines: new_offsets.append(new_offsets[-1] + len(line))
+        seq = difflib.SequenceMatcher(None, base_lines, new_lines, autojunk=False)
+        for opcode, i1, i2, j1, j2 in seq.get_opcodes():
+            if opcode == "equal": copy(base_offsets[i1], base_offsets[i2] - base_offsets[i1])
+            else: insert(new_mid[new_offsets[j1]:new_offsets[j2]])
+    else:
+        insert(new_mid)
+    copy(len(base) - suffix, suffix)
+    return ops, bytes(literal)
+
+def apply_delta(base, ops, literal):
+    out = bytearray()
+    pos = 0
+    for op in ops:
+        if op[0] == 0:
+            out.extend(base[op[1]:op[1] + op[2]])
+        else:
+            out.extend(literal[pos:pos + op[1]])
+            pos += op[1]
+    return bytes(out)
+
+def read_blob_bytes(digest):
+    chain = []
+    while not os.path.exists(blob_path(digest)):
+        with open(delta_path(digest), "rb") as f:
+            header = json.loads(f.readline())
+            payload = zlib.decompress(f.read())
+        chain.append(payload)
+        digest = header["base"]
+    with open(blob_path(digest), "rb") as f:
+        data = f.read()
+    for payload in reversed(chain):
+        ops_line, _, literal = payload.partition(b"\n")
+        data = apply_delta(data, json.loads(ops_line), literal)
+    return data
+
+def materialize_blob(digest):
+    if os.path.exists(blob_path(digest)): return blob_path(digest)
+    dest = os.path.join(MATERIALIZED_DIR, digest)
+    if os.path.exists(dest):
+        os.utime(dest)
+        return dest
+    os.makedirs(MATERIALIZED_DIR, exist_ok=True)
+    data = read_blob_bytes(digest)
+    fd, tmp_path = tempfile.mkstemp(dir=MATERIALIZED_DIR, prefix="tmp-")
+    with os.fdopen(fd, "wb") as f: f.write(data)
+    os.replace(tmp_path, dest)
+    def mtime(path):
+        try: return os.path.getmtime(path)
+        except OSError: return 0
+    cached = sorted((os.path.join(MATERIALIZED_DIR, f) for f in os.listdir(MATERIALIZED_DIR)), key=mtime, reverse=True)
+    for old in cached[MATERIALIZED_KEEP:]:
+        try: os.remove(old)
+        except OSError: pass
+    return dest
+
+def write_blob_file(dest, data):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOBS_BASE, prefix="tmp-")
+    with os.fdopen(fd, "wb") as f: f.write(data)
+    os.replace(tmp_path, dest)
+
+def store_delta_blob(src, base_digest, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    if os.path.getsize(src) > DELTA_MAX_BYTES or not base_digest or not blob_exists(base_digest):
+        return store_blob(src)
+    with open(src, "rb") as f: data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if blob_exists(digest): return digest, len(data)
+    header = read_delta_header(base_digest) if not os.path.exists(blob_path(base_digest)) else None
+    depth = header["depth"] + 1 if header else 1
+    if depth < keyframe_interval:
+        ops, literal = make_delta(read_blob_bytes(base_digest), data)
+        payload = zlib.compress(json.dumps(ops).encode("utf-8") + b"\n" + literal, 9)
+        if len(payload) < len(data):
+            header = json.dumps({"base": base_digest, "depth": depth, "size": len(data)}).encode("utf-8")
+            write_blob_file(delta_path(digest), header + b"\n" + payload)
+            return digest, len(data)
+    # keyframe, so rebuilding any version never replays more than keyframe_interval deltas
+    write_blob_file(blob_path(digest), data)
+    shutil.copystat(src, blob_path(digest))
+    return digest, len(data)
+
+def copy_stream_with_hash(fin, fout):
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: fin.read(COPY_CHUNK_SIZE), b""):
+        sha256.update(chunk)
+        fout.write(chunk)
+        size += len(chunk)
+    return sha256.hexdigest(), size
+
+def hash_stream(fin):
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: fin.read(COPY_CHUNK_SIZE), b""): sha256.update(chunk)
+    return sha256.hexdigest()
+
+def clone_file(fin, fout):
+    # copy-on-write clone on btrfs/xfs and friends: shares the extents, nothing is read or written
+    if fcntl is None: return False
+    try:
+        fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        return True
+    except OSError:
+        return False
+
+def kernel_copy(fin, fout):
+    # copy_file_range (or sendfile) keeps the bytes inside the kernel. only falls back while nothing
+    # was copied yet, a failure halfway through is a real error
+    src, dst = fin.fileno(), fout.fileno()
+    if hasattr(os, "copy_file_range"):
+        copied = 0
+        try:
+            while True:
+                n = os.copy_file_range(src, dst, COPY_CHUNK_SIZE * 64)
+                if not n: return True
+                copied += n
+        except OSError:
+            if copied: raise
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        offset = 0
+        try:
+            while True:
+                n = os.sendfile(dst, src, offset, COPY_CHUNK_SIZE * 64)
+                if not n: return True
+                offset += n
+        except OSError:
+            if offset: raise
+    return False
+
+def copy_file(src, dst):
+    # copies content only. src is a blob or cache file with the store's private mode and times,
+    # so dst keeps its own mode (a new file gets the default one) and is modified now
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        if not (clone_file(fin, fout) or kernel_copy(fin, fout)):
+            shutil.copyfileobj(fin, fout, COPY_CHUNK_SIZE)
+
+def copy_with_hash(src, dst, digest=None, signature=None):
+    # a digest is only trusted when signature, the (size, mtime_ns, inode) it was computed for,
+    # still matches before and after the copy. then a clone or kernel copy needs no read at all,
+    # otherwise a clone costs one read of the clone and anything else one pass that hashes while copying
+    with open(src, "rb") as fin, open(dst, "w+b") as fout:
+        st = os.fstat(fin.fileno())
+        before = (st.st_size, st.st_mtime_ns, st.st_ino)
+        known = bool(digest and signature and tuple(signature) == before)
+        if clone_file(fin, fout) or (known and kernel_copy(fin, fout)):
+            st = os.fstat(fin.fileno())
+            if not (known and (st.st_size, st.st_mtime_ns, st.st_ino) == before):
+                fout.seek(0)
+                digest = hash_stream(fout)
+            size = os.fstat(fout.fileno()).st_size
+        else:
+            fout.seek(0); fout.truncate()
+            digest, size = copy_stream_with_hash(fin, fout)
+    shutil.copystat(src, dst)
+    return digest, size
+
+def store_blob_stream(fin, expected_digest=None):
+    fd, tmp_path = tempfile.mkstemp(dir=BLOBS_BASE, prefix="tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            digest, size = copy_stream_with_hash(fin, fout)
+        if expected_digest and digest != expected_digest:
+            raise ValueError(f"content does not match its hash {expected_digest[:12]}")
+        dest = blob_path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if blob_exists(digest): os.remove(tmp_path)
+        else: os.replace(tmp_path, dest)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    return digest, size
+
+def open_blob(digest):
+    if os.path.exists(blob_path(digest)): return open(blob_path(digest), "rb")
+    return io.BytesIO(read_blob_bytes(digest))
+
+@instrumented("copy_blob")
+def store_blob(src, digest=None, signature=None, immutable=False):
+    if digest and blob_exists(digest):
+        return digest, os.path.getsize(src)
+    if immutable:
+        return link_blob(src)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOBS_BASE, prefix="tmp-")
+    os.close(fd)
+    try:
+        digest, size = copy_with_hash(src, tmp_path, digest, signature)
+        dest = blob_path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if blob_exists(digest): os.remove(tmp_path)
+        else: os.replace(tmp_path, dest)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    return digest, size
+
+def link_blob(src):
+    # content that never changes again (old-style snapshot files) is hardlinked into the store instead of copied
+    with open(src, "rb") as fin: digest = hash_stream(fin)
+    size = os.path.getsize(src)
+    dest = blob_path(digest)
+    if blob_exists(digest): return digest, size
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        return store_blob(src)
+    return digest, size
+
+def write_snapshot_ref(ref_path, digest, size, orig_path):
+    with open(ref_path, 'w') as f:
+        json.dump({"blob": digest, "size": size, "path": orig_path}, f)
+
+def read_snapshot_ref(ref_path):
+    try:
+        with open(ref_path, 'r') as f:
+            ref = json.load(f)
+        return ref if isinstance(ref, dict) and "blob" in ref else None
+    except (IOError, ValueError):
+        return None
+
+@instrumented("save_snapshot")
+def save_snapshot(file_path, note=None, digest=None, use_delta=False, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, signature=None):
+    if not os.path.exists(file_path): return None, None, None
+    snapdir = get_snapshot_dir(file_path)
+    snap_name = make_snapshot_name(os.path.basename(file_path))
+    dest = os.path.join(snapdir, snap_name + REF_SUFFIX)
+    with blob_store_lock.writing():
+        if use_delta and os.path.splitext(file_path)[1].lower() in TEXT_EXTENSIONS and not (digest and blob_exists(digest)):
+            latest = get_latest_snapshot(file_path)
+            base_digest = snapshot_digest(file_path, latest) if latest and snapshot_entry_path(file_path, latest).endswith(REF_SUFFIX) else None
+            digest, size = store_delta_blob(file_path, base_digest, keyframe_interval)
+        else:
+            digest, size = store_blob(file_path, digest, signature)
+        write_snapshot_ref(dest, digest, size, file_path)
+    if note: notes_journal.append(snapdir, {"set": snap_name, "note": note})
+    snapshot_index.add(file_path, snap_name, snapshot_sort_key(dest, snap_name), size, digest, note)
+    index_snapshot_content(digest, snap_name, size)
+    return dest, snap_name, digest
+
+def index_snapshot_content(digest, snap_name, size=0):
+    if os.path.splitext(snap_name)[1].lower() not in TEXT_EXTENSIONS or size > SEARCH_MAX_BYTES: return False
+    if snapshot_index.is_content_indexed(digest): return False
+    try:
+        data = read_blob_bytes(digest)
+        if len(data) > SEARCH_MAX_BYTES: return False
+        snapshot_index.index_content(digest, data.decode("utf-8", errors="ignore"))
+    except (OSError, ValueError, zlib.error, sqlite3.Error):
+        return False
+    return True
+
+def index_pending_snapshot_contents():
+    # picks up versions saved before search existed (or while it was failing)
+    indexed = 0
+    for digest, snap_name in snapshot_index.unindexed_contents():
+        if index_snapshot_content(digest, snap_name): indexed += 1
+    return indexed
+
+def snapshot_sort_key(entry_path, snap_name):
+    m = re.search(r'(\d{8}_\d{6}_\d{6})', snap_name)
+    if m:
+        try:
+            datetime.strptime(m.group(1), "%Y%m%d_%H%M%S_%f")
+            return m.group(1)
+        except ValueError: pass
+    try: return datetime.fromtimestamp(os.path.getmtime(entry_path)).strftime("%Y%m%d_%H%M%S_%f")
+    except OSError: return ""
+
+def list_snapshots(file_path):
+    return snapshot_index.list(file_path)
+
+def snapshot_entry_path(file_path, snap_name):
+    legacy_path = os.path.join(get_snapshot_dir(file_path), snap_name)
+    ref_path = legacy_path + REF_SUFFIX
+    return ref_path if os.path.exists(ref_path) else legacy_path
+
+def snapshot_exists(file_path, snap_name):
+    return os.path.exists(snapshot_entry_path(file_path, snap_name))
+
+def snapshot_content_path(file_path, snap_name):
+    entry_path = snapshot_entry_path(file_path, snap_name)
+    if entry_path.endswith(REF_SUFFIX):
+        ref = read_snapshot_ref(entry_path)
+        return materialize_blob(ref["blob"]) if ref else None
+    return entry_path
+
+def snapshot_digest(file_path, snap_name):
+    row = snapshot_index.get(file_path, snap_name)
+    if row and row["digest"]: return row["digest"]
+    entry_path = snapshot_entry_path(file_path, snap_name)
+    if entry_path.endswith(REF_SUFFIX):
+        ref = read_snapshot_ref(entry_path)
+        return ref["blob"] if ref else None
+    try:
+        sha256 = hashlib.sha256()
+        with open(entry_path, "rb") as f:
+            for b in iter(lambda: f.read(COPY_CHUNK_SIZE), b""): sha256.update(b)
+        return sha256.hexdigest()
+    except OSError:
+        return None
+
+def snapshot_size(file_path, snap_name):
+    row = snapshot_index.get(file_path, snap_name)
+    if row: return row["size"]
+    entry_path = snapshot_entry_path(file_path, snap_name)
+    if entry_path.endswith(REF_SUFFIX):
+        ref = read_snapshot_ref(entry_path)
+        return ref.get("size", 0) if ref else 0
+    try: return os.path.getsize(entry_path)
+    except OSError: return 0
+
+def rename_snapshot_entry(file_path, old_snap_name, new_snap_name):
+    entry_path = snapshot_entry_path(file_path, old_snap_name)
+    suffix = REF_SUFFIX if entry_path.endswith(REF_SUFFIX) else ""
+    os.rename(entry_path, os.path.join(get_snapshot_dir(file_path), new_snap_name + suffix))
+    row = snapshot_index.get(file_path, old_snap_name)
+    if row is None or row["note"]:
+        notes_journal.append(get_snapshot_dir(file_path), {"move": [old_snap_name, new_snap_name]})
+    snapshot_index.rename(file_path, old_snap_name, new_snap_name)
+
+def delete_snapshot_entry(file_path, snap_name):
+    # the blob stays behind until the next garbage collection, other snapshots may share it
+    os.remove(snapshot_entry_path(file_path, snap_name))
+    row = snapshot_index.get(file_path, snap_name)
+    if row is None or row["note"]:
+        notes_journal.append(get_snapshot_dir(file_path), {"set": snap_name, "note": ""})
+    snapshot_index.remove(file_path, snap_name)
+
+def migrate_snapshot_dir(snapdir, orig_path=None):
+    migrated = 0
+    for f in os.listdir(snapdir):
+        legacy_path = os.path.join(snapdir, f)
+        if f in SNAPSHOT_META_FILES or f.endswith(REF_SUFFIX) or not os.path.isfile(legacy_path):
+            continue
+        ref_path = legacy_path + REF_SUFFIX
+        if not os.path.exists(ref_path):
+            with blob_store_lock.writing():
+                digest, size = store_blob(legacy_path, immutable=True)
+                write_snapshot_ref(ref_path, digest, size, orig_path)
+        # only drop the old copy once the ref pointing at its blob is on disk
+        os.remove(legacy_path)
+        migrated += 1
+    if migrated:
+        snapshot_index.reindex_dir(os.path.basename(snapdir), orig_path)
+    return migrated
+
+def migrate_all_snapshots(known_paths=()):
+    paths_by_id = {hash_file_path(p): p for p in known_paths}
+    migrated = 0
+    for file_id in os.listdir(SNAPSHOTS_BASE):
+        snapdir = os.path.join(SNAPSHOTS_BASE, file_id)
+        if os.path.isdir(snapdir):
+            migrated += migrate_snapshot_dir(snapdir, paths_by_id.get(file_id))
+    return migrated
+
+def gc_blobs():
+    with blob_store_lock.exclusive():
+        return collect_blobs()
+
+def collect_blobs():
+    referenced = set()
+    for file_id in os.listdir(SNAPSHOTS_BASE):
+        snapdir = os.path.join(SNAPSHOTS_BASE, file_id)
+        if not os.path.isdir(snapdir): continue
+        for f in os.listdir(snapdir):
+            if f.endswith(REF_SUFFIX):
+                ref = read_snapshot_ref(os.path.join(snapdir, f))
+                if ref: referenced.add(ref["blob"])
+    # deltas keep their whole chain down to the keyframe alive
+    pending = list(referenced)
+    while pending:
+        header = read_delta_header(pending.pop())
+        if header and header["base"] not in referenced:
+            referenced.add(header["base"])
+            pending.append(header["base"])
+    snapshot_index.prune_search(referenced)
+    removed, freed = 0, 0
+    # without flock another process may be between writing a blob and its ref, so recent blobs stay
+    young = time.time() - BLOB_GC_GRACE_SECONDS if fcntl is None else None
+    for root, _, fnames in os.walk(BLOBS_BASE):
+        for fname in fnames:
+            key = fname[:-len(DELTA_SUFFIX)] if fname.endswith(DELTA_SUFFIX) else fname
+            if key in referenced or fname.startswith("tmp-"): continue
+            path = os.path.join(root, fname)
+            if path == BLOBS_LOCK_PATH: continue
+            try:
+                if young and os.stat(path).st_ctime > young: continue
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+            except OSError: pass
+    return removed, freed
+
+def blob_disk_size(digest):
+    for path in (blob_path(digest), delta_path(digest)):
+        try: return os.path.getsize(path)
+        except OSError: pass
+    return 0
+
+def plan_retention(rows, policy, now=None):
+    # rows are (name, ts, size, digest, note, custom_name), newest first. the newest snapshot,
+    # named ones and ones with a note written by the user are never picked. returns the (name, digest, size) to drop
+    now = now or datetime.now()
+    def hours(key, per=1):
+        return policy.get(key, 0) * per
+    tiers, start = [], hours("keep_all_hours")
+    for key, per, fmt in (("hourly_days", 24, "%Y%m%d%H"), ("daily_days", 24, "%Y%m%d"), ("weekly_weeks", 168, "%G%V")):
+        if hours(key, per):
+            start += hours(key, per)
+            tiers.append((start, fmt))
+    timed = bool(hours("keep_all_hours") or tiers)
+    kept, drop, buckets = [], [], set()
+    for i, (name, ts, size, digest, note, custom_name) in enumerate(rows):
+        try: age = (now - datetime.strptime(ts, "%Y%m%d_%H%M%S_%f")).total_seconds() / 3600
+        except ValueError: age = None
+        protected = i == 0 or (bool(note) and note not in AUTO_NOTES) or bool(custom_name) or age is None
+        entry = (name, digest, size or 0, protected)
+        if protected or not timed or age < hours("keep_all_hours"):
+            kept.append(entry)
+            continue
+        tier = next((t for t in tiers if age < t[0]), None)
+        bucket = tier and (tier[1], datetime.strptime(ts, "%Y%m%d_%H%M%S_%f").strftime(tier[1]))
+        if bucket and bucket not in buckets:
+            buckets.add(bucket)
+            kept.append(entry)
+        else:
+            drop.append(entry)
+    max_count, max_bytes = policy.get("max_count", 0), policy.get("max_mb", 0) * 1024 * 1024
+    total = sum(e[2] for e in kept)
+    for entry in reversed(list(kept)):
+        if not ((max_count and len(kept) > max_count) or (max_bytes and total > max_bytes)): break
+        if entry[3]: continue
+        kept.remove(entry); drop.append(entry)
+        total -= entry[2]
+    return [e[:3] for e in drop]
+
+def prune_snapshots(plans, dry_run=False, cancelled=None, pause=PRUNE_PAUSE):
+    # plans are (file_path, policy) pairs. a dry run only reports what would go and roughly how much
+    # disk that frees: a shared blob is only counted once every snapshot pointing at it is dropped
+    doomed = []
+    for file_path, policy in plans:
+        doomed.extend((file_path, name, digest, size) for name, digest, size in plan_retention(snapshot_index.retention_rows(file_path), policy))
+    dropping = {}
+    for *_, digest, size in doomed:
+        if digest: dropping[digest] = dropping.get(digest, 0) + 1
+    counts = snapshot_index.digest_counts(dropping)
+    freed = sum(blob_disk_size(d) for d, n in dropping.items() if counts.get(d, 0) <= n)
+    freed += sum(size for *_, digest, size in doomed if not digest)
+    summary = {"files": len({d[0] for d in doomed}), "snapshots": len(doomed), "bytes": freed, "dry_run": dry_run}
+    if dry_run or not doomed: return summary
+    removed = 0
+    for file_path, name, _, _ in doomed:
+        if cancelled and cancelled(): break
+        try: delete_snapshot_entry(file_path, name)
+        except OSError: continue
+        removed += 1
+        if pause and removed % PRUNE_BATCH == 0: time.sleep(pause)
+    summary["snapshots"] = removed
+    summary["bytes"] = gc_blobs()[1]
+    return summary
+
+class ArchiveCancelled(Exception):
+    pass
+
+# archives hold a manifest (files, snapshot names, hashes, notes) and every distinct content once under blobs/
+def export_archive(zip_path, file_paths, progress=None, cancelled=None):
+    import zipfile
+    files, digests = [], {}
+    for file_path in file_paths:
+        notes = snapshot_index.notes(file_path)
+        snaps = []
+        for snap_name in list_snapshots(file_path):
+            entry_path = snapshot_entry_path(file_path, snap_name)
+            digest = snapshot_digest(file_path, snap_name)
+            if not digest: continue
+            snaps.append({"name": snap_name, "digest": digest, "size": snapshot_size(file_path, snap_name), "note": notes.get(snap_name, "")})
+            if digest not in digests:
+                digests[digest] = (None if entry_path.endswith(REF_SUFFIX) else entry_path, snap_name)
+        if snaps: files.append({"path": file_path, "snapshots": snaps})
+    manifest = {"format": ARCHIVE_FORMAT, "created": datetime.now().isoformat(timespec="seconds"), "files": files}
+    tmp_path = zip_path + ".part"
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
+            zipf.writestr(ARCHIVE_MANIFEST, json.dumps(manifest, indent=1))
+            for done, (digest, (legacy_path, snap_name)) in enumerate(digests.items()):
+                if cancelled and cancelled(): raise ArchiveCancelled()
+                if progress: progress(done, len(digests))
+                # images and the like are compressed already, deflating them again only costs time
+                compress = zipfile.ZIP_DEFLATED if os.path.splitext(snap_name)[1].lower() in TEXT_EXTENSIONS else zipfile.ZIP_STORED
+                info = zipfile.ZipInfo(f"blobs/{digest}", date_time=time.localtime()[:6])
+                info.compress_type = compress
+                with (open(legacy_path, "rb") if legacy_path else open_blob(digest)) as fin, zipf.open(info, "w", force_zip64=True) as fout:
+                    for chunk in iter(lambda: fin.read(COPY_CHUNK_SIZE), b""): fout.write(chunk)
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    if progress: progress(len(digests), len(digests))
+    return sum(len(f["snapshots"]) for f in files), len(digests)
+
+def merge_note(existing, imported):
+    if not imported or imported == existing: return existing
+    if not existing: return imported
+    return f"{existing}\n{imported}"
+
+def import_archive(zip_path, target_path=None, progress=None, cancelled=None):
+    # target_path redirects a single-file archive (or an old-style one) to another tracked file
+    import zipfile
+    imported, skipped = 0, 0
+    with zipfile.ZipFile(zip_path, "r") as zipf:
+        names = set(zipf.namelist())
+        if ARCHIVE_MANIFEST in names:
+            manifest = json.loads(zipf.read(ARCHIVE_MANIFEST))
+            files = manifest.get("files", [])
+            if target_path and len(files) != 1: raise ValueError("this archive holds several files, it can only be imported to their original locations.")
+        else:
+            # archives written before the manifest existed: snapshot files plus a notes.json for one file
+            if not target_path: raise ValueError("this archive has no manifest, select the file it belongs to first.")
+            notes = json.loads(zipf.read("notes.json")) if "notes.json" in names else {}
+            files = [{"path": target_path, "snapshots": [{"name": n, "entry": n, "note": notes.get(n, "")} for n in sorted(names)
+                                                         if n != "notes.json" and not n.endswith("/")]}]
+        bad = next((snap.get("name") for f in files for snap in f["snapshots"] if not is_valid_snapshot_name(snap.get("name"))), None)
+        if bad is not None: raise ValueError(f"this archive has an invalid snapshot name: {bad!r}")
+        bad = next((snap["digest"] for f in files for snap in f["snapshots"] if snap.get("digest") is not None and not is_valid_digest(snap["digest"])), None)
+        if bad is not None: raise ValueError(f"this archive has an invalid content hash: {bad!r}")
+        total = sum(len(f["snapshots"]) for f in files)
+        done = 0
+        for f in files:
+            file_path = os.path.normpath(target_path or f["path"])
+            snapdir = get_snapshot_dir(file_path)
+            notes = load_notes(file_path)
+            existing = {name: snapshot_digest(file_path, name) for name in list_snapshots(file_path)}
+            def add_note(name, note):
+                # appended one snapshot at a time, a note the daemon or the app writes meanwhile must survive
+                merged = merge_note(notes.get(name, ""), note)
+                if merged != notes.get(name, ""):
+                    notes[name] = merged
+                    notes_journal.append(snapdir, {"set": name, "note": merged})
+            for snap in f["snapshots"]:
+                if cancelled and cancelled(): raise ArchiveCancelled()
+                if progress: progress(done, total)
+                done += 1
+                name, digest = snap["name"], snap.get("digest")
+                if digest and existing.get(name) == digest:
+                    skipped += 1
+                    add_note(name, snap.get("note", ""))
+                    continue
+                size = snap.get("size")
+                with blob_store_lock.writing():
+                    if not (digest and blob_exists(digest)):
+                        with zipf.open(snap.get("entry") or f"blobs/{digest}") as fin:
+                            digest, size = store_blob_stream(fin, digest)
+                        if existing.get(name) == digest:
+                            skipped += 1
+                            add_note(name, snap.get("note", ""))
+                            continue
+                    if name in existing: name = f"imported_{name}"
+                    if name in existing:
+                        skipped += 1
+                        continue
+                    if size is None: size = len(read_blob_bytes(digest))
+                    write_snapshot_ref(os.path.join(snapdir, name + REF_SUFFIX), digest, size, file_path)
+                existing[name] = digest
+                add_note(name, snap.get("note", ""))
+                imported += 1
+            snapshot_index.reindex_dir(hash_file_path(file_path), file_path)
+    if progress: progress(total, total)
+    return imported, skipped
+
+def format_snap_time(fname):
+    match = re.match(r'^(.*?)(_?)(\d{8}_\d{6}_\d{6}\..*)$', fname)
+    if not match:
+        return fname
+
+    custom_name, separator, timestamp_part_with_ext = match.groups()
+    
+    ts_match = re.search(r'(\d{8}_\d{6}_\d{6})', timestamp_part_with_ext)
+    if not ts_match:
+        return fname 
+
+    try:
+        dt = datetime.strptime(ts_match.group(1), "%Y%m%d_%H%M%S_%f")
+        time_str = dt.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    except ValueError:
+        return fname
+
+    if custom_name:
+        return f"{custom_name} ({time_str})"
+    else:
+        return time_str
+
+def myers_blocks(a, b, a0, b0, deadline, max_edits):
+    # classic O((n+m)d) myers, gives up (returns None) past max_edits or the deadline
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(max_edits, n + m) + 1):
+        if d % 32 == 0 and time.perf_counter() > deadline: return None
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]): x = v[k + 1]
+            else: x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]: x += 1; y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                blocks = []
+                for dd in range(d, -1, -1):
+                    vv = trace[dd]
+                    k = x - y
+                    if dd == 0: prev_x = prev_y = 0
+                    else:
+                        prev_k = k + 1 if (k == -dd or (k != dd and vv[k - 1] < vv[k + 1])) else k - 1
+                        prev_x = vv[prev_k]; prev_y = prev_x - prev_k
+                    start_x = prev_x if dd == 0 else (prev_x if prev_k == k + 1 else prev_x + 1)
+                    snake = min(x - start_x, y - (start_x - k))
+                    if snake > 0: blocks.append((a0 + x - snake, b0 + y - snake, snake))
+                    x, y = prev_x, prev_y
+                blocks.reverse()
+                return blocks
+    return None
+
+def unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    # patience: lines that occur exactly once on both sides, kept in increasing order on both sides
+    counts = {}
+    for i in range(a_lo, a_hi):
+        c = counts.get(a[i]); counts[a[i]] = [1, 0, i] if c is None else [c[0] + 1, 0, c[2]]
+    for j in range(b_lo, b_hi):
+        c = counts.get(b[j])
+        if c is not None: c[1] += 1; c.append(j)
+    pairs = sorted((c[2], c[3]) for c in counts.values() if c[0] == 1 and c[1] == 1)
+    tails, tail_idx, prev = [], [], [None] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails): tails.append(j); tail_idx.append(idx)
+        else: tails[pos] = j; tail_idx[pos] = idx
+        prev[idx] = tail_idx[pos - 1] if pos else None
+    anchors = []
+    idx = tail_idx[-1] if tail_idx else None
+    while idx is not None:
+        anchors.append(pairs[idx]); idx = prev[idx]
+    anchors.reverse()
+    return anchors
+
+def diff_opcodes(a, b, time_budget=DIFF_TIME_BUDGET, max_edits=DIFF_MAX_EDITS):
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a]
+    b = [ids.setdefault(line, len(ids)) for line in b]
+    deadline = time.perf_counter() + time_budget
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            blocks.append((a_lo, b_lo, 1)); a_lo += 1; b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1; b_hi -= 1; blocks.append((a_hi, b_hi, 1))
+        if a_lo == a_hi or b_lo == b_hi: continue
+        found = None
+        if (a_hi - a_lo) + (b_hi - b_lo) <= 4 * max_edits:
+            found = myers_blocks(a[a_lo:a_hi], b[b_lo:b_hi], a_lo, b_lo, deadline, max_edits)
+        if found is not None:
+            blocks.extend(found)
+            continue
+        if time.perf_counter() > deadline: continue
+        anchors = unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+        # whatever is left without anchors is shown as one replaced block
+        prev_i, prev_j = a_lo, b_lo
+        for i, j in anchors:
+            blocks.append((i, j, 1))
+            stack.append((prev_i, i, prev_j, j))
+            prev_i, prev_j = i + 1, j + 1
+        if anchors: stack.append((prev_i, a_hi, prev_j, b_hi))
+    blocks.sort()
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in merged + [(len(a), len(b), 0)]:
+        if i < ai and j < bj: opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai: opcodes.append(("delete", i, ai, j, j))
+        elif j < bj: opcodes.append(("insert", i, i, j, bj))
+        if size: opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return opcodes
+
+class TextDiff:
+    # diffed once, rendered as hunks with collapsible unchanged runs and a row limit that can grow
+    EMPTY_ROW = '<tr class="empty_row"><td class="lineno">&nbsp;</td><td>&nbsp;</td></tr>'
+
+    def __init__(self, snap, curr):
+        self.error = None
+        try:
+            with open(snap, encoding="utf-8", errors="ignore") as f: self.left = f.readlines()
+            with open(curr, encoding="utf-8", errors="ignore") as f: self.right = f.readlines()
+        except Exception as e:
+            self.error = str(e)
+            self.left, self.right, self.opcodes = [], [], []
+            return
+        with metrics.timed("text_diff"): self.opcodes = diff_opcodes(self.left, self.right)
+
+    def row(self, lines, i, css):
+        cls = f' class="{css}"' if css else ""
+        return f'<tr{cls}><td class="lineno">{i+1}</td><td><pre>{html.escape(lines[i])}</pre></td></tr>'
+
+    def collapsed_row(self, idx, count):
+        return f'<tr class="collapsed"><td class="lineno">&nbsp;</td><td><a href="expand:{idx}">&#8943; {count} unchanged line{"s" if count != 1 else ""}</a></td></tr>'
+
+    def rows(self, expanded, context):
+        last = len(self.opcodes) - 1
+        for idx, (opcode, i1, i2, j1, j2) in enumerate(self.opcodes):
+            if opcode == "equal":
+                head = 0 if idx == 0 else context
+                tail = 0 if idx == last else context
+                if idx in expanded or (i2 - i1) <= head + tail + 1:
+                    for i, j in zip(range(i1, i2), range(j1, j2)): yield self.row(self.left, i, ""), self.row(self.right, j, "")
+                    continue
+                for k in range(head): yield self.row(self.left, i1 + k, ""), self.row(self.right, j1 + k, "")
+                yield self.collapsed_row(idx, i2 - i1 - head - tail), self.collapsed_row(idx, i2 - i1 - head - tail)
+                for k in range(tail, 0, -1): yield self.row(self.left, i2 - k, ""), self.row(self.right, j2 - k, "")
+            else:
+                for k in range(max(i2 - i1, j2 - j1)):
+                    l = self.row(self.left, i1 + k, "diff_sub") if i1 + k < i2 else self.EMPTY_ROW
+                    r = self.row(self.right, j1 + k, "diff_add") if j1 + k < j2 else self.EMPTY_ROW
+                    yield l, r
+
+    # focus is a 1-based line of the selected version: it is always rendered and gets a "focus" anchor
+    @instrumented("diff_render")
+    def render(self, expanded=frozenset(), max_rows=DIFF_PAGE_ROWS, context=DIFF_CONTEXT, focus=None):
+        if self.error is not None:
+            return f"<pre>could not read files: {html.escape(self.error)}</pre>"
+        focus_cell = None
+        if focus and 0 < focus <= len(self.left):
+            focus_cell = f'<td class="lineno">{focus}</td>'
+            expanded = set(expanded)
+            expanded.update(idx for idx, op in enumerate(self.opcodes) if op[0] == "equal" and op[1] < focus <= op[2])
+        l = ['<table class="content-table"><tr><th>&nbsp;</th><th>selected version</th></tr>']
+        r = ['<table class="content-table"><tr><th>&nbsp;</th><th>current file</th></tr>']
+        count = 0
+        more = False
+        for left_row, right_row in self.rows(expanded, context):
+            if count >= max_rows and not focus_cell:
+                more = True
+                break
+            if focus_cell and focus_cell in left_row:
+                left_row = left_row.replace(focus_cell, f'<td class="lineno"><a name="focus"></a>{focus}</td>')
+                focus_cell = None
+            l.append(left_row); r.append(right_row)
+            count += 1
+        l.append('</table>'); r.append('</table>')
+        footer = f'<p style="text-align:center;"><a href="more:{count}">show more</a></p>' if more else ""
+        return DIFF_CSS + f'<table class="layout-table"><tr><td>{"".join(l)}</td><td>{"".join(r)}</td></tr></table>' + footer
+
+def get_text_diff(snap, curr):
+    return TextDiff(snap, curr).render()
+
+# plain unified diff lines for terminals and patch files, grouped the way difflib does it but built on diff_opcodes
+def unified_diff(a, b, from_name, to_name, context=DIFF_CONTEXT):
+    codes = [list(op) for op in diff_opcodes(a, b)]
+    if all(op[0] == "equal" for op in codes): return
+    if codes[0][0] == "equal":
+        codes[0][1], codes[0][3] = max(codes[0][1], codes[0][2] - context), max(codes[0][3], codes[0][4] - context)
+    if codes[-1][0] == "equal":
+        codes[-1][2], codes[-1][4] = min(codes[-1][2], codes[-1][1] + context), min(codes[-1][4], codes[-1][3] + context)
+    groups, group = [], []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, i1 + context, j1, j1 + context))
+            groups.append(group)
+            group = []
+            i1, j1 = i2 - context, j2 - context
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"): groups.append(group)
+
+    def span(start, stop):
+        if stop - start == 1: return f"{start + 1}"
+        return f"{start + 1 if stop > start else start},{stop - start}"
+
+    def line(prefix, text):
+        return prefix + (text if text.endswith("\n") else text + "\n")
+
+    yield f"--- {from_name}\n"
+    yield f"+++ {to_name}\n"
+    for group in groups:
+        yield f"@@ -{span(group[0][1], group[-1][2])} +{span(group[0][3], group[-1][4])} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for text in a[i1:i2]: yield line(" ", text)
+                continue
+            for text in a[i1:i2]: yield line("-", text)
+            for text in b[j1:j2]: yield line("+", text)
+
+# downscaled copies live on disk keyed by content digest, so the gui only ever decodes a small png.
+# returns (thumbnail path, (width, height) of the original) or (None, None)
+def get_image_preview(image_path, digest, size=THUMBNAIL_SIZE):
+    if not digest: return None, None
+    # pillow is only loaded once an image is actually previewed, the daemon never needs it
+    from PIL import Image
+    from PIL.PngImagePlugin import PngInfo
+    dest = os.path.join(THUMBNAILS_DIR, f"{digest}-{size}.png")
+    try:
+        if os.path.exists(dest):
+            os.utime(dest)
+            with Image.open(dest) as thumb:
+                orig_size = tuple(int(v) for v in thumb.text.get("orig_size", "0x0").split("x"))
+            return dest, orig_size
+        with Image.open(image_path) as img:
+            orig_size = img.size
+            img.draft("RGB", (size, size))
+            img.thumbnail((size, size))
+            img = img.convert("RGBA")
+            info = PngInfo(); info.add_text("orig_size", f"{orig_size[0]}x{orig_size[1]}")
+            os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=THUMBNAILS_DIR, prefix="tmp-")
+            with os.fdopen(fd, "wb") as f: img.save(f, "PNG", pnginfo=info)
+        os.replace(tmp_path, dest)
+    except Exception:
+        return None, None
+    prune_thumbnails()
+    return dest, orig_size
+
+def prune_thumbnails(max_bytes=THUMBNAIL_CACHE_BYTES):
+    entries = []
+    for f in os.listdir(THUMBNAILS_DIR):
+        path = os.path.join(THUMBNAILS_DIR, f)
+        try:
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+        except OSError: pass
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes: break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError: pass
+
+def get_latest_snapshot(file_path):
+    return snapshot_index.latest(file_path)
+
+class HashService:
+    # hashes files with big reads into a reused buffer on a thread pool; hashlib drops the gil while it
+    # works, so several files really are hashed at once. blobs are always addressed by sha256, the
+    # configurable algorithm is only used to notice changes
+    def __init__(self, algorithm=CONTENT_HASH, workers=HASH_WORKERS):
+        self.algorithm = algorithm
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bkpr-hash")
+        self.buffers = threading.local()
+
+    @staticmethod
+    def algorithms():
+        names = [CONTENT_HASH, "blake2b"]
+        if xxhash is not None: names.append("xxhash")
+        return names
+
+    @staticmethod
+    def new_hasher(algorithm):
+        if algorithm == "blake2b": return hashlib.blake2b(digest_size=32)
+        if algorithm == "xxhash" and xxhash is not None: return xxhash.xxh3_128()
+        return hashlib.sha256()
+
+    @instrumented("hash_file")
+    def hash_file(self, path, algorithm=None):
+        h = self.new_hasher(algorithm or self.algorithm)
+        try:
+            # no mmap: tracked files are live, and one truncated while mapped kills the process with sigbus
+            with open(path, "rb") as f:
+                buf = getattr(self.buffers, "buf", None)
+                if buf is None: buf = self.buffers.buf = bytearray(HASH_READ_SIZE)
+                view = memoryview(buf)
+                while True:
+                    n = f.readinto(buf)
+                    if not n: break
+                    h.update(view[:n])
+        except (OSError, ValueError):
+            return None
+        return h.hexdigest()
+
+    def hash_many(self, paths, hasher=None, cancelled=None):
+        # yields (path, digest) in order, keeping only a few files per worker in flight
+        hasher = hasher or self.hash_file
+        pending = deque()
+        for path in paths:
+            if cancelled and cancelled(): break
+            pending.append((path, self.pool.submit(hasher, path)))
+            if len(pending) >= self.workers * 4:
+                p, future = pending.popleft()
+                yield p, future.result()
+        if cancelled and cancelled():
+            for _, future in pending: future.cancel()
+            return
+        while pending:
+            p, future = pending.popleft()
+            yield p, future.result()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+snapshot_index = SnapshotIndex(INDEX_PATH)
+hash_service = HashService()
+
+class ChangeHandler:
+    # watchdog only ever calls dispatch(), so this does not subclass its handler base and
+    # watchdog stays unloaded until the first watch is scheduled
+    def __init__(self, callback, dir_created=None, moved=None):
+        self.callback = callback
+        self.dir_created = dir_created
+        self.moved = moved
+
+    def dispatch(self, event):
+        handler = getattr(self, f"on_{event.event_type}", None)
+        if handler: handler(event)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.callback(event.src_path)
+
+    def on_created(self, event):
+        self.callback(event.src_path)
+        if event.is_directory and self.dir_created: self.dir_created(event.src_path)
+
+    def on_deleted(self, event):
+        self.callback(event.src_path)
+
+    def on_moved(self, event):
+        if self.moved:
+            self.moved(event.src_path, event.dest_path)
+        else:
+            self.callback(event.src_path)
+            self.callback(event.dest_path)
+        if event.is_directory and self.dir_created: self.dir_created(event.dest_path)
+
+class FileWatcher:
+    # one observer for the whole app. watches are diffed against what is already scheduled, folders get
+    # recursive watches except around ignored subtrees and single files a flat watch on their folder.
+    # changed(path) and moved(src, dest) are called on watchdog's threads
+    def __init__(self, changed, moved):
+        self.changed = changed
+        self.moved = moved
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bkpr-watch")
+        self.lock = threading.Lock()
+        self.handler = ChangeHandler(self.on_event, self.on_dir_created, self.on_moved)
+        self.observer = None
+        self.use_polling = False
+        self.native_failed = False
+        self.watches = {}
+        self.files = frozenset()
+        self.folders = ()
+        self.is_ignored = None
+
+    def set_paths(self, paths, is_ignored, use_polling=False):
+        files = frozenset(p for p in paths if not os.path.isdir(p))
+        folders = tuple(p for p in paths if os.path.isdir(p))
+        with self.lock:
+            self.files, self.folders, self.is_ignored = files, folders, is_ignored
+        self.pool.submit(self.apply, use_polling)
+
+    def clear(self):
+        self.set_paths([], None, self.use_polling)
+
+    def covers(self, path):
+        return path in self.files or any(path == f or path.startswith(os.path.join(f, "")) for f in self.folders)
+
+    def on_event(self, path):
+        metrics.count("watch_events")
+        path = os.path.normpath(path)
+        # flat watches on a file's folder also see its neighbours, only the file itself is passed on
+        if self.covers(path): self.changed(path)
+
+    def on_moved(self, src, dest):
+        metrics.count("watch_moves")
+        src, dest = os.path.normpath(src), os.path.normpath(dest)
+        if self.covers(src) or self.covers(dest): self.moved(src, dest)
+
+    def on_dir_created(self, path):
+        path = os.path.normpath(path)
+        if not any(path.startswith(os.path.join(f, "")) for f in self.folders): return
+        if (os.path.dirname(path), False) in self.watches:
+            self.pool.submit(self.add_tree, path)
+        else:
+            self.pool.submit(self.split_watch, path)
+
+    def watch_plan(self, root):
+        # walks the folder once, pruning ignored folders, and marks every folder that has one somewhere below
+        children, tainted = {}, set()
+        for dirpath, dirnames, _ in os.walk(root):
+            keep = []
+            for d in dirnames:
+                if self.is_ignored and self.is_ignored(os.path.join(dirpath, d), True):
+                    p = dirpath
+                    while p not in tainted and (p == root or p.startswith(os.path.join(root, ""))):
+                        tainted.add(p)
+                        if p == root: break
+                        p = os.path.dirname(p)
+                else:
+                    keep.append(d)
+            dirnames[:] = keep
+            children[dirpath] = [os.path.join(dirpath, d) for d in keep]
+        plan, stack = set(), [root]
+        while stack:
+            d = stack.pop()
+            if d in tainted:
+                plan.add((d, False))
+                stack.extend(children.get(d, []))
+            else:
+                plan.add((d, True))
+        return plan
+
+    def apply(self, use_polling):
+        with self.lock:
+            files, folders = self.files, self.folders
+        wanted = set()
+        for folder in folders:
+            if not any(folder.startswith(os.path.join(f, "")) for f in folders):
+                wanted |= self.watch_plan(folder)
+        for f in files:
+            parent = os.path.dirname(f)
+            if os.path.isdir(parent) and not any(f.startswith(os.path.join(d, "")) for d in folders):
+                wanted.add((parent, False))
+        use_polling = use_polling or self.native_failed
+        if use_polling != self.use_polling or (self.observer is None and wanted):
+            self.restart_observer(use_polling)
+        for key in [k for k in self.watches if k not in wanted]:
+            try: self.observer.unschedule(self.watches.pop(key))
+            except (KeyError, OSError): pass
+        self.schedule(k for k in wanted if k not in self.watches)
+
+    def add_tree(self, path):
+        if not os.path.isdir(path) or (self.is_ignored and self.is_ignored(path, True)): return
+        self.schedule(k for k in self.watch_plan(path) if k not in self.watches)
+
+    def split_watch(self, path):
+        # an ignored folder appeared under a recursive watch (npm install making node_modules, a first build/):
+        # the watch covering it is planned again, so the new folder is left out like it would be at startup
+        if not (self.is_ignored and self.is_ignored(path, True)): return
+        root = next((k[0] for k in self.watches if k[1] and path.startswith(os.path.join(k[0], ""))), None)
+        if root is None: return
+        plan = self.watch_plan(root)
+        self.schedule(k for k in plan if k not in self.watches)
+        for key in [k for k in self.watches if (k[0] == root or k[0].startswith(os.path.join(root, ""))) and k not in plan]:
+            try: self.observer.unschedule(self.watches.pop(key))
+            except (KeyError, OSError): pass
+
+    def schedule(self, keys):
+        keys = list(keys)
+        for i, key in enumerate(keys):
+            try:
+                self.watches[key] = self.observer.schedule(self.handler, key[0], recursive=key[1])
+            except OSError as e:
+                if self.use_polling: continue
+                # out of inotify watches or a filesystem that does not support them: poll everything instead
+                print(f"native file watching failed ({e}), falling back to polling.")
+                self.native_failed = True
+                self.restart_observer(True)
+                self.schedule(keys[i:])
+                return
+
+    def restart_observer(self, use_polling):
+        keys = list(self.watches)
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        self.use_polling = use_polling
+        if use_polling:
+            from watchdog.observers.polling import PollingObserver as Observer
+        else:
+            from watchdog.observers import Observer
+        self.observer = Observer()
+        self.observer.start()
+        self.watches = {}
+        self.schedule(keys)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+class JobQueue:
+    # finished(path, result), failed(path, error) and status(queued, running) are called on the worker threads
+    def __init__(self, finished=None, failed=None, status=None, max_workers=SNAPSHOT_WORKERS, max_pending=SNAPSHOT_QUEUE_LIMIT):
+        self.finished = finished
+        self.failed = failed
+        self.status = status
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bkpr-snapshot")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.queues = {}
+        # paths with a job waiting and none running, in the order they became ready. the pool only ever
+        # gets as many jobs as it has workers, everything else waits here and counts against max_pending
+        self.ready = {}
+        self.running = set()
+        self.pending = 0
+        self.closed = False
+
+    # jobs for the same path always run one after another, in submission order
+    def submit(self, path, kind, fn, *args, coalesce=False):
+        with self.lock:
+            if self.closed: return False
+            queue = self.queues.setdefault(path, deque())
+            if coalesce and any(job[0] == kind for job in queue):
+                return True
+            if self.pending >= self.max_pending:
+                return False
+            queue.append((kind, fn, args))
+            self.pending += 1
+            if path not in self.running: self.ready[path] = True
+            self.start_next()
+        self.emit_status()
+        return True
+
+    def start_next(self):
+        while self.ready and len(self.running) < self.max_workers:
+            path = next(iter(self.ready))
+            del self.ready[path]
+            job = self.queues[path].popleft()
+            self.pending -= 1
+            self.running.add(path)
+            self.pool.submit(self.run_job, path, job)
+
+    def run_job(self, path, job):
+        kind, fn, args = job
+        try:
+            result = fn(*args)
+            if self.finished: self.finished(path, result)
+        except Exception as e:
+            if self.failed: self.failed(path, f"{kind}: {e}")
+        finally:
+            with self.lock:
+                self.running.discard(path)
+                if self.queues.get(path): self.ready[path] = True
+                else: self.queues.pop(path, None)
+                if not self.closed: self.start_next()
+            self.emit_status()
+
+    def emit_status(self):
+        if not self.status: return
+        with self.lock:
+            queued, running = self.pending, len(self.running)
+        self.status(queued, running)
+
+    def is_idle(self):
+        with self.lock:
+            return not self.pending and not self.running
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            self.queues.clear()
+            self.ready.clear()
+            self.pending = 0
+        self.pool.shutdown(wait=True)
+
+def run_job_now(path, kind, fn, *args, coalesce=False):
+    fn(*args)
+    return True
+
+class Tracker:
+    # what is tracked and how, and the work of keeping snapshots up to date. it never touches a window:
+    # snapshot work goes through submit(path, kind, fn, *args, coalesce=False), which a JobQueue provides
+    # for the gui and the daemon, and which runs jobs right away for one-off commands
+    def __init__(self, submit=run_job_now):
+        self.submit = submit
+        self.tracked_paths = []
+        self.file_hashes = {}
+        self.change_cache = ChangeCache(HASH_CACHE_PATH)
+        self.change_cache.load()
+        self.ignore_patterns = []
+        self.ignore_matcher = IgnoreMatcher([])
+        self.storage_mode = "full"
+        self.keyframe_interval = DEFAULT_KEYFRAME_INTERVAL
+        self.retention_policies = {}
+        self.watch_polling = False
+        self.settle_ms = EVENT_SETTLE_MS
+        self.pending_events = {}
+        self.events_lock = threading.RLock()
+        # a full check runs inside one job, these keep it from checking a file while that file's own job
+        # snapshots or restores it. reentrant since a check goes on to track_new_file under the same lock
+        self.check_locks = [threading.RLock() for _ in range(64)]
+        self.stale_files = []
+
+    def save_settings(self):
+        settings = {
+            "tracked_paths": self.tracked_paths,
+            "storage_mode": self.storage_mode,
+            "keyframe_interval": self.keyframe_interval,
+            "retention": self.retention_policies,
+            "watch_polling": self.watch_polling,
+            "settle_ms": self.settle_ms,
+            "hash_algorithm": hash_service.algorithm,
+            "metrics": metrics.enabled
+        }
+        try:
+            with open(SETTINGS_PATH, 'w') as f:
+                json.dump(settings, f, indent=4)
+        except IOError:
+            print("sum happened, could not save settings.")
+
+    def load_settings(self):
+        if not os.path.exists(SETTINGS_PATH):
+            return
+        try:
+            with open(SETTINGS_PATH, 'r') as f:
+                settings_data = json.load(f)
+            if isinstance(settings_data, list):
+                self.tracked_paths = settings_data
+            else:
+                self.tracked_paths = settings_data.get("tracked_paths", [])
+                self.storage_mode = settings_data.get("storage_mode", "full")
+                self.keyframe_interval = max(1, int(settings_data.get("keyframe_interval", DEFAULT_KEYFRAME_INTERVAL)))
+                self.retention_policies = {os.path.normpath(p): policy for p, policy in settings_data.get("retention", {}).items()}
+                self.watch_polling = bool(settings_data.get("watch_polling", False))
+                self.settle_ms = max(50, int(settings_data.get("settle_ms", EVENT_SETTLE_MS)))
+                self.set_hash_algorithm(settings_data.get("hash_algorithm", CONTENT_HASH))
+                metrics.enabled = bool(settings_data.get("metrics", False))
+            self.tracked_paths = [os.path.normpath(p) for p in self.tracked_paths]
+        except (IOError, ValueError):
+            print("sum happened, could not load settings.")
+            self.tracked_paths = []
+
+    def load_ignore_patterns(self):
+        if os.path.exists(IGNORE_FILE_PATH):
+            with open(IGNORE_FILE_PATH, 'r') as f:
+                self.ignore_patterns = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        else:
+            self.ignore_patterns = []
+        self.ignore_matcher = IgnoreMatcher(self.ignore_patterns)
+
+    def track(self, path, note):
+        self.tracked_paths.append(path)
+        if os.path.isfile(path):
+            self.submit(path, "track", self.track_new_file, path, note)
+        elif os.path.isdir(path):
+            self.submit(path, "track-folder", self.track_folder, path, note)
+
+    def track_folder(self, folder_path, note):
+        # snapshotted right here instead of one job per file: a big folder would fill the bounded queue
+        # and most of its files would be skipped until the next full check
+        for file_path in self.get_all_files_in_path(folder_path):
+            self.track_new_file(file_path, note)
+        return ("created", folder_path)
+
+    def path_lock(self, file_path):
+        return self.check_locks[hash(file_path) % len(self.check_locks)]
+
+    def track_new_file(self, file_path, note):
+        if self.is_path_ignored(file_path):
+            return None
+        with self.path_lock(file_path):
+            self.file_hashes[file_path] = self.snapshot_hash(file_path, self.save_snapshot(file_path, note)[2])
+        return ("created", file_path)
+
+    def untrack(self, path, purge=False, files=None):
+        if files is None: files = self.get_all_files_in_path(path) if os.path.isdir(path) else [path]
+        if purge and files:
+            self.submit(path, "purge", self.purge_snapshots, path, list(files))
+        if path in self.tracked_paths:
+            self.tracked_paths.remove(path)
+            self.retention_policies.pop(path, None)
+        for f in files:
+            self.file_hashes.pop(f, None)
+            self.change_cache.forget(f)
+
+    @staticmethod
+    def purge_snapshots(path, files):
+        for f in files:
+            shutil.rmtree(get_snapshot_dir(f), ignore_errors=True)
+            snapshot_index.remove_file(f)
+        gc_blobs()
+        return ("purged", path)
+
+    def save_snapshot(self, file_path, note=None, digest=None):
+        if hash_service.algorithm != CONTENT_HASH: digest = None
+        entry = self.change_cache.entries.get(file_path)
+        signature = entry[:3] if entry and digest and entry[3] == digest else None
+        before = self.stat_signature(file_path)
+        dest, snap_name, stored = save_snapshot(file_path, note, digest, use_delta=self.storage_mode == "delta", keyframe_interval=self.keyframe_interval, signature=signature)
+        # the copy hashed the content on the way, so the change cache learns it without another read,
+        # unless the file moved while it was copied
+        if stored and hash_service.algorithm == CONTENT_HASH and before and self.stat_signature(file_path) == before:
+            self.change_cache.remember(file_path, stored)
+        return dest, snap_name, stored
+
+    def snapshot_hash(self, file_path, stored):
+        # the hash to remember for a file just snapshotted: what was stored when that is comparable
+        return stored if stored and hash_service.algorithm == CONTENT_HASH else self.current_hash(file_path)
+
+    def take_snapshot_now(self, file_path, note):
+        with self.path_lock(file_path):
+            self.file_hashes[file_path] = self.snapshot_hash(file_path, self.save_snapshot(file_path, note)[2])
+        return ("manual", file_path)
+
+    def restore_file(self, orig_path, snap_name, dest=None):
+        version_path = snapshot_content_path(orig_path, snap_name)
+        if dest and dest != orig_path:
+            copy_file(version_path, dest)
+            return ("copied", orig_path)
+        with self.path_lock(orig_path):
+            latest_snap = get_latest_snapshot(orig_path)
+            curr_hash = self.current_hash(orig_path)
+            if not self.matches_snapshot(orig_path, latest_snap, curr_hash):
+                self.save_snapshot(orig_path, NOTE_BEFORE_RESTORE, curr_hash)
+            copy_file(version_path, orig_path)
+            restored_hash = snapshot_digest(orig_path, snap_name) if hash_service.algorithm == CONTENT_HASH else None
+            self.change_cache.remember(orig_path, restored_hash)
+            self.file_hashes[orig_path] = restored_hash or self.current_hash(orig_path)
+        return ("restored", orig_path)
+
+    # checks every file within this one job, one job per file would overflow the bounded queue on big trees.
+    # returns ("checked", results) with what check_file reported, and ("failed", path, error) for files that failed
+    @instrumented("poll_files")
+    def reconcile_files(self):
+        all_tracked_files = self.get_all_tracked_files()
+        all_tracked_files.update(f for f in list(self.file_hashes) if not os.path.exists(f))
+        self.change_cache.save()
+        results = []
+        for file_path in sorted(all_tracked_files):
+            try:
+                result = self.check_file(file_path)
+            except Exception as e:
+                result = ("failed", file_path, f"check: {e}")
+            if result: results.append(result)
+        return ("checked", results)
+
+    def check_files(self, file_paths):
+        for file_path in file_paths:
+            self.submit(file_path, "check", self.check_file, file_path, coalesce=True)
+
+    @instrumented("check_file")
+    def check_file(self, file_path):
+        with self.path_lock(file_path):
+            return self.check_file_locked(file_path)
+
+    def check_file_locked(self, file_path):
+        if not os.path.exists(file_path):
+            self.change_cache.forget(file_path)
+            if self.file_hashes.pop(file_path, None) is not None:
+                return ("deleted", file_path)
+            return None
+
+        current_hash = self.current_hash(file_path)
+        last_hash = self.file_hashes.get(file_path)
+        if last_hash is None:
+            latest_snap = get_latest_snapshot(file_path)
+            if self.matches_snapshot(file_path, latest_snap, current_hash):
+                # already snapshotted, we just had not seen it since startup
+                self.file_hashes[file_path] = current_hash
+                return None
+            return self.track_new_file(file_path, NOTE_NEW_FILE)
+        elif current_hash and current_hash != last_hash:
+            self.save_snapshot(file_path, NOTE_FILE_CHANGE, current_hash)
+            self.file_hashes[file_path] = current_hash
+            return ("changed", file_path)
+        return None
+
+    @staticmethod
+    def stat_signature(path):
+        try:
+            st = os.stat(path)
+            return (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    # every burst of events for a path waits until it has been quiet for the settle window
+    # and its size and mtime did not move since the last event, so one save gives one snapshot
+    def note_event(self, path):
+        path = os.path.normpath(path)
+        now = time.monotonic()
+        with self.events_lock:
+            entry = self.pending_events.get(path)
+            self.pending_events[path] = [entry[0] if entry else now, now, self.stat_signature(path)]
+
+    def note_move(self, src, dest):
+        with self.events_lock:
+            if src in self.file_hashes or os.path.isdir(dest):
+                self.note_event(src)
+            else:
+                # a temporary file renamed over its target (atomic save): only the target changed
+                self.pending_events.pop(src, None)
+            self.note_event(dest)
+
+    def has_pending_events(self):
+        with self.events_lock:
+            return bool(self.pending_events)
+
+    def clear_events(self):
+        with self.events_lock:
+            self.pending_events.clear()
+
+    # returns the tracked files behind every event that has settled
+    def settled_events(self):
+        settle, max_wait = self.settle_ms / 1000, EVENT_MAX_WAIT_MS / 1000
+        now = time.monotonic()
+        ready = []
+        with self.events_lock:
+            for p, entry in list(self.pending_events.items()):
+                first_seen, last_event, signature = entry
+                if now - last_event < settle: continue
+                current = self.stat_signature(p)
+                if current != signature and now - first_seen < max_wait:
+                    # still being written without telling us, give it another window
+                    entry[1], entry[2] = now, current
+                    continue
+                del self.pending_events[p]
+                ready.append(p)
+        return self.expand_event_paths(ready) if ready else set()
+
+    def expand_event_paths(self, paths):
+        files = set()
+        for path in paths:
+            if self.is_path_ignored(path) or not self.is_path_tracked(path):
+                continue
+            if os.path.isdir(path):
+                files.update(self.get_all_files_in_path(path))
+            elif os.path.exists(path) or path in self.file_hashes:
+                files.add(path)
+            else:
+                # a deleted or moved-away directory no longer tells us what was inside it
+                prefix = os.path.join(path, "")
+                files.update(f for f in list(self.file_hashes) if f.startswith(prefix))
+        return files
+
+    def is_path_tracked(self, path):
+        for tracked in self.tracked_paths:
+            if path == tracked or path.startswith(os.path.join(tracked, "")):
+                return True
+        return False
+
+    def retention_plans(self, policies=None):
+        # a file follows the policy of the closest tracked path above it that has one
+        policies = {p: policy for p, policy in (policies or self.retention_policies).items() if p in self.tracked_paths}
+        owners = {}
+        for path in sorted(policies, key=len):
+            for f in snapshot_index.files_under(path): owners[f] = path
+        return [(f, policies[owner]) for f, owner in owners.items()]
+
+    def is_path_ignored(self, path, is_dir=None):
+        return self.ignore_matcher.is_ignored(path, self.ignore_root(path), is_dir)
+
+    def ignore_root(self, path):
+        root = None
+        for tracked in self.tracked_paths:
+            if (path == tracked or path.startswith(os.path.join(tracked, ""))) and os.path.isdir(tracked):
+                if root is None or len(tracked) > len(root): root = tracked
+        return root or os.path.dirname(path)
+
+    @instrumented("get_all_files_in_path")
+    def get_all_files_in_path(self, path):
+        files = []
+        matcher = self.ignore_matcher
+        if os.path.isdir(path):
+            # excluded folders are pruned here, so their contents are never listed
+            for root, dirs, fnames in os.walk(path, topdown=True):
+                rel_root = os.path.relpath(root, path).replace('\\', '/')
+                rel_root = "" if rel_root == "." else rel_root + "/"
+                dirs[:] = [d for d in dirs if not matcher.match_entry(os.path.join(root, d), rel_root + d, True)]
+                for fname in fnames:
+                    if not matcher.match_entry(os.path.join(root, fname), rel_root + fname, False):
+                        files.append(os.path.join(root, fname))
+        return files
+
+    def get_all_tracked_files(self):
+        all_files = set()
+        for path in self.tracked_paths:
+            if self.is_path_ignored(path):
+                continue
+            if os.path.isfile(path):
+                all_files.add(path)
+            elif os.path.isdir(path):
+                all_files.update(self.get_all_files_in_path(path))
+        return all_files
+
+    def list_tracked_path(self, path):
+        if self.is_path_ignored(path): return []
+        if os.path.isfile(path): return [path]
+        return self.get_all_files_in_path(path)
+
+    def hash_file(self, path):
+        return hash_service.hash_file(path)
+
+    # change hashes only double as blob addresses when they are sha256
+    def matches_snapshot(self, file_path, snap_name, current_hash):
+        if not snap_name or not current_hash: return False
+        if hash_service.algorithm == CONTENT_HASH:
+            return snapshot_digest(file_path, snap_name) == current_hash
+        try:
+            if snapshot_size(file_path, snap_name) != os.path.getsize(file_path): return False
+        except OSError:
+            return False
+        return snapshot_digest(file_path, snap_name) == hash_service.hash_file(file_path, CONTENT_HASH)
+
+    def set_hash_algorithm(self, name):
+        if name not in HashService.algorithms(): name = CONTENT_HASH
+        if name == hash_service.algorithm: return
+        # hashes from another algorithm can not be compared, start over from the snapshots
+        hash_service.algorithm = name
+        self.change_cache = ChangeCache(hash_cache_path(name))
+        self.change_cache.load()
+        self.file_hashes.clear()
+
+    def current_hash(self, path):
+        return self.change_cache.get_hash(path, self.hash_file)
+
+    def seed_known_hashes(self):
+        # known files can be watched straight away, the baseline scan corrects anything stale
+        for path, entry in list(self.change_cache.entries.items()):
+            if self.is_path_tracked(path):
+                self.file_hashes[path] = entry[3]
+
+    # lists and hashes every tracked file once. returns the scanned files, or None when cancelled.
+    # the watcher is already live, so a hash is only filled in where none is known: a file whose known
+    # hash is off is left to check_file in finish_baseline, or a change still settling would be lost
+    def scan_baseline(self, cancelled=None, progress=None):
+        scanned = set()
+        self.stale_files = []
+        for p in list(self.tracked_paths):
+            if cancelled and cancelled(): return None
+            scanned.update(self.list_tracked_path(p))
+        total = len(scanned)
+        for i, (f, digest) in enumerate(hash_service.hash_many(scanned, self.current_hash, cancelled)):
+            if digest and self.file_hashes.setdefault(f, digest) != digest: self.stale_files.append(f)
+            if progress and i % BASELINE_BATCH == 0:
+                progress(i, total)
+        if cancelled and cancelled(): return None
+        return scanned
+
+    def finish_baseline(self, scanned):
+        for f in [f for f in list(self.file_hashes) if f not in scanned]:
+            if not os.path.exists(f) or not self.is_path_tracked(f) or self.is_path_ignored(f):
+                self.file_hashes.pop(f, None)
+        self.change_cache.prune(scanned)
+        self.change_cache.save()
+        self.check_files(self.stale_files)
+        self.stale_files = []
+
+# what `python -X importtime` says about importing a module, slowest first as (cumulative ms, self ms, name).
+# it runs in a fresh interpreter so the numbers are for a cold import, whatever this process has loaded already
+def import_time_report(module, cwd=None):
+    import subprocess
+    if getattr(sys, "frozen", False): return None
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=cwd, capture_output=True, text=True, timeout=120)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (.+)$", line)
+        if m: rows.append((int(m.group(2)) / 1000, int(m.group(1)) / 1000, m.group(3).strip()))
+    return sorted(rows, reverse=True)
+
+def format_startup_report(timings, imports, limit=40):
+    lines = [f"{k:>20}  {v:8.0f} ms" if isinstance(v, float) else f"{k:>20}  {v}" for k, v in timings.items()]
+    if lines: lines.append("")
+    if imports is None:
+        lines.append("import times are not available in the packaged app.")
+    elif imports:
+        lines.append(f"{'cumulative':>10}  {'self':>8}  module")
+        lines.extend(f"{total:8.1f} ms  {own:5.1f} ms  {name}" for total, own, name in imports[:limit])
+    return "\n".join(lines)